@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Benchmarks of pyviscalib against the simulated cameras
+
+  python benchmark.py [--quick] [--output results.json]
+  python benchmark.py --compare old.json new.json [--threshold 10]
+
+Every benchmark reports the rate in operations per second of wall
+clock time, which is the cost of the library itself, and the latency
+per operation. The end to end benchmarks run on the virtual time of the
+simulator and also report the simulated bus time per operation, which
+follows from baud rate and camera timing.
+"""
+
+import sys
+import time
+import json
+import platform
+import optparse
+
+from pyviscalib.visca import Visca
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+
+BAUDRATES=(9600,38400,115200)
+CAMERAS=(1,7)
+
+
+def percentile(values,q):
+	if not values:
+		return None
+	values=sorted(values)
+	return values[min(len(values)-1,int(q*len(values)))]
+
+def result(latencies,wall,sim=None,ops=None):
+	if ops is None:
+		ops=len(latencies)
+	entry={
+		'ops': ops,
+		'seconds': wall,
+		'rate': ops/wall if wall else None,
+		'p50': percentile(latencies,0.5),
+		'p90': percentile(latencies,0.9),
+		'max': max(latencies) if latencies else None,
+		}
+	if sim is not None:
+		entry['sim_per_op']=sim/ops if ops else None
+	return entry
+
+def micro(fn,count):
+	"""time count calls of fn, in batches so the clock is not measured"""
+	batch=100
+	latencies=[]
+	started=time.time()
+	for i in range(count//batch):
+		t=time.time()
+		for j in xrange(batch):
+			fn()
+		latencies.append((time.time()-t)/batch)
+	return result(latencies,time.time()-started,ops=len(latencies)*batch)
+
+def open_chain(cameras,baudrate,pipeline=False):
+	simulator=ViscaSimulator(cameras,virtual=True,baudrate=baudrate)
+	# a short read timeout, so close() does not wait long for the reader
+	visca=Visca(SimTransport(simulator,timeout=0.1),pipeline=pipeline,baudrate=baudrate)
+	return simulator,visca
+
+def timed(simulator,fn,count):
+	latencies=[]
+	started=time.time()
+	sim_started=simulator.time()
+	for i in xrange(count):
+		t=time.time()
+		fn(i)
+		latencies.append(time.time()-t)
+	return result(latencies,time.time()-started,simulator.time()-sim_started)
+
+
+def bench_micro(count):
+	# none of these touch the port, close it so the reader thread does
+	# not compete for the interpreter
+	simulator,visca=open_chain(1,9600)
+	template=visca.template(1,'cmd_ptd_abs')
+	visca.close()
+	return {
+		'micro.i2v': micro(lambda: visca.i2v(0x1234),count),
+		'micro.v2i': micro(lambda: visca.v2i('\x01\x02\x03\x04'),count),
+		'micro.make_packet': micro(lambda: visca.make_packet(1,'\x01\x06\x01\x10\x10\x01\x03'),count),
+		'micro.template_encode': micro(lambda: template.encode((0x14,0x18,-1000,300)),count),
+		'micro.parse_reply_packet': micro(lambda: visca.parse_reply_packet('\x90\x50\x00\x00\x01\x02\xff'),count),
+		}
+
+def bench_inquiries(cameras,baudrate,count):
+	simulator,visca=open_chain(cameras,baudrate)
+	try:
+		return timed(simulator,lambda i: visca.inq_cam_zoom_pos(i%cameras+1),count)
+	finally:
+		visca.close()
+
+def bench_joystick(cameras,baudrate,count):
+	# a stream of drive commands with changing speeds, as a joystick sends
+	simulator,visca=open_chain(cameras,baudrate)
+	try:
+		def drive(i):
+			speed=i%0x18+1
+			visca.cmd_ptd(i%cameras+1,speed,speed,1+i%2,3)
+		return timed(simulator,drive,count)
+	finally:
+		visca.close()
+
+def bench_recall_storm(cameras,baudrate,count):
+	# every camera recalls a preset at once, then all wait for completion
+	simulator,visca=open_chain(cameras,baudrate,pipeline=True)
+	try:
+		for camera in range(1,cameras+1):
+			visca.wait_for_cmd_completion(visca.cmd_ptd_abs(camera,pp=-500*camera%1440,tp=50*camera),30)
+			visca.wait_for_cmd_completion(visca.cmd_cam_memory_set(camera,1),30)
+			visca.wait_for_cmd_completion(visca.cmd_ptd_home(camera),30)
+		def storm(i):
+			handles=[visca.cmd_cam_memory_recall(camera,1-i%2) for camera in range(1,cameras+1)]
+			for handle in handles:
+				visca.wait_for_cmd_completion(handle,30)
+		return timed(simulator,storm,count)
+	finally:
+		visca.close()
+
+
+def run(quick=False):
+	scale=10 if quick else 1
+	results=bench_micro(100000//scale)
+	for baudrate in BAUDRATES:
+		for cameras in CAMERAS:
+			key='%d@%d' % (cameras,baudrate)
+			results['inquiry.'+key]=bench_inquiries(cameras,baudrate,2000//scale)
+			results['joystick.'+key]=bench_joystick(cameras,baudrate,2000//scale)
+		results['recall_storm.7@%d' % baudrate]=bench_recall_storm(7,baudrate,50//scale)
+	return {
+		'meta': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'quick': quick,
+			},
+		'results': results,
+		}
+
+
+def compare(old,new,threshold):
+	"""print the change of every rate, returns the regressed benchmarks"""
+	regressions=[]
+	print "%-32s %14s %14s %8s" % ('benchmark','old ops/s','new ops/s','change')
+	for name in sorted(set(old['results'])|set(new['results'])):
+		a=old['results'].get(name)
+		b=new['results'].get(name)
+		if not a or not b or not a['rate'] or not b['rate']:
+			print "%-32s %14s %14s" % (name,a and '%.1f' % a['rate'] or '-',b and '%.1f' % b['rate'] or '-')
+			continue
+		change=(b['rate']-a['rate'])*100.0/a['rate']
+		flag=''
+		if change<-threshold:
+			flag=' REGRESSION'
+			regressions.append(name)
+		print "%-32s %14.1f %14.1f %+7.1f%%%s" % (name,a['rate'],b['rate'],change,flag)
+	return regressions
+
+
+def main():
+	parser=optparse.OptionParser(usage="%prog [--quick] [--output FILE] | --compare OLD NEW")
+	parser.add_option('--quick',action='store_true',help="a tenth of the iterations")
+	parser.add_option('--output',metavar='FILE',help="write the results to FILE instead of stdout")
+	parser.add_option('--compare',action='store_true',help="compare two result files")
+	parser.add_option('--threshold',type='float',default=10.0,help="percent a rate may drop before it counts as a regression")
+	options,args=parser.parse_args()
+
+	if options.compare:
+		if len(args)!=2:
+			parser.error("--compare needs two result files")
+		old,new=[json.load(open(name)) for name in args]
+		if compare(old,new,options.threshold):
+			return 1
+		return 0
+
+	results=run(options.quick)
+	if options.output:
+		with open(options.output,'w') as f:
+			json.dump(results,f,indent=2,sort_keys=True)
+	else:
+		print json.dumps(results,indent=2,sort_keys=True)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
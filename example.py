@@ -36,26 +36,14 @@ def main():
 		v = Visca(sys.argv[1])
 	else:
 		v = Visca()
-	# Initializing the cameras from any state seems to be
-	# a complicated process. Try setting the address and clearing
-	# the interface a few times, sometimes one order works, sometimes
-	# the other order.
-	for i in range(3):
-		print 'example: Attempting to init camera, pass', i
-		ok = True
-		try:
-			v.cmd_adress_set()
-		except ViscaError:
-			ok = False
-		try:
-			v.cmd_if_clear_all()
-		except ViscaError:
-			ok = False
-		if ok: break
-	else:
-		print 'example: Failed to initialize cameras'
+	# address set and interface clear, repeated until the bus answers
+	print 'example: Attempting to init cameras'
+	try:
+		v.renumber()
+	except ViscaError as e:
+		print 'example: Failed to initialize cameras:', e
 		sys.exit(1)
-		
+
 	CAM=1
 
 	print 'Camera status:'
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""asyncio front-end for PyVisca
+
+AsyncVisca has the same methods as Visca, but everything that talks to
+the bus returns an asyncio future instead of blocking: await it (or
+``yield From(...)`` it with trollius). Replies are read from the
+port by the event loop, so one loop can drive many cameras and ports.
+"""
+
+import time
+
+try:
+	import asyncio
+except ImportError:
+	import trollius as asyncio
+
+from visca import Visca, ViscaError, ViscaTimeout
+from transport import open_transport
+
+
+class AsyncFuture(asyncio.Future):
+	"""
+	Future that ignores being finished twice, so a reply arriving for a
+	request the caller already cancelled does not upset the dispatcher.
+	"""
+
+	def set_result(self,value):
+		if not self.done():
+			asyncio.Future.set_result(self,value)
+
+	def set_exception(self,error):
+		if not self.done():
+			asyncio.Future.set_exception(self,error)
+
+
+class AsyncCommand(AsyncFuture):
+	"""
+	asyncio counterpart of ViscaCommand: created from the ACK, finished
+	with the completion packet or the error reported for the socket.
+	"""
+
+	def __init__(self,ack,loop):
+		AsyncFuture.__init__(self,loop=loop)
+		self.ack=ack
+		self.device=(ord(ack[0])&0b01110000)>>4
+		self.socket=ord(ack[1])&0b1111
+		self.packet=None
+		self.sent_at=None
+
+
+class AsyncVisca(Visca):
+
+	def __init__(self,portname="/dev/ttyUSB0",loop=None,**kwargs):
+		self.loop = loop or asyncio.get_event_loop()
+		Visca.__init__(self,portname,**kwargs)
+
+	def open_port(self):
+
+		if self.baudrate == 'auto':
+			raise ViscaError("AsyncVisca needs an explicit baudrate")
+
+		if (self.transport == None):
+			try:
+				self.transport = open_transport(self.portname,self.baudrate,timeout=0)
+				self.transport.flushInput()
+				self.framer.reset()
+			except Exception as e:
+				print ("Exception opening port '%s' for display: %s\n" % (self.portname,e))
+				raise e
+
+			self.running=True
+			# kept, the transport may be closed under us at EOF
+			self.fd=self.transport.fileno()
+			self.loop.add_reader(self.fd,self._data_ready)
+
+	def close(self):
+		self._shutdown(ViscaError('Port closed'))
+
+	def _shutdown(self,error):
+		if self.transport == None:
+			return
+		self.running=False
+		self.loop.remove_reader(self.fd)
+		self.transport.close()
+		self.transport=None
+		self._fail_all(error)
+
+	def _data_ready(self):
+		# the transport is non-blocking: take whatever is there
+		try:
+			data=self.transport.read(max(1,self.transport.inWaiting()))
+		except Exception as e:
+			print 'visca: reading the port failed: %s' % e
+			self._shutdown(ViscaError('Reading the port failed: %s' % e))
+			return
+		if not data:
+			# readable without visca data: the other end went away, or
+			# it was a VISCA over IP control message
+			if not self.transport.isOpen():
+				self._shutdown(ViscaError('Port closed by the other end'))
+			return
+		self.framer.feed(data)
+		while True:
+			packet=self.framer.get()
+			if packet is None:
+				break
+			self._received(packet)
+
+	def _new_future(self):
+		return AsyncFuture(loop=self.loop)
+
+	def _new_command(self,ack):
+		return AsyncCommand(ack,self.loop)
+
+	def _then(self,reply,fn):
+		chained=self._new_future()
+		def _chain(future):
+			if future.cancelled():
+				chained.cancel()
+			elif future.exception() is not None:
+				chained.set_exception(future.exception())
+			else:
+				try:
+					chained.set_result(fn(future.result()))
+				except Exception as e:
+					chained.set_exception(e)
+		reply.add_done_callback(_chain)
+		return chained
+
+	def _wait_reply(self,recipient,future):
+		"""
+		send_packet and send_template return the future for the first
+		reply (see Visca.submit_packet) instead of waiting for it. The
+		future fails with ViscaTimeout if nothing arrives within the
+		timeout of the retry_policy. Packets are not resent.
+		"""
+		timer=self.loop.call_later(self._packet_timeout(future,0),self._reply_timeout,recipient,future)
+		future.add_done_callback(lambda future: timer.cancel())
+		return future
+
+	def _reply_timeout(self,recipient,future):
+		if future.done():
+			return
+		timeout=self._packet_timeout(future,0)
+		if future.sent_at is None:
+			# still queued, by the scheduler or for a free socket
+			self.loop.call_later(timeout,self._reply_timeout,recipient,future)
+			return
+		remaining=future.sent_at+timeout-time.time()
+		if remaining>0:
+			self.loop.call_later(remaining,self._reply_timeout,recipient,future)
+			return
+		self._forget_pending(recipient,future)
+		print "ERROR: Timeout waiting for reply"
+		self.counters['timeouts']+=1
+		self.metrics.timeout(recipient,future.packet)
+		future.set_exception(ViscaTimeout("Timeout waiting for reply"))
+
+	def _call_later(self,delay,fn,*args):
+		self.loop.call_later(delay,fn,*args)
+
+	def renumber(self,timeout=10):
+		"""see Visca.renumber, returns a future for the mapping"""
+		return self._start_renumber()
+
+	def startup(self,topology_file=None,timeout=10):
+		raise ViscaError("AsyncVisca does not check a topology file, use renumber()")
+
+	def wait_for_cmd_completion(self,packet,timeout=-1):
+		"""
+		returns a future for the completion packet of a command, given
+		its AsyncCommand handle or ACK packet.
+		"""
+		if isinstance(packet,AsyncCommand):
+			handle=packet
+		else:
+			if not packet or len(packet) != 3 or (ord(packet[1])&0xf0) != 0x40:
+				raise ViscaError('wait_for_cmd_completion expects an ACK packet argument')
+			key=((ord(packet[0])&0b01110000)>>4,ord(packet[1])&0b1111)
+			handle=self.socket_in_use.get(key) or self.socket_completed.get(key)
+			if not handle:
+				raise ViscaError('No command outstanding for cam=%d socket=%d' % key)
+		key=(handle.device,handle.socket)
+
+		completion=self._new_future()
+		def _done(handle):
+			if self.socket_completed.get(key) is handle:
+				del self.socket_completed[key]
+			if handle.cancelled():
+				completion.cancel()
+			elif handle.exception() is not None:
+				completion.set_exception(handle.exception())
+			else:
+				completion.set_result(handle.result())
+		handle.add_done_callback(_done)
+		if timeout > 0:
+			timer=self.loop.call_later(timeout,completion.set_exception,ViscaError("Timeout waiting for command completion"))
+			completion.add_done_callback(lambda future: timer.cancel())
+		return completion
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Commands for many cameras at once"""
+
+import time
+import threading
+
+import commands
+from visca import ViscaError, ViscaTimeout
+
+PENDING='pending'
+DONE='done'
+FAILED='failed'
+TIMEOUT='timeout'
+
+
+class BatchResult():
+	"""
+	What became of one operation of a batch. status is PENDING, DONE,
+	FAILED (error holds the exception) or TIMEOUT. value is the
+	completion packet of a command, the decoded reply of an inquiry or
+	the packet that came back around the chain for a broadcast.
+	"""
+
+	def __init__(self,device,name):
+		self.device=device
+		self.name=name
+		self.status=PENDING
+		self.value=None
+		self.error=None
+		# seconds from the start of the batch
+		self.acked=None
+		self.finished=None
+
+	def ok(self):
+		return self.status==DONE
+
+	def __repr__(self):
+		return '<BatchResult cam=%d %s %s>' % (self.device,self.name,self.status)
+
+
+class ViscaBatch():
+	"""
+	A list of operations on several cameras, a "scene".
+
+	run() writes all of them back to back, without waiting for replies
+	in between, then collects ACKs, completions and inquiry replies as
+	they come in and returns once everything is finished or the
+	deadline has passed. Use a pipelining Visca for more than two
+	commands per camera.
+
+	add_broadcast() sends a command to all cameras in one packet with
+	the 0x88 header, for the commands the table marks as broadcast.
+
+	  scene=ViscaBatch(visca)
+	  for cam in (1,2,3):
+	      scene.add(cam,'cmd_cam_memory_recall',2)
+	  results=scene.run(timeout=5)
+	"""
+
+	def __init__(self,visca):
+		self.visca=visca
+		# (device, command, values)
+		self.operations=[]
+
+	def add(self,device,name,*values,**kwargs):
+		# the header has three bits for it, 9 would reach camera 1
+		if device not in range(1,8):
+			raise ViscaError("Camera addresses are 1 to 7, not %r" % (device,))
+		command=commands.BY_NAME[name]
+		# bound, defaulted and clamped like a call of the cmd_* method
+		self.operations.append((device,command,command.values(values,kwargs)))
+		return self
+
+	def add_broadcast(self,name,*values,**kwargs):
+		command=commands.BY_NAME[name]
+		if not command.broadcast:
+			raise ViscaError("%s can not be broadcast" % name)
+		self.operations.append((-1,command,command.values(values,kwargs)))
+		return self
+
+	def run(self,timeout=10.0):
+		"""
+		send every operation and wait at most timeout seconds. returns
+		{device: [BatchResult, ...]} in the order of the operations,
+		device -1 holding the broadcasts.
+		"""
+		visca=self.visca
+		cond=threading.Condition()
+		started=time.time()
+		results={}
+		remaining=[0]
+		entries=[]
+
+		def _finish(result,status,value=None,error=None):
+			with cond:
+				if result.status!=PENDING:
+					return
+				result.status=status
+				result.value=value
+				result.error=error
+				result.finished=time.time()-started
+				remaining[0]-=1
+				cond.notify_all()
+
+		for device,command,values in self.operations:
+			result=BatchResult(device,command.name)
+			results.setdefault(device,[]).append(result)
+			with cond:
+				remaining[0]+=1
+			try:
+				future=visca.submit_template(device,command.name,values,timeout,timeout)
+			except Exception as e:
+				_finish(result,FAILED,error=e)
+				continue
+			entries.append(result)
+			future.add_done_callback(lambda future,result=result,command=command: self._replied(future,result,command,started,_finish))
+
+		end=started+timeout
+		with cond:
+			while remaining[0]>0:
+				left=end-time.time()
+				if left<=0:
+					break
+				cond.wait(left)
+
+		# what is still under way is given up by the Visca when its
+		# deadline passes, about now
+		for result in entries:
+			_finish(result,TIMEOUT)
+		return results
+
+	def _failed(self,result,error,finish):
+		if isinstance(error,ViscaTimeout):
+			finish(result,TIMEOUT)
+		else:
+			finish(result,FAILED,error=error)
+
+	def _replied(self,future,result,command,started,finish):
+		error=future.exception()
+		if error is not None:
+			self._failed(result,error,finish)
+			return
+		reply=future.result()
+		if hasattr(reply,'ack'):
+			result.acked=time.time()-started
+			def _completed(handle):
+				error=handle.exception()
+				if error is not None:
+					self._failed(result,error,finish)
+				else:
+					finish(result,DONE,handle.result())
+			reply.add_done_callback(_completed)
+		elif command.reply:
+			try:
+				finish(result,DONE,command.decode(reply))
+			except Exception as e:
+				finish(result,FAILED,error=e)
+		else:
+			finish(result,DONE,reply)
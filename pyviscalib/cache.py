@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Cache for inquiry replies"""
+
+import time
+import threading
+
+FOREVER=None
+
+class ViscaCache():
+	"""
+	Keeps inquiry replies per camera for a while, so repeated inquiries
+	don't go over the bus.
+
+	TTL maps the inquiry (the packet without header and terminator) to
+	the number of seconds a reply stays valid, FOREVER for facts that
+	don't change. Inquiries not in the table are not cached.
+
+	Commands invalidate the inquiries listed for them in INVALIDATES,
+	when they are sent and again when they complete, so e.g. the pan
+	tilt position is fetched fresh after any pan tilt drive command.
+
+	Install it with Visca(..., cache=ViscaCache()).
+	"""
+
+	TTL={
+		'\x09\x00\x02': FOREVER,	# version
+		'\x09\x04\x22': FOREVER,	# camera ID
+		'\x09\x06\x23': FOREVER,	# video system
+		'\x09\x04\x00': 1.0,		# power
+		'\x09\x04\x47': 0.2,		# zoom position
+		'\x09\x06\x12': 0.2,		# pan/tilt position
+		}
+
+	# command prefix -> inquiries it invalidates
+	INVALIDATES=(
+		('\x01\x04\x00', ('\x09\x04\x00','\x09\x04\x47','\x09\x06\x12')),	# power
+		('\x01\x04\x07', ('\x09\x04\x47',)),	# zoom
+		('\x01\x04\x47', ('\x09\x04\x47',)),	# zoom direct
+		('\x01\x04\x06', ('\x09\x04\x47',)),	# digital zoom
+		('\x01\x04\x3f', ('\x09\x04\x47','\x09\x06\x12')),	# memory
+		('\x01\x06\x01', ('\x09\x06\x12',)),	# pan tilt drive
+		('\x01\x06\x02', ('\x09\x06\x12',)),	# absolute position
+		('\x01\x06\x04', ('\x09\x06\x12',)),	# home
+		('\x01\x06\x05', ('\x09\x06\x12',)),	# reset
+		)
+
+	def __init__(self,ttl=None):
+		self.ttl=dict(self.TTL)
+		if ttl:
+			self.ttl.update(ttl)
+		self.mutex=threading.Lock()
+		# (camera, inquiry) -> (reply, expires)
+		self.entries={}
+		# (camera, inquiry) -> invalidation count, to drop replies that
+		# were under way while a command invalidated them
+		self.generation={}
+		self.hits=0
+		self.misses=0
+
+	def get(self,camera,inquiry):
+		"""the cached reply, or None"""
+		if inquiry not in self.ttl:
+			return None
+		with self.mutex:
+			entry=self.entries.get((camera,inquiry))
+			if entry and (entry[1] is None or entry[1]>time.time()):
+				self.hits+=1
+				return entry[0]
+			self.misses+=1
+		return None
+
+	def watch_inquiry(self,camera,inquiry,future):
+		"""store the reply future will get"""
+		if inquiry not in self.ttl:
+			return
+		key=(camera,inquiry)
+		with self.mutex:
+			generation=self.generation.setdefault(key,0)
+		def _store(future):
+			try:
+				reply=future.result()
+			except Exception:
+				return
+			if reply is None:
+				return
+			ttl=self.ttl[inquiry]
+			with self.mutex:
+				if self.generation[key]!=generation:
+					return
+				if ttl is FOREVER:
+					self.entries[key]=(reply,None)
+				else:
+					self.entries[key]=(reply,time.time()+ttl)
+		future.add_done_callback(_store)
+
+	def watch_command(self,camera,command,future):
+		"""
+		invalidate what command affects now, and again when it
+		completes. future is the one for the ACK of the command.
+		"""
+		inquiries=self.affected(command)
+		if not inquiries:
+			return
+		self.invalidate(camera,inquiries)
+		def _completed(handle):
+			self.invalidate(camera,inquiries)
+		def _acked(future):
+			try:
+				handle=future.result()
+			except Exception:
+				return
+			if handle is not None and hasattr(handle,'ack'):
+				handle.add_done_callback(_completed)
+		future.add_done_callback(_acked)
+
+	def affected(self,command):
+		for prefix,inquiries in self.INVALIDATES:
+			if command.startswith(prefix):
+				return inquiries
+		return ()
+
+	def invalidate(self,camera,inquiries=None):
+		"""
+		forget the given inquiries (all of them if None) for camera, -1
+		meaning every camera
+		"""
+		with self.mutex:
+			for key in self.entries.keys():
+				if camera!=-1 and key[0]!=camera:
+					continue
+				if inquiries is not None and key[1] not in inquiries:
+					continue
+				self.entries.pop(key,None)
+			if camera!=-1 and inquiries is not None:
+				for inquiry in inquiries:
+					key=(camera,inquiry)
+					self.generation[key]=self.generation.get(key,0)+1
+			else:
+				for key in self.generation:
+					if camera==-1 or key[0]==camera:
+						self.generation[key]+=1
+
+	def remap(self,mapping):
+		"""
+		move the entries to the new addresses of their cameras after the
+		bus was renumbered, mapping is {old: new or None}. Entries of
+		cameras not in mapping are dropped.
+		"""
+		with self.mutex:
+			entries={}
+			for (camera,inquiry),entry in self.entries.items():
+				if mapping.get(camera) is not None:
+					entries[(mapping[camera],inquiry)]=entry
+			self.entries=entries
+			# replies under way are for the old addresses
+			for key in self.generation:
+				self.generation[key]+=1
+
+	def clear(self):
+		self.invalidate(-1)
@@ -0,0 +1,379 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""The visca command set as a table
+
+Every entry describes one cmd_* or inq_* method of Visca: the packet
+data with its parameters zeroed, where and how the parameters go into
+it and, for inquiries, how the reply is decoded. install() generates
+the methods from the table when visca is imported; the same entries
+drive the packet templates, the debug dump and the simulator.
+"""
+
+# parameter and reply field encodings
+BYTE=1		# the whole byte
+NIBBLE=2	# low nibble, the high nibble is part of the opcode
+WORD=3		# 16 bit value spread over the low nibbles of 4 bytes
+SWORD=4		# WORD, signed (replies only)
+RAW=5		# the bytes up to the terminator (replies only)
+
+# bytes taken by a field of each encoding, at least
+SIZES={BYTE: 1, NIBBLE: 1, WORD: 4, SWORD: 4, RAW: 0}
+
+
+class Param():
+	"""
+	A parameter of a command: its name in the generated method, the
+	offset in the packet data, the encoding, a default value and the
+	range values are clamped to (None for no limit).
+	"""
+
+	def __init__(self,name,offset,encoding,default=None,lo=None,hi=None):
+		self.name=name
+		self.offset=offset
+		self.encoding=encoding
+		self.default=default
+		self.lo=lo
+		self.hi=hi
+
+
+class Command():
+	"""
+	One entry of the table. name is the Visca method, data the packet
+	without header and terminator, reply the (offset, encoding) fields
+	of an inquiry reply. broadcast marks commands that can be sent to
+	all cameras at once.
+	"""
+
+	def __init__(self,name,data,params=(),reply=None,broadcast=False,doc=None):
+		self.name=name
+		self.data=data
+		self.params=params
+		self.names=frozenset(param.name for param in params)
+		self.reply=reply
+		# shortest reply packet the fields fit in, with the terminator
+		self.reply_length=0
+		for offset,encoding in reply or ():
+			self.reply_length=max(self.reply_length,offset+SIZES[encoding]+1)
+		self.broadcast=broadcast
+		self.doc=doc
+
+	def inquiry(self):
+		return self.data[:1]=='\x09'
+
+	def fields(self):
+		return tuple((param.offset,param.encoding) for param in self.params)
+
+	def prefix(self):
+		"""the fixed bytes before the first parameter"""
+		if not self.params:
+			return self.data
+		return self.data[:min(param.offset for param in self.params)]
+
+	def values(self,args=(),kwargs=None):
+		"""
+		the parameter values for a call of the generated method, args in
+		parameter order and kwargs by name (args may be a dict by name
+		instead), with the defaults filled in and clamped to the ranges.
+		Raises TypeError for parameters missing, unknown or given twice.
+		"""
+		if isinstance(args,dict):
+			args,kwargs=(),args
+		if len(args)>len(self.params):
+			raise TypeError("%s() takes at most %d parameters (%d given)" % (self.name,len(self.params),len(args)))
+		bound=dict(zip([param.name for param in self.params],args))
+		for name in kwargs or ():
+			if name in bound:
+				raise TypeError("%s() got multiple values for parameter '%s'" % (self.name,name))
+			if name not in self.names:
+				raise TypeError("%s() got an unexpected parameter '%s'" % (self.name,name))
+			bound[name]=kwargs[name]
+		values=[]
+		for param in self.params:
+			value=bound.get(param.name)
+			if value is None:
+				value=param.default
+				if value is None:
+					raise TypeError("%s() needs parameter '%s'" % (self.name,param.name))
+			if param.lo is not None:
+				value=min(max(value,param.lo),param.hi)
+			values.append(int(value))
+		return tuple(values)
+
+	def decode(self,reply):
+		if len(reply)<self.reply_length:
+			# imported here, visca imports this module
+			from visca import ViscaError
+			raise ViscaError("Reply %s too short for %s" % (reply.encode('hex'),self.name))
+		values=[]
+		for offset,encoding in self.reply:
+			if encoding==BYTE:
+				values.append(ord(reply[offset]))
+			elif encoding==RAW:
+				values.append(reply[offset:-1])
+			else:
+				value=((ord(reply[offset])&0x0f)<<12)|((ord(reply[offset+1])&0x0f)<<8)|((ord(reply[offset+2])&0x0f)<<4)|(ord(reply[offset+3])&0x0f)
+				if encoding==SWORD and value&0x8000:
+					value-=0x10000
+				values.append(value)
+		if len(values)==1:
+			return values[0]
+		return tuple(values)
+
+	def __repr__(self):
+		return '<Command %s %s>' % (self.name,self.data.encode('hex'))
+
+
+C=Command
+P=Param
+
+def _ts(offset):
+	return P('ts',offset,BYTE,0x14,0x01,0x17)
+
+def _ps(offset):
+	return P('ps',offset,BYTE,0x18,0x01,0x18)
+
+def _direct(name,opcode,doc=None):
+	# "direct" settings: 0x00 0x00 0x0p 0x0q
+	return C(name,'\x01\x04'+opcode+'\x00\x00\x00\x00',(P('value',3,WORD,None,0,0xff),),doc=doc)
+
+def _updown(name,opcode):
+	return (C(name+'_reset','\x01\x04'+opcode+'\x00'),
+		C(name+'_up','\x01\x04'+opcode+'\x02'),
+		C(name+'_down','\x01\x04'+opcode+'\x03'))
+
+COMMANDS=(
+	# power
+	C('cmd_cam_power_on','\x01\x04\x00\x02',broadcast=True),
+	C('cmd_cam_power_off','\x01\x04\x00\x03',broadcast=True),
+	C('cmd_cam_auto_power_off','\x01\x04\x40\x00\x00\x00\x00',(P('time',3,WORD,0,0,0xffff),),doc="""
+		time = minutes without command until standby
+		0: disable
+		0xffff: 65535 minutes
+		"""),
+
+	# zoom
+	C('cmd_cam_zoom_stop','\x01\x04\x07\x00',broadcast=True),
+	C('cmd_cam_zoom_tele','\x01\x04\x07\x02'),
+	C('cmd_cam_zoom_wide','\x01\x04\x07\x03'),
+	C('cmd_cam_zoom_tele_speed','\x01\x04\x07\x20',(P('speed',3,NIBBLE,None,0,7),),doc="""
+		zoom in with speed = 0..7
+		"""),
+	C('cmd_cam_zoom_wide_speed','\x01\x04\x07\x30',(P('speed',3,NIBBLE,None,0,7),),doc="""
+		zoom out with speed = 0..7
+		"""),
+	C('cmd_cam_zoom_direct','\x01\x04\x47\x00\x00\x00\x00',(P('zoom',3,WORD),),broadcast=True,doc="""
+		zoom to value
+		optical: 0..4000
+		digital: 4000..7000 (1x - 4x)
+		"""),
+	C('cmd_cam_dzoom_on','\x01\x04\x06\x02'),
+	C('cmd_cam_dzoom_off','\x01\x04\x06\x03'),
+
+	# focus
+	C('cmd_cam_focus_stop','\x01\x04\x08\x00'),
+	C('cmd_cam_focus_far','\x01\x04\x08\x02'),
+	C('cmd_cam_focus_near','\x01\x04\x08\x03'),
+	C('cmd_cam_focus_far_speed','\x01\x04\x08\x20',(P('speed',3,NIBBLE,None,0,7),)),
+	C('cmd_cam_focus_near_speed','\x01\x04\x08\x30',(P('speed',3,NIBBLE,None,0,7),)),
+	C('cmd_cam_focus_direct','\x01\x04\x48\x00\x00\x00\x00',(P('focus',3,WORD,None,0x1000,0x9fff),)),
+	C('cmd_cam_focus_auto','\x01\x04\x38\x02'),
+	C('cmd_cam_focus_manual','\x01\x04\x38\x03'),
+	C('cmd_cam_focus_auto_toggle','\x01\x04\x38\x10'),
+	C('cmd_cam_focus_one_push','\x01\x04\x18\x01'),
+	C('cmd_cam_focus_infinity','\x01\x04\x18\x02'),
+
+	# white balance
+	C('cmd_cam_wb_auto','\x01\x04\x35\x00'),
+	C('cmd_cam_wb_indoor','\x01\x04\x35\x01'),
+	C('cmd_cam_wb_outdoor','\x01\x04\x35\x02'),
+	C('cmd_cam_wb_one_push','\x01\x04\x35\x03'),
+	C('cmd_cam_wb_atw','\x01\x04\x35\x04'),
+	C('cmd_cam_wb_manual','\x01\x04\x35\x05'),
+	C('cmd_cam_wb_one_push_trigger','\x01\x04\x10\x05'),
+	)+_updown('cmd_cam_rgain','\x03')+(
+	_direct('cmd_cam_rgain_direct','\x43'),
+	)+_updown('cmd_cam_bgain','\x04')+(
+	_direct('cmd_cam_bgain_direct','\x44'),
+
+	# automatic exposure
+	C('cmd_cam_ae_full_auto','\x01\x04\x39\x00'),
+	C('cmd_cam_ae_manual','\x01\x04\x39\x03'),
+	C('cmd_cam_ae_shutter_priority','\x01\x04\x39\x0a'),
+	C('cmd_cam_ae_iris_priority','\x01\x04\x39\x0b'),
+	C('cmd_cam_ae_bright','\x01\x04\x39\x0d'),
+	C('cmd_cam_slow_shutter_auto','\x01\x04\x5a\x02'),
+	C('cmd_cam_slow_shutter_manual','\x01\x04\x5a\x03'),
+	)+_updown('cmd_cam_shutter','\x0a')+(
+	_direct('cmd_cam_shutter_direct','\x4a'),
+	)+_updown('cmd_cam_iris','\x0b')+(
+	_direct('cmd_cam_iris_direct','\x4b'),
+	)+_updown('cmd_cam_gain','\x0c')+(
+	_direct('cmd_cam_gain_direct','\x4c'),
+	)+_updown('cmd_cam_bright','\x0d')+(
+	_direct('cmd_cam_bright_direct','\x4d'),
+	C('cmd_cam_expcomp_on','\x01\x04\x3e\x02'),
+	C('cmd_cam_expcomp_off','\x01\x04\x3e\x03'),
+	)+_updown('cmd_cam_expcomp','\x0e')+(
+	_direct('cmd_cam_expcomp_direct','\x4e'),
+	C('cmd_cam_backlight_on','\x01\x04\x33\x02'),
+	C('cmd_cam_backlight_off','\x01\x04\x33\x03'),
+	)+_updown('cmd_cam_aperture','\x02')+(
+	_direct('cmd_cam_aperture_direct','\x42'),
+
+	# 16:9 / wide format
+	C('cmd_cam_wide','\x01\x04\x60\x00',(P('mode',3,BYTE),)),
+	C('cmd_cam_wide_off','\x01\x04\x60\x00'),
+	C('cmd_cam_wide_cinema','\x01\x04\x60\x01'),
+	C('cmd_cam_wide_full','\x01\x04\x60\x02'),
+
+	# mirror
+	C('cmd_cam_lr_reverse','\x01\x04\x61\x00',(P('mode',3,BYTE),)),
+	C('cmd_cam_lr_reverse_on','\x01\x04\x61\x02'),
+	C('cmd_cam_lr_reverse_off','\x01\x04\x61\x03'),
+
+	# freeze
+	C('cmd_cam_freeze','\x01\x04\x62\x00',(P('mode',3,BYTE),)),
+	C('cmd_cam_freeze_on','\x01\x04\x62\x02',broadcast=True),
+	C('cmd_cam_freeze_off','\x01\x04\x62\x03',broadcast=True),
+
+	# picture effects
+	C('cmd_cam_picture_effect','\x01\x04\x63\x00',(P('mode',3,BYTE),)),
+	C('cmd_cam_picture_effect_off','\x01\x04\x63\x00'),
+	C('cmd_cam_picture_effect_pastel','\x01\x04\x63\x01'),
+	C('cmd_cam_picture_effect_negart','\x01\x04\x63\x02'),
+	C('cmd_cam_picture_effect_sepa','\x01\x04\x63\x03'),
+	C('cmd_cam_picture_effect_bw','\x01\x04\x63\x04'),
+	C('cmd_cam_picture_effect_solarize','\x01\x04\x63\x05'),
+	C('cmd_cam_picture_effect_mosaic','\x01\x04\x63\x06'),
+	C('cmd_cam_picture_effect_slim','\x01\x04\x63\x07'),
+	C('cmd_cam_picture_effect_stretch','\x01\x04\x63\x08'),
+
+	# digital effects
+	C('cmd_cam_digital_effect','\x01\x04\x64\x00',(P('mode',3,BYTE),)),
+	C('cmd_cam_digital_effect_off','\x01\x04\x64\x00'),
+	C('cmd_cam_digital_effect_still','\x01\x04\x64\x01'),
+	C('cmd_cam_digital_effect_flash','\x01\x04\x64\x02'),
+	C('cmd_cam_digital_effect_lumi','\x01\x04\x64\x03'),
+	C('cmd_cam_digital_effect_trail','\x01\x04\x64\x04'),
+	C('cmd_cam_digital_effect_level','\x01\x04\x65\x00',(P('level',3,BYTE,None,0,0x3f),)),
+
+	# memory of settings including position
+	# FIXME: can only be executed when motion has stopped!!!
+	C('cmd_cam_memory_reset','\x01\x04\x3f\x00\x00',(P('num',4,BYTE,None,0,5),)),
+	C('cmd_cam_memory_set','\x01\x04\x3f\x01\x00',(P('num',4,BYTE,None,0,5),)),
+	C('cmd_cam_memory_recall','\x01\x04\x3f\x02\x00',(P('num',4,BYTE,None,0,5),),broadcast=True),
+
+	# datascreen
+	C('cmd_datascreen','\x01\x06\x06\x00',(P('func',3,BYTE),)),
+	C('cmd_datascreen_on','\x01\x06\x06\x02'),
+	C('cmd_datascreen_off','\x01\x06\x06\x03'),
+	C('cmd_datascreen_toggle','\x01\x06\x06\x10'),
+
+	# pan and tilt drive
+	C('cmd_ptd','\x01\x06\x01\x00\x00\x00\x00',(P('ps',3,BYTE),P('ts',4,BYTE),P('lr',5,BYTE),P('ud',6,BYTE))),
+	C('cmd_ptd_up','\x01\x06\x01\x00\x00\x03\x01',(_ts(4),)),
+	C('cmd_ptd_down','\x01\x06\x01\x00\x00\x03\x02',(_ts(4),)),
+	C('cmd_ptd_left','\x01\x06\x01\x00\x00\x01\x03',(_ps(3),)),
+	C('cmd_ptd_right','\x01\x06\x01\x00\x00\x02\x03',(_ps(3),)),
+	C('cmd_ptd_upleft','\x01\x06\x01\x00\x00\x01\x01',(_ts(4),_ps(3))),
+	C('cmd_ptd_upright','\x01\x06\x01\x00\x00\x02\x01',(_ts(4),_ps(3))),
+	C('cmd_ptd_downleft','\x01\x06\x01\x00\x00\x01\x02',(_ts(4),_ps(3))),
+	C('cmd_ptd_downright','\x01\x06\x01\x00\x00\x02\x02',(_ts(4),_ps(3))),
+	C('cmd_ptd_stop','\x01\x06\x01\x00\x00\x03\x03',broadcast=True),
+	C('cmd_ptd_abs','\x01\x06\x02\x00\x00'+'\x00'*8,(_ts(3),_ps(4),P('pp',5,WORD,0),P('tp',9,WORD,0)),broadcast=True,doc="""
+		move to an absolute position
+		pp: range: -1440 - 1440
+		tp: range -360 - 360
+		negative positions are sent as 16 bit two's complement
+		"""),
+	C('cmd_ptd_home','\x01\x06\x04',broadcast=True),
+	C('cmd_ptd_reset','\x01\x06\x05'),
+
+	# inquiries
+	C('inq_cam_power','\x09\x04\x00',reply=((2,BYTE),)),
+	C('inq_cam_zoom_pos','\x09\x04\x47',reply=((2,WORD),)),
+	C('inq_cam_version','\x09\x00\x02',reply=((2,RAW),)),
+	C('inq_cam_id','\x09\x04\x22',reply=((2,WORD),)),
+	C('inq_cam_videosystem','\x09\x06\x23',reply=((2,BYTE),)),
+	C('inq_cam_pan_tilt_pos','\x09\x06\x12',reply=((2,SWORD),(6,SWORD))),
+	C('inq_cam_dzoom_mode','\x09\x04\x06',reply=((2,BYTE),)),
+	C('inq_cam_focus_mode','\x09\x04\x38',reply=((2,BYTE),)),
+	C('inq_cam_focus_pos','\x09\x04\x48',reply=((2,WORD),)),
+	C('inq_cam_wb_mode','\x09\x04\x35',reply=((2,BYTE),)),
+	C('inq_cam_rgain','\x09\x04\x43',reply=((2,WORD),)),
+	C('inq_cam_bgain','\x09\x04\x44',reply=((2,WORD),)),
+	C('inq_cam_ae_mode','\x09\x04\x39',reply=((2,BYTE),)),
+	C('inq_cam_slow_shutter_mode','\x09\x04\x5a',reply=((2,BYTE),)),
+	C('inq_cam_shutter_pos','\x09\x04\x4a',reply=((2,WORD),)),
+	C('inq_cam_iris_pos','\x09\x04\x4b',reply=((2,WORD),)),
+	C('inq_cam_gain_pos','\x09\x04\x4c',reply=((2,WORD),)),
+	C('inq_cam_bright_pos','\x09\x04\x4d',reply=((2,WORD),)),
+	C('inq_cam_expcomp_mode','\x09\x04\x3e',reply=((2,BYTE),)),
+	C('inq_cam_expcomp_pos','\x09\x04\x4e',reply=((2,WORD),)),
+	C('inq_cam_backlight_mode','\x09\x04\x33',reply=((2,BYTE),)),
+	C('inq_cam_aperture','\x09\x04\x42',reply=((2,WORD),)),
+	)
+
+BY_NAME=dict((command.name,command) for command in COMMANDS)
+
+# fixed prefix -> commands, for finding the command a packet carries
+_BY_PREFIX={}
+for _command in COMMANDS:
+	_BY_PREFIX.setdefault(_command.prefix(),[]).append(_command)
+_PREFIX_LENGTHS=sorted(set(len(prefix) for prefix in _BY_PREFIX),reverse=True)
+del _command
+
+def lookup(data):
+	"""
+	the Command for packet data (without header and terminator), or
+	None. Fixed variants win over their parameterized form, e.g.
+	cmd_cam_wide_off over cmd_cam_wide.
+	"""
+	for length in _PREFIX_LENGTHS:
+		if length>len(data):
+			continue
+		for command in _BY_PREFIX.get(data[:length],()):
+			if len(command.data)==len(data):
+				return command
+	return None
+
+
+def _method(command):
+	name=command.name
+	if command.reply:
+		decode=command.decode
+		def method(self,device,*args,**kwargs):
+			values=command.values(args,kwargs)
+			return self._then(self.send_template(device,name,*values),decode)
+	else:
+		def method(self,device,*args,**kwargs):
+			values=command.values(args,kwargs)
+			return self.send_template(device,name,*values)
+	method.__name__=name
+	method.__doc__=command.doc
+	return method
+
+def install(cls):
+	"""add a method for every table entry that cls doesn't define itself"""
+	for command in COMMANDS:
+		if command.name in cls.__dict__:
+			continue
+		setattr(cls,command.name,_method(command))
@@ -0,0 +1,310 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Many ports with camera chains, read by a single thread"""
+
+import os
+import time
+import select
+import threading
+from functools import partial
+
+import commands
+import metrics
+from visca import Visca, ViscaError
+
+
+class ViscaCamera():
+	"""
+	One camera of a ViscaController. Has the cmd_* and inq_* methods of
+	the command table, without the device argument:
+
+	  controller.camera('studioA/3').cmd_ptd_abs(pp=100,tp=20)
+	"""
+
+	def __init__(self,visca,device,path):
+		self.visca=visca
+		self.device=device
+		self.path=path
+
+	def __getattr__(self,name):
+		if name not in commands.BY_NAME:
+			raise AttributeError(name)
+		return partial(getattr(self.visca,name),self.device)
+
+	def __repr__(self):
+		return '<ViscaCamera %s>' % self.path
+
+
+class ViscaController():
+	"""
+	Owns any number of ports, each with its own Visca: its own queues,
+	pipelining, cache and metrics. Their replies are read by one thread
+	waiting on all ports with epoll (poll where there is no epoll),
+	instead of a reader thread per port. The timers of the ports (the
+	timeouts of renumbering) run on the same thread. Ports without a
+	file descriptor, like the in memory simulator, get a reader thread
+	of their own.
+
+	Cameras are named "port/address", e.g. "studioA/3".
+
+	A port that fails (the adapter was unplugged, the connection
+	dropped) is closed and its error kept in faults, requests waiting
+	on it fail. The other ports are not affected. reopen() tries again.
+	"""
+
+	def __init__(self):
+		self.mutex=threading.Lock()
+		# name -> Visca
+		self.ports={}
+		# name -> (portname, keyword arguments), for reopen
+		self.configs={}
+		# name -> the error that took the port down
+		self.faults={}
+		# file descriptor -> name
+		self.fds={}
+		if hasattr(select,'epoll'):
+			self.poller=select.epoll()
+			self.timescale=1.0
+			self.readable=select.EPOLLIN
+			self.failed=select.EPOLLERR|select.EPOLLHUP
+		else:
+			self.poller=select.poll()
+			self.timescale=1000.0
+			self.readable=select.POLLIN
+			self.failed=select.POLLERR|select.POLLHUP|select.POLLNVAL
+		# written to wake the loop up
+		self.wakeup=os.pipe()
+		self.poller.register(self.wakeup[0],self.readable)
+		self.running=False
+		self.thread=None
+
+	def start(self):
+		self.running=True
+		self.thread=threading.Thread(target=self._run,name='visca-controller')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running=False
+		self._wake()
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread=None
+
+	def close(self):
+		"""stop the loop and close every port"""
+		self.stop()
+		for name in list(self.ports):
+			self.remove_port(name)
+		if hasattr(self.poller,'close'):
+			self.poller.close()
+		os.close(self.wakeup[0])
+		os.close(self.wakeup[1])
+
+	def add_port(self,name,portname,**kwargs):
+		"""
+		open portname as name, the keyword arguments go to Visca.
+		The port is read from the loop before anything is sent, so
+		baudrate='auto' works. lazy is not supported, ports are opened
+		here. returns the Visca.
+		"""
+		if '/' in name:
+			raise ValueError("Port names can not contain '/'")
+		if kwargs.get('lazy'):
+			raise ViscaError("Ports of a ViscaController are opened by add_port, lazy is not supported")
+		with self.mutex:
+			if name in self.ports:
+				raise ViscaError("Port %s exists already" % name)
+		# opened in steps, detecting the rate needs the replies read
+		visca=Visca(portname,**dict(kwargs,threaded=False,lazy=True))
+		visca.lazy=False
+		visca.open_port()
+		try:
+			fd=visca.transport.fileno()
+		except Exception:
+			fd=None
+		with self.mutex:
+			self.ports[name]=visca
+			self.configs[name]=(portname,kwargs)
+			self.faults.pop(name,None)
+			if fd is not None:
+				self.fds[fd]=name
+		if fd is None:
+			visca.start_reader()
+		else:
+			visca.timer_added=self._wake
+			self.poller.register(fd,self.readable)
+		if visca.baudrate=='auto':
+			try:
+				visca.detect_baudrate()
+			except Exception:
+				with self.mutex:
+					self.ports.pop(name,None)
+					self.configs.pop(name,None)
+					self._forget_fd(name)
+				visca.close()
+				raise
+		return visca
+
+	def remove_port(self,name):
+		with self.mutex:
+			visca=self.ports.pop(name,None)
+			self.configs.pop(name,None)
+			self.faults.pop(name,None)
+			self._forget_fd(name)
+		if visca:
+			visca.close()
+
+	def _forget_fd(self,name):
+		# called with the mutex held
+		for fd,port in self.fds.items():
+			if port==name:
+				del self.fds[fd]
+				try:
+					self.poller.unregister(fd)
+				except (IOError,OSError,ValueError):
+					pass
+				return fd
+		return None
+
+	def reopen(self,name):
+		"""open a failed port again, returns the new Visca"""
+		with self.mutex:
+			portname,kwargs=self.configs[name]
+			visca=self.ports.pop(name,None)
+			self._forget_fd(name)
+		if visca:
+			visca.close()
+		return self.add_port(name,portname,**kwargs)
+
+	def port(self,name):
+		"""the Visca of port name"""
+		return self.ports[name]
+
+	def resolve(self,path):
+		"""(Visca, address) for "port/address\""""
+		name,_,address=path.rpartition('/')
+		if not name or not address.isdigit():
+			raise ValueError("Cameras are named port/address, not '%s'" % path)
+		visca=self.ports.get(name)
+		if visca is None:
+			raise ViscaError("No port %s" % name)
+		if name in self.faults:
+			raise ViscaError("Port %s failed: %s" % (name,self.faults[name]))
+		return visca,int(address)
+
+	def camera(self,path):
+		visca,address=self.resolve(path)
+		return ViscaCamera(visca,address,path)
+
+	def cameras(self):
+		"""the names of all cameras found by renumbering, of working ports"""
+		names=[]
+		for name in sorted(self.ports):
+			visca=self.ports[name]
+			if name in self.faults or not visca.devices:
+				continue
+			names.extend('%s/%d' % (name,address) for address in range(1,visca.devices+1))
+		return names
+
+	def renumber(self,timeout=10):
+		"""
+		renumber every working port, all at once. returns {port: mapping},
+		ports that failed get the exception instead.
+		"""
+		started=[]
+		for name,visca in sorted(self.ports.items()):
+			if name not in self.faults:
+				started.append((name,visca._start_renumber()))
+		results={}
+		for name,future in started:
+			try:
+				results[name]=future.result(timeout)
+			except ViscaError as e:
+				results[name]=e
+		return results
+
+	def snapshot(self):
+		"""the metric snapshots of all ports, with a port entry each"""
+		snapshots=[]
+		for name,visca in sorted(self.ports.items()):
+			for snapshot in visca.metrics.snapshot():
+				snapshot['port']=name
+				snapshots.append(snapshot)
+		return snapshots
+
+	def prometheus(self,prefix='visca'):
+		return metrics.prometheus(self.snapshot(),prefix)
+
+	# the loop
+
+	def _wake(self):
+		os.write(self.wakeup[1],'x')
+
+	def _timeout(self):
+		# until the next timer of a port we read, at most a second
+		timeout=1.0
+		now=time.time()
+		for name in list(self.fds.values()):
+			visca=self.ports.get(name)
+			deadline=visca and visca.next_timer()
+			if deadline is not None:
+				timeout=min(timeout,max(0,deadline-now))
+		return timeout
+
+	def _run(self):
+		while self.running:
+			try:
+				events=self.poller.poll(self._timeout()*self.timescale)
+			except (IOError,OSError,select.error) as e:
+				if e.args and e.args[0]==4:
+					# EINTR
+					continue
+				raise
+			for fd,event in events:
+				if fd==self.wakeup[0]:
+					os.read(fd,512)
+					continue
+				name=self.fds.get(fd)
+				visca=self.ports.get(name)
+				if visca is None:
+					continue
+				try:
+					if event&self.readable:
+						visca.feed()
+					elif event&self.failed:
+						raise ViscaError("Port reports an error")
+				except Exception as e:
+					self._fault(name,e)
+			for name in list(self.fds.values()):
+				visca=self.ports.get(name)
+				if visca is not None:
+					visca.run_timers()
+
+	def _fault(self,name,error):
+		print "visca: port %s failed: %s" % (name,error)
+		with self.mutex:
+			self.faults[name]=error
+			self._forget_fd(name)
+			visca=self.ports.get(name)
+		if visca:
+			visca.close()
@@ -0,0 +1,475 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Daemon sharing the cameras with many processes over a unix socket
+
+  python -m pyviscalib.daemon --socket /tmp/visca.sock /dev/ttyUSB0
+  python -m pyviscalib.daemon --socket /tmp/visca.sock studioA=/dev/ttyUSB0 studioB=/dev/ttyUSB1
+
+The protocol is one JSON object per line in both directions. Requests
+carry an id of the client's choosing, which is repeated in the replies:
+
+  {"id": 1, "camera": 1, "call": "inq_cam_zoom_pos"}
+  {"id": 1, "result": 16384}
+
+  {"id": 2, "camera": "studioA/3", "call": "cmd_ptd_abs", "args": {"pp": 100, "tp": 20}}
+  {"id": 2, "ack": true}
+  {"id": 2, "completed": true}
+
+  {"id": 3, "call": "subscribe", "events": ["state", "completion", "renumber"]}
+  {"id": 3, "result": ["completion", "renumber", "state"]}
+  {"event": "state", "camera": 1, "pan": 120, "tilt": 0, "zoom": 0, "power": 2}
+
+calls are the cmd_* and inq_* names of the command table, args a list
+in parameter order or an object by name. camera is an address, or
+port/address with several ports. Errors come back as {"id": ...,
+"error": message, "type": exception class}. "cameras" lists the
+cameras, "unsubscribe" takes "events" like "subscribe".
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import select
+import threading
+import optparse
+
+import commands
+from visca import Visca, ViscaError
+from controller import ViscaController
+from poller import ViscaPoller
+
+EVENTS=('state','completion','renumber')
+
+
+class Client():
+	"""a connection, with what it has sent and what waits to be sent to it"""
+
+	def __init__(self,sock):
+		self.sock=sock
+		self.input=''
+		self.output=[]
+		self.events=set()
+		self.closed=False
+
+
+class ViscaDaemon():
+	"""
+	Serves the command table of a Visca, or of all ports of a
+	ViscaController, to any number of clients on a unix socket.
+
+	Requests are submitted as they arrive, without waiting for earlier
+	ones, so the requests of all clients are pipelined on the bus. An
+	inquiry that is already on the bus for the same camera is not sent
+	again, every client asking gets the one reply. Command replies come
+	in two steps, the ACK and the completion.
+
+	Clients subscribe to events: "state" for what pollers added with
+	add_poller report, "completion" for every command of any client
+	that completed, and "renumber" when a bus was renumbered.
+
+	Everything runs on one thread, replies are queued for it by the
+	reader threads.
+	"""
+
+	# seconds to wait for the reply to a request
+	timeout=5.0
+
+	# seconds a command may run before its client is told it failed
+	completion_timeout=60.0
+
+	def __init__(self,target,path):
+		self.target=target
+		self.path=path
+		self.mutex=threading.Lock()
+		# socket -> Client
+		self.clients={}
+		# (visca, address, packet) -> [(client, id)] of a merged inquiry
+		self.inquiries={}
+		self.merged=0
+		self.server=None
+		self.wakeup=os.pipe()
+		self.running=False
+		self.thread=None
+		if isinstance(target,ViscaController):
+			for name,visca in target.ports.items():
+				visca.renumber_handlers.append(self._renumbered(name))
+		else:
+			target.renumber_handlers.append(self._renumbered(None))
+
+	def start(self):
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.server=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		self.server.bind(self.path)
+		self.server.listen(16)
+		self.server.setblocking(False)
+		self.running=True
+		self.thread=threading.Thread(target=self.run,name='visca-daemon')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running=False
+		self._wake()
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread=None
+		for client in self.clients.values():
+			client.sock.close()
+		self.clients.clear()
+		if self.server:
+			self.server.close()
+			self.server=None
+			os.unlink(self.path)
+
+	def add_poller(self,poller,port=None):
+		"""report the state changes poller sees as state events"""
+		def _changed(old,new):
+			event={'event': 'state','camera': _camera(port,new.device)}
+			for name in ('pan','tilt','zoom','power'):
+				event[name]=getattr(new,name)
+			self._event('state',event)
+		poller.subscribe(_changed)
+
+	def _renumbered(self,port):
+		def _handler(mapping):
+			self._event('renumber',{'event': 'renumber','port': port,
+				'mapping': dict((str(old),new) for old,new in mapping.items())})
+		return _handler
+
+	# output, from any thread
+
+	def _wake(self):
+		os.write(self.wakeup[1],'x')
+
+	def _send(self,client,message):
+		with self.mutex:
+			if client.closed:
+				return
+			client.output.append(json.dumps(message)+'\n')
+		self._wake()
+
+	def _event(self,kind,message):
+		with self.mutex:
+			clients=[client for client in self.clients.values() if kind in client.events]
+		for client in clients:
+			self._send(client,message)
+
+	# the loop
+
+	def run(self):
+		while self.running:
+			with self.mutex:
+				writers=[client.sock for client in self.clients.values() if client.output]
+			readers=[self.server,self.wakeup[0]]+[client.sock for client in self.clients.values()]
+			try:
+				readable,writable,_=select.select(readers,writers,[],1.0)
+			except select.error as e:
+				if e.args[0]==errno.EINTR:
+					continue
+				raise
+			for sock in readable:
+				if sock is self.server:
+					self._accept()
+				elif sock is self.wakeup[0]:
+					os.read(self.wakeup[0],512)
+				else:
+					self._read(self.clients[sock])
+			for sock in writable:
+				# dropped while reading
+				client=self.clients.get(sock)
+				if client:
+					self._write(client)
+
+	def _accept(self):
+		try:
+			sock,_=self.server.accept()
+		except socket.error:
+			return
+		sock.setblocking(False)
+		self.clients[sock]=Client(sock)
+
+	def _drop(self,client):
+		with self.mutex:
+			client.closed=True
+			client.output=[]
+			self.clients.pop(client.sock,None)
+		client.sock.close()
+
+	def _read(self,client):
+		try:
+			data=client.sock.recv(65536)
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+				return
+			data=''
+		if not data:
+			self._drop(client)
+			return
+		client.input+=data
+		while '\n' in client.input:
+			line,client.input=client.input.split('\n',1)
+			if line.strip():
+				self._request(client,line)
+
+	def _write(self,client):
+		with self.mutex:
+			data=''.join(client.output)
+			client.output=[]
+		try:
+			sent=client.sock.send(data)
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+				sent=0
+			else:
+				self._drop(client)
+				return
+		if sent<len(data):
+			with self.mutex:
+				client.output.insert(0,data[sent:])
+
+	# requests
+
+	def _request(self,client,line):
+		id=None
+		try:
+			request=json.loads(line)
+			id=request.get('id')
+			call=request.get('call')
+			if call=='subscribe' or call=='unsubscribe':
+				events=set(request.get('events',EVENTS))
+				if events-set(EVENTS):
+					raise ValueError("Unknown events %s" % ', '.join(sorted(events-set(EVENTS))))
+				with self.mutex:
+					if call=='subscribe':
+						client.events|=events
+					else:
+						client.events-=events
+				self._send(client,{'id': id,'result': sorted(client.events)})
+			elif call=='cameras':
+				self._send(client,{'id': id,'result': self._cameras()})
+			else:
+				command=commands.BY_NAME.get(call)
+				if command is None:
+					raise ValueError("Unknown call %s" % call)
+				visca,address=self._resolve(request.get('camera'))
+				values=command.values(request.get('args',()))
+				self._submit(client,id,request.get('camera'),visca,address,command,values)
+		except Exception as e:
+			self._send(client,{'id': id,'error': str(e),'type': type(e).__name__})
+
+	def _resolve(self,camera):
+		if isinstance(self.target,ViscaController):
+			return self.target.resolve(camera)
+		if camera is None:
+			raise ValueError("No camera given")
+		return self.target,int(camera)
+
+	def _cameras(self):
+		if isinstance(self.target,ViscaController):
+			return self.target.cameras()
+		return range(1,(self.target.devices or 0)+1)
+
+	def _submit(self,client,id,camera,visca,address,command,values):
+		packet=visca.template(address,command.name).encode(values)
+		if command.inquiry():
+			key=(visca,address,packet)
+			with self.mutex:
+				waiting=self.inquiries.get(key)
+				if waiting is not None:
+					waiting.append((client,id))
+					self.merged+=1
+					return
+				self.inquiries[key]=[(client,id)]
+		try:
+			future=visca.submit(address,packet,self.timeout,self.completion_timeout)
+		except Exception as e:
+			if not command.inquiry():
+				raise
+			# nobody may join an inquiry that was never sent
+			with self.mutex:
+				waiting=self.inquiries.pop(key,())
+			for client,id in waiting:
+				self._send(client,{'id': id,'error': str(e),'type': type(e).__name__})
+			return
+		if command.inquiry():
+			future.add_done_callback(lambda future: self._answered(key,command,future))
+		else:
+			future.add_done_callback(lambda future: self._acked(client,id,camera,command,future))
+
+	def _answered(self,key,command,future):
+		with self.mutex:
+			waiting=self.inquiries.pop(key,())
+		if future.exception() is not None:
+			error=future.exception()
+			message={'error': str(error),'type': type(error).__name__}
+		else:
+			message={'result': _json(command.decode(future.result()))}
+		for client,id in waiting:
+			reply=dict(message)
+			reply['id']=id
+			self._send(client,reply)
+
+	def _acked(self,client,id,camera,command,future):
+		error=future.exception()
+		if error is not None:
+			self._send(client,{'id': id,'error': str(error),'type': type(error).__name__})
+			return
+		handle=future.result()
+		self._send(client,{'id': id,'ack': True})
+		def _completed(handle):
+			error=handle.exception()
+			if error is not None:
+				self._send(client,{'id': id,'error': str(error),'type': type(error).__name__})
+				return
+			self._send(client,{'id': id,'completed': True})
+			self._event('completion',{'event': 'completion','camera': camera,'call': command.name})
+		handle.add_done_callback(_completed)
+
+
+class ViscaClient():
+	"""
+	Blocking client for the daemon. request() sends one request and
+	returns its final reply; events arriving meanwhile are kept in
+	events.
+	"""
+
+	def __init__(self,path):
+		self.sock=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		self.sock.connect(path)
+		self.file=self.sock.makefile('r')
+		self.next_id=0
+		self.events=[]
+
+	def close(self):
+		self.file.close()
+		self.sock.close()
+
+	def send(self,call,camera=None,**args):
+		"""send a request without waiting, returns its id"""
+		self.next_id+=1
+		request={'id': self.next_id,'call': call}
+		if camera is not None:
+			request['camera']=camera
+		if args:
+			request['args']=args
+		self.sock.sendall(json.dumps(request)+'\n')
+		return self.next_id
+
+	def receive(self):
+		"""the next message from the daemon"""
+		line=self.file.readline()
+		if not line:
+			raise ViscaError("Daemon closed the connection")
+		return json.loads(line)
+
+	def request(self,call,camera=None,**args):
+		"""
+		the result of an inquiry or other call, True once a command
+		completed. Errors are raised as ViscaError.
+		"""
+		id=self.send(call,camera,**args)
+		while True:
+			message=self.receive()
+			if 'event' in message:
+				self.events.append(message)
+				continue
+			if message.get('id')!=id or message.get('ack'):
+				continue
+			if 'error' in message:
+				raise ViscaError("%s: %s" % (message['type'],message['error']))
+			if 'completed' in message:
+				return True
+			return message['result']
+
+
+def _camera(port,device):
+	if port is None:
+		return device
+	return '%s/%d' % (port,device)
+
+def _json(value):
+	# raw replies are given as hex
+	if isinstance(value,str):
+		return value.encode('hex')
+	if isinstance(value,tuple):
+		return [_json(item) for item in value]
+	return value
+
+
+def main():
+	parser=optparse.OptionParser(usage="%prog --socket PATH [options] PORT | NAME=PORT ...")
+	parser.add_option('--socket',metavar='PATH',default='/tmp/visca.sock',help="unix socket to listen on")
+	parser.add_option('--baudrate',default='9600',help="baud rate of the ports, or auto")
+	parser.add_option('--pipeline',action='store_true',help="queue commands for busy cameras")
+	parser.add_option('--topology',metavar='FILE',help="topology file of a single port, see Visca.startup")
+	parser.add_option('--poll',type='float',metavar='RATE',help="poll state this many times per second for state events")
+	options,args=parser.parse_args()
+	if not args:
+		parser.error("no port given")
+	baudrate=options.baudrate
+	if baudrate!='auto':
+		baudrate=int(baudrate)
+
+	pollers=[]
+	if len(args)==1 and '=' not in args[0]:
+		target=Visca(args[0],baudrate=baudrate,pipeline=options.pipeline)
+		target.startup(options.topology)
+		if options.poll:
+			pollers.append((ViscaPoller(target,range(1,target.devices+1),options.poll),None))
+	else:
+		target=ViscaController()
+		for arg in args:
+			name,_,portname=arg.partition('=')
+			if not portname:
+				parser.error("give several ports as NAME=PORT")
+			target.add_port(name,portname,baudrate=baudrate,pipeline=options.pipeline)
+		target.start()
+		for name,result in sorted(target.renumber().items()):
+			if isinstance(result,Exception):
+				print "visca: port %s: %s" % (name,result)
+			elif options.poll:
+				visca=target.port(name)
+				pollers.append((ViscaPoller(visca,range(1,visca.devices+1),options.poll),name))
+
+	daemon=ViscaDaemon(target,options.socket)
+	for poller,port in pollers:
+		daemon.add_poller(poller,port)
+		poller.start()
+	daemon.start()
+	print "visca: serving on %s" % options.socket
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		pass
+	for poller,port in pollers:
+		poller.stop()
+	daemon.stop()
+	target.close()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Latency histograms and counters per camera and command"""
+
+import threading
+from bisect import bisect_left
+
+import commands
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0)
+
+# packets for the bus itself, which are not in the command table
+BUS_COMMANDS={'\x30\x01': 'cmd_adress_set', '\x01\x00\x01': 'cmd_if_clear_all'}
+
+def command_name(data):
+	"""the name of the command in packet data, '' if unknown"""
+	command=commands.lookup(data)
+	if command:
+		return command.name
+	return BUS_COMMANDS.get(data,'')
+
+
+class Histogram():
+	"""
+	Counts observations in fixed buckets. The counts are preallocated,
+	observe() only increments them.
+	"""
+
+	def __init__(self,bounds=BUCKETS):
+		self.bounds=bounds
+		# the last bucket takes everything above the last bound
+		self.counts=[0]*(len(bounds)+1)
+		self.count=0
+		self.sum=0.0
+
+	def observe(self,value):
+		self.counts[bisect_left(self.bounds,value)]+=1
+		self.count+=1
+		self.sum+=value
+
+	def quantile(self,q):
+		"""upper bound of the bucket holding quantile q, None if empty"""
+		if not self.count:
+			return None
+		rank=q*self.count
+		seen=0
+		for bound,count in zip(self.bounds,self.counts):
+			seen+=count
+			if seen>=rank:
+				return bound
+		return float('inf')
+
+	def snapshot(self):
+		"""
+		{'buckets': [(upper bound, cumulative count), ...], 'count': n,
+		'sum': seconds}, the last bound being inf
+		"""
+		buckets=[]
+		seen=0
+		for bound,count in zip(self.bounds+(float('inf'),),self.counts):
+			seen+=count
+			buckets.append((bound,seen))
+		return {'buckets':buckets,'count':self.count,'sum':self.sum}
+
+
+class CommandStats():
+	"""what happened to the packets of one command sent to one camera"""
+
+	def __init__(self,camera,opcode,command,buckets=BUCKETS):
+		self.camera=camera
+		self.opcode=opcode
+		self.command=command
+		# sending to the ACK of a command or the reply to an inquiry
+		self.ack=Histogram(buckets)
+		# sending to the completion of a command
+		self.completion=Histogram(buckets)
+		self.retries=0
+		self.timeouts=0
+		# error code -> count
+		self.errors={}
+
+	def snapshot(self):
+		return {
+			'camera': self.camera,
+			'opcode': self.opcode.encode('hex'),
+			'command': self.command,
+			'ack': self.ack.snapshot(),
+			'completion': self.completion.snapshot(),
+			'retries': self.retries,
+			'timeouts': self.timeouts,
+			'errors': dict(self.errors),
+			}
+
+
+class ViscaMetrics():
+	"""
+	Latency histograms and counters per camera and command, kept by
+	every Visca in visca.metrics. Commands are told apart by their name
+	in the command table, packets not in the table by their opcode (the
+	first three bytes after the header, e.g. 01 04 07 for zoom).
+
+	snapshot() returns everything as plain data, prometheus() in the
+	Prometheus text exposition format.
+	"""
+
+	def __init__(self,buckets=BUCKETS):
+		self.buckets=buckets
+		# (camera, opcode, command name) -> CommandStats
+		self.stats={}
+		self.mutex=threading.Lock()
+
+	def _stats(self,camera,packet):
+		# called with the mutex held
+		data=packet[1:-1]
+		opcode=data[:3]
+		name=command_name(data)
+		stats=self.stats.get((camera,opcode,name))
+		if stats is None:
+			stats=self.stats[(camera,opcode,name)]=CommandStats(camera,opcode,name,self.buckets)
+		return stats
+
+	def ack(self,camera,packet,seconds):
+		with self.mutex:
+			self._stats(camera,packet).ack.observe(seconds)
+
+	def completion(self,camera,packet,seconds):
+		with self.mutex:
+			self._stats(camera,packet).completion.observe(seconds)
+
+	def retry(self,camera,packet):
+		with self.mutex:
+			self._stats(camera,packet).retries+=1
+
+	def timeout(self,camera,packet):
+		with self.mutex:
+			self._stats(camera,packet).timeouts+=1
+
+	def error(self,camera,packet,code):
+		with self.mutex:
+			errors=self._stats(camera,packet).errors
+			errors[code]=errors.get(code,0)+1
+
+	def reset(self):
+		with self.mutex:
+			self.stats.clear()
+
+	def snapshot(self):
+		"""a list with the snapshot of every camera and command seen"""
+		with self.mutex:
+			return [self.stats[key].snapshot() for key in sorted(self.stats)]
+
+	def prometheus(self,prefix='visca'):
+		"""the metrics in the Prometheus text format"""
+		return prometheus(self.snapshot(),prefix)
+
+def prometheus(snapshots,prefix='visca'):
+	"""
+	snapshots in the Prometheus text format. A snapshot with a 'port'
+	entry gets a port label, so several ports can share one output.
+	"""
+	lines=[]
+	for name,help in (('ack','Time from sending a packet to its ACK or inquiry reply'),
+			('completion','Time from sending a command to its completion')):
+		metric='%s_%s_seconds' % (prefix,name)
+		lines.append('# HELP %s %s.' % (metric,help))
+		lines.append('# TYPE %s histogram' % metric)
+		for snapshot in snapshots:
+			histogram=snapshot[name]
+			if not histogram['count']:
+				continue
+			labels=_labels(snapshot)
+			for bound,count in histogram['buckets']:
+				if bound==float('inf'):
+					le='+Inf'
+				else:
+					le=repr(bound)
+				lines.append('%s_bucket{%s,le="%s"} %d' % (metric,labels,le,count))
+			lines.append('%s_sum{%s} %r' % (metric,labels,histogram['sum']))
+			lines.append('%s_count{%s} %d' % (metric,labels,histogram['count']))
+	for name,help in (('retries','Packets sent again for lack of a reply'),
+			('timeouts','Packets that got no reply at all')):
+		metric='%s_%s_total' % (prefix,name)
+		lines.append('# HELP %s %s.' % (metric,help))
+		lines.append('# TYPE %s counter' % metric)
+		for snapshot in snapshots:
+			lines.append('%s{%s} %d' % (metric,_labels(snapshot),snapshot[name]))
+	metric='%s_errors_total' % prefix
+	lines.append('# HELP %s Error replies by error code.' % metric)
+	lines.append('# TYPE %s counter' % metric)
+	for snapshot in snapshots:
+		for code,count in sorted(snapshot['errors'].items()):
+			lines.append('%s{%s,code="0x%02x"} %d' % (metric,_labels(snapshot),code,count))
+	return '\n'.join(lines)+'\n'
+
+def _labels(snapshot):
+	labels='camera="%d",opcode="%s",command="%s"' % (snapshot['camera'],snapshot['opcode'],snapshot['command'])
+	if 'port' in snapshot:
+		labels='port="%s",%s' % (snapshot['port'],labels)
+	return labels
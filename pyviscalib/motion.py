@@ -0,0 +1,223 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Coalescing motion commands from joysticks and trackers"""
+
+import time
+import threading
+from collections import deque
+
+from visca import ViscaTimeout
+
+PANTILT='pantilt'
+ZOOM='zoom'
+FOCUS='focus'
+
+
+class ViscaMotion():
+	"""
+	Latest-wins channel for motion commands, per camera and axis.
+
+	The input methods never block: they store the command as the one
+	waiting for its camera and axis, replacing a waiting command that
+	has not been sent yet. A background thread sends the waiting
+	commands, round-robin over cameras and axes, each as soon as the
+	previous command on its axis was answered. So at most one motion
+	command per axis is ever queued, and whatever goes on the bus is
+	the freshest input.
+
+	The thread does not wait for the replies, the commands of all axes
+	are in flight at once. A command that gets no reply within the
+	first timeout of the retry policy is given up without resending,
+	so a camera that is gone only holds up its own axes. A command that
+	failed (no reply, buffer full, not executable) is sent again, at
+	most retries times, unless newer input for its axis came in.
+
+	Speeds are signed: positive pans right, tilts up and zooms tele.
+	"""
+
+	retries=2
+
+	def __init__(self,visca):
+		self.visca=visca
+		self.cond=threading.Condition()
+		# (device, axis) -> (template name, values) waiting to be sent
+		self.latest={}
+		# keys with a waiting command, in the order they get their turn
+		self.ready=deque()
+		# keys with a command on its way that was not answered yet
+		self.busy=set()
+		# key -> times its command was sent again after failing
+		self.attempts={}
+		self.sent=0
+		self.retried=0
+		self.timeouts=0
+		self.coalesced=0
+		self.running=False
+		self.thread=None
+
+	def start(self):
+		self.running=True
+		self.thread=threading.Thread(target=self._run,name='visca-motion')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		with self.cond:
+			self.running=False
+			self.cond.notify_all()
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread=None
+
+	def submit(self,device,axis,name,*values):
+		"""send command name of the table with values, replacing what waits on the axis"""
+		key=(device,axis)
+		with self.cond:
+			if key in self.latest:
+				self.coalesced+=1
+			elif key not in self.busy:
+				self.ready.append(key)
+			self.latest[key]=(name,values)
+			self.attempts.pop(key,None)
+			self.cond.notify_all()
+
+	def pending(self,device,axis):
+		with self.cond:
+			return (device,axis) in self.latest
+
+	def flush(self,timeout=None):
+		"""wait until everything submitted has been sent, returns False on timeout"""
+		end=None
+		if timeout is not None:
+			end=time.time()+timeout
+		with self.cond:
+			while self.latest or self.busy:
+				remaining=None
+				if end is not None:
+					remaining=end-time.time()
+					if remaining<=0:
+						return False
+				self.cond.wait(remaining)
+		return True
+
+	# input
+
+	def pan_tilt(self,device,pan,tilt):
+		"""drive with pan speed -0x18..0x18 and tilt speed -0x17..0x17, 0 stops"""
+		if not pan and not tilt:
+			self.submit(device,PANTILT,'cmd_ptd_stop')
+			return
+		if pan<0:
+			lr=0x01
+		elif pan>0:
+			lr=0x02
+		else:
+			lr=0x03
+		if tilt>0:
+			ud=0x01
+		elif tilt<0:
+			ud=0x02
+		else:
+			ud=0x03
+		ps=max(1,min(0x18,abs(pan)))
+		ts=max(1,min(0x17,abs(tilt)))
+		self.submit(device,PANTILT,'cmd_ptd',ps,ts,lr,ud)
+
+	def pan_tilt_to(self,device,pan,tilt,ps=0x18,ts=0x14):
+		"""move to an absolute position"""
+		self.submit(device,PANTILT,'cmd_ptd_abs',max(1,min(0x17,ts)),max(1,min(0x18,ps)),pan,tilt)
+
+	def zoom(self,device,speed):
+		"""0 stops, 1..8 zooms tele and -1..-8 wide at visca speed 0..7"""
+		if not speed:
+			self.submit(device,ZOOM,'cmd_cam_zoom_stop')
+		elif speed>0:
+			self.submit(device,ZOOM,'cmd_cam_zoom_tele_speed',min(speed,8)-1)
+		else:
+			self.submit(device,ZOOM,'cmd_cam_zoom_wide_speed',min(-speed,8)-1)
+
+	def zoom_to(self,device,zoom):
+		self.submit(device,ZOOM,'cmd_cam_zoom_direct',max(0,min(0x7000,zoom)))
+
+	def focus(self,device,speed):
+		"""0 stops, 1..8 focuses far and -1..-8 near at visca speed 0..7"""
+		if not speed:
+			self.submit(device,FOCUS,'cmd_cam_focus_stop')
+		elif speed>0:
+			self.submit(device,FOCUS,'cmd_cam_focus_far_speed',min(speed,8)-1)
+		else:
+			self.submit(device,FOCUS,'cmd_cam_focus_near_speed',min(-speed,8)-1)
+
+	def halt(self,device):
+		"""stop pan/tilt and zoom of device"""
+		self.pan_tilt(device,0,0)
+		self.zoom(device,0)
+
+	# sending
+
+	def _run(self):
+		visca=self.visca
+		while True:
+			with self.cond:
+				while self.running and not self.ready:
+					self.cond.wait()
+				if not self.running:
+					return
+				sending=[]
+				while self.ready:
+					key=self.ready.popleft()
+					sending.append((key,self.latest.pop(key)))
+					self.busy.add(key)
+			for key,(name,values) in sending:
+				try:
+					future=visca.submit_template(key[0],name,values)
+				except Exception as e:
+					print "visca: motion command %s for cam %d failed: %s" % (name,key[0],e)
+					self._answered(key)
+					continue
+				future.add_done_callback(lambda future,key=key,name=name,values=values: self._replied(key,name,values,future))
+
+	def _replied(self,key,name,values,future):
+		error=future.exception()
+		if error is not None:
+			print "visca: motion command %s for cam %d failed: %s" % (name,key[0],error)
+			with self.cond:
+				if isinstance(error,ViscaTimeout):
+					self.timeouts+=1
+				attempts=self.attempts.get(key,0)
+				if key not in self.latest and attempts<self.retries:
+					# nothing newer to send, the axis would be left as
+					# it was before this command
+					self.latest[key]=(name,values)
+					self.attempts[key]=attempts+1
+					self.retried+=1
+		self._answered(key)
+
+	def _answered(self,key):
+		with self.cond:
+			self.busy.discard(key)
+			self.sent+=1
+			if key in self.latest:
+				# new input arrived while this one was on its way, or
+				# it failed and goes again
+				self.ready.append(key)
+			self.cond.notify_all()
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Background polling of the camera state"""
+
+import time
+import threading
+
+
+class CameraState(object):
+	"""
+	Snapshot of what we know about a camera. States are never modified,
+	the poller replaces them, so they can be read from any thread
+	without locking. Values are None until the first successful poll.
+	"""
+	__slots__=('device','pan','tilt','zoom','power','updated')
+
+	def __init__(self,device,pan=None,tilt=None,zoom=None,power=None,updated=None):
+		self.device=device
+		self.pan=pan
+		self.tilt=tilt
+		self.zoom=zoom
+		self.power=power
+		self.updated=updated
+
+	def replace(self,**changes):
+		values=dict((name,getattr(self,name)) for name in self.__slots__)
+		values.update(changes)
+		return CameraState(**values)
+
+	def same(self,other):
+		"""True if other has the same pan, tilt, zoom and power"""
+		return (self.pan,self.tilt,self.zoom,self.power)==(other.pan,other.tilt,other.zoom,other.power)
+
+	def __repr__(self):
+		return '<CameraState cam=%d pan=%s tilt=%s zoom=%s power=%s>' % (self.device,self.pan,self.tilt,self.zoom,self.power)
+
+
+class ViscaPoller():
+	"""
+	Keeps a CameraState per camera up to date from a background thread.
+
+	Every camera is polled for pan/tilt, zoom and power about rate times
+	per second. Inquiries are only sent when the bus has been quiet for
+	idle_gap seconds, and while commands are being sent the interval
+	doubles per round, up to max_interval, so polling gives way to
+	control traffic.
+
+	Subscribers are called on the poller thread as fn(old, new) for
+	every state that changed.
+	"""
+
+	idle_gap=0.02
+	max_interval=2.0
+
+	def __init__(self,visca,devices,rate=5.0):
+		self.visca=visca
+		self.devices=list(devices)
+		self.interval=1.0/rate
+		self.states=dict((device,CameraState(device)) for device in self.devices)
+		self.subscribers=[]
+		self.running=False
+		self.thread=None
+		visca.renumber_handlers.append(self.remap)
+
+	def state(self,device):
+		return self.states[device]
+
+	def remap(self,mapping):
+		"""follow the cameras to their new addresses after renumbering"""
+		devices=[]
+		states={}
+		for device in self.devices:
+			new=mapping.get(device,device)
+			if new is None:
+				continue
+			devices.append(new)
+			states[new]=self.states[device].replace(device=new)
+		self.devices=devices
+		self.states=states
+
+	def subscribe(self,fn):
+		self.subscribers.append(fn)
+
+	def unsubscribe(self,fn):
+		self.subscribers.remove(fn)
+
+	def start(self):
+		self.running=True
+		self.thread=threading.Thread(target=self._run,name='visca-poller')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running=False
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread=None
+
+	def _run(self):
+		interval=self.interval
+		while self.running:
+			started=time.time()
+			last_command=self.visca.last_command
+			for device in self.devices:
+				if not self.running:
+					return
+				self._wait_idle()
+				self.poll(device)
+			if self.visca.last_command!=last_command:
+				interval=min(interval*2,self.max_interval)
+			else:
+				interval=self.interval
+			remaining=started+interval-time.time()
+			if remaining>0:
+				time.sleep(remaining)
+
+	def _wait_idle(self):
+		while self.running:
+			quiet=time.time()-self.visca.last_write
+			if quiet>=self.idle_gap:
+				return
+			time.sleep(self.idle_gap-quiet)
+
+	def poll(self,device):
+		"""refresh the state of device now, returns the new state"""
+		old=self.states.get(device)
+		if old is None:
+			# left the bus while we were polling
+			return None
+		changes={}
+		for name,inquiry in (('power',self.visca.inq_cam_power),('zoom',self.visca.inq_cam_zoom_pos),('pantilt',self.visca.inq_cam_pan_tilt_pos)):
+			try:
+				value=inquiry(device)
+			except Exception as e:
+				# no reply or not available in the current mode, keep the old value
+				if self.visca.DEBUG: print "debug: poller: %s of cam %d: %s" % (name,device,e)
+				continue
+			if name=='pantilt':
+				changes['pan'],changes['tilt']=value
+			else:
+				changes[name]=value
+		new=old.replace(updated=time.time(),**changes)
+		self.states[device]=new
+		if not new.same(old):
+			for fn in list(self.subscribers):
+				try:
+					fn(old,new)
+				except Exception as e:
+					print "visca: poller subscriber failed: %s" % e
+		return new
@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Named presets kept on the host, as many as you like per camera
+
+The cameras only have six position memories. ViscaPresets stores named
+positions in a memory mapped file instead and recalls them with
+absolute position commands.
+"""
+
+import os
+import mmap
+import time
+import struct
+import threading
+
+import commands
+from visca import ViscaError
+
+MAGIC='VPRS'
+VERSION=1
+# magic, version, record size, number of record slots
+FILE_HEADER=struct.Struct('<4sHHI')
+
+# longest preset name, in bytes of utf-8
+MAXNAME=32
+
+# camera, in use, name, pan, tilt, zoom, focus, pan speed, tilt speed, saved at
+RECORD=struct.Struct('<BB%dsiiiiBBd' % MAXNAME)
+
+# focus of a preset saved without one
+NO_FOCUS=-1
+
+
+class Preset():
+	"""a preset as read from the store"""
+
+	def __init__(self,camera,name,pan,tilt,zoom,focus=None,ps=0x18,ts=0x14,saved=None):
+		self.camera=camera
+		self.name=name
+		self.pan=pan
+		self.tilt=tilt
+		self.zoom=zoom
+		self.focus=focus
+		self.ps=ps
+		self.ts=ts
+		self.saved=saved
+
+	def __repr__(self):
+		return '<Preset cam=%d %s pan=%d tilt=%d zoom=%d focus=%s>' % (self.camera,self.name.encode('utf8'),self.pan,self.tilt,self.zoom,self.focus)
+
+
+class ViscaPresets():
+	"""
+	Presets in a file of fixed size records, memory mapped. The index of
+	(camera, name) to record slot is built when the file is opened, so
+	get() and recall() never touch the disk; save() writes one record in
+	place. The file grows by doubling when all slots are in use.
+
+	recall() sends the absolute pan/tilt position and the zoom position
+	of a preset at once, so they run on the two command sockets of the
+	camera in parallel. Their packets are encoded once per preset and
+	kept. capture() reads the positions of many cameras in one sweep,
+	with all inquiries on the bus before the first reply is awaited.
+
+	  presets=ViscaPresets('presets.db')
+	  presets.capture(visca,range(1,8),'stage')
+	  handles=presets.recall(visca,3,'stage')
+	"""
+
+	def __init__(self,filename,slots=1024):
+		self.filename=filename
+		self.mutex=threading.Lock()
+		# (camera, name) -> slot
+		self.index={}
+		self.free=[]
+		# (camera, name) -> encoded recall packets
+		self.packets={}
+		self.map=None
+		new=not os.path.exists(filename) or os.path.getsize(filename)==0
+		self.file=open(filename,'r+b' if not new else 'w+b')
+		if new:
+			self.slots=0
+			self._grow(slots)
+		else:
+			self._map()
+			self._load()
+
+	def _map(self):
+		size=os.fstat(self.file.fileno()).st_size
+		self.map=mmap.mmap(self.file.fileno(),size)
+		magic,version,record_size,self.slots=FILE_HEADER.unpack_from(self.map,0)
+		if magic!=MAGIC or version!=VERSION or record_size!=RECORD.size:
+			self.map.close()
+			raise ViscaError("%s is not a preset file of this version" % self.filename)
+		if size<FILE_HEADER.size+self.slots*RECORD.size:
+			self.map.close()
+			raise ViscaError("%s is truncated" % self.filename)
+
+	def _grow(self,slots):
+		# called with the mutex held, or from __init__
+		old=self.slots
+		if old:
+			self.map.close()
+		self.file.truncate(FILE_HEADER.size+slots*RECORD.size)
+		self.map=mmap.mmap(self.file.fileno(),FILE_HEADER.size+slots*RECORD.size)
+		FILE_HEADER.pack_into(self.map,0,MAGIC,VERSION,RECORD.size,slots)
+		self.slots=slots
+		# slots are handed out from the end of the list
+		self.free.extend(reversed(range(old,slots)))
+
+	def _load(self):
+		for slot in reversed(range(self.slots)):
+			record=RECORD.unpack_from(self.map,FILE_HEADER.size+slot*RECORD.size)
+			if record[1]:
+				self.index[(record[0],_name(record[2]))]=slot
+			else:
+				self.free.append(slot)
+
+	def _read(self,slot):
+		camera,used,name,pan,tilt,zoom,focus,ps,ts,saved=RECORD.unpack_from(self.map,FILE_HEADER.size+slot*RECORD.size)
+		if focus==NO_FOCUS:
+			focus=None
+		return Preset(camera,_name(name),pan,tilt,zoom,focus,ps,ts,saved)
+
+	def close(self):
+		with self.mutex:
+			if self.map is None:
+				return
+			self.map.flush()
+			self.map.close()
+			self.map=None
+			self.file.close()
+
+	def flush(self):
+		"""write changed records to disk now"""
+		with self.mutex:
+			self.map.flush()
+
+	def __len__(self):
+		return len(self.index)
+
+	def __contains__(self,key):
+		return _key(*key) in self.index
+
+	def names(self,camera):
+		"""the names of the presets of camera, sorted"""
+		with self.mutex:
+			return sorted(name for cam,name in self.index if cam==camera)
+
+	def get(self,camera,name):
+		"""the Preset, or None"""
+		with self.mutex:
+			slot=self.index.get(_key(camera,name))
+			if slot is None:
+				return None
+			return self._read(slot)
+
+	def save(self,camera,name,pan,tilt,zoom,focus=None,ps=0x18,ts=0x14):
+		"""store a preset, replacing one of the same name"""
+		key=_key(camera,name)
+		encoded=key[1].encode('utf8')
+		if not encoded or len(encoded)>MAXNAME or '\0' in encoded:
+			raise ValueError("Preset names are 1 to %d bytes without NUL" % MAXNAME)
+		with self.mutex:
+			slot=self.index.get(key)
+			if slot is None:
+				if not self.free:
+					self._grow(self.slots*2)
+				slot=self.free.pop()
+			RECORD.pack_into(self.map,FILE_HEADER.size+slot*RECORD.size,camera,1,encoded,
+				pan,tilt,zoom,NO_FOCUS if focus is None else focus,ps,ts,time.time())
+			self.index[key]=slot
+			self.packets.pop(key,None)
+
+	def delete(self,camera,name):
+		key=_key(camera,name)
+		with self.mutex:
+			slot=self.index.pop(key,None)
+			if slot is None:
+				return False
+			self.map[FILE_HEADER.size+slot*RECORD.size:FILE_HEADER.size+(slot+1)*RECORD.size]='\0'*RECORD.size
+			self.free.append(slot)
+			self.packets.pop(key,None)
+			return True
+
+	def _recall_packets(self,visca,camera,name):
+		key=_key(camera,name)
+		packets=self.packets.get(key)
+		if packets is None:
+			preset=self.get(camera,name)
+			if preset is None:
+				raise ViscaError("No preset '%s' for cam %d" % (name,camera))
+			ptd=visca.template(camera,'cmd_ptd_abs').encode((preset.ts,preset.ps,preset.pan,preset.tilt))
+			zoom=visca.template(camera,'cmd_cam_zoom_direct').encode((preset.zoom,))
+			focus=None
+			if preset.focus is not None:
+				focus=(visca.template(camera,'cmd_cam_focus_manual').encode(()),
+					visca.template(camera,'cmd_cam_focus_direct').encode((preset.focus,)))
+			packets=self.packets[key]=(ptd,zoom,focus)
+		return packets
+
+	def recall(self,visca,camera,name,focus=False):
+		"""
+		move camera to the preset. returns the futures of the commands,
+		pan/tilt first, then zoom, see Visca.submit: they fail with
+		ViscaTimeout when the camera does not answer. With focus set a
+		preset with a saved focus also switches to manual focus and sets
+		it, which needs a pipelining Visca as both sockets are busy
+		already.
+		"""
+		ptd,zoom,focus_packets=self._recall_packets(visca,camera,name)
+		futures=[visca.submit(camera,ptd),visca.submit(camera,zoom)]
+		if focus and focus_packets:
+			for packet in focus_packets:
+				futures.append(visca.submit(camera,packet))
+		return futures
+
+	def capture(self,visca,cameras,name,focus=False):
+		"""
+		save the current position of every camera as preset name. All
+		inquiries are submitted first, then the replies collected.
+		returns {camera: Preset}, cameras that did not answer are left
+		out.
+		"""
+		inquiries=['inq_cam_pan_tilt_pos','inq_cam_zoom_pos']
+		if focus:
+			inquiries.append('inq_cam_focus_pos')
+		sweep=[]
+		for camera in cameras:
+			for inquiry in inquiries:
+				template=visca.template(camera,inquiry)
+				sweep.append((camera,inquiry,visca._submit(camera,template.encode(()),False)))
+		replies={}
+		for camera,inquiry,future in sweep:
+			try:
+				reply=visca._wait_reply(camera,future)
+			except ViscaError as e:
+				print "visca: capturing %s of cam %d failed: %s" % (inquiry,camera,e)
+				continue
+			if reply:
+				replies[(camera,inquiry)]=commands.BY_NAME[inquiry].decode(reply)
+		captured={}
+		for camera in cameras:
+			if (camera,'inq_cam_pan_tilt_pos') not in replies or (camera,'inq_cam_zoom_pos') not in replies:
+				continue
+			pan,tilt=replies[(camera,'inq_cam_pan_tilt_pos')]
+			self.save(camera,name,pan,tilt,replies[(camera,'inq_cam_zoom_pos')],replies.get((camera,'inq_cam_focus_pos')))
+			captured[camera]=self.get(camera,name)
+		return captured
+
+def _name(field):
+	return field.rstrip('\0').decode('utf8')
+
+def _key(camera,name):
+	# names are indexed as unicode, whichever way they are passed
+	if not isinstance(name,unicode):
+		name=name.decode('utf8')
+	return (camera,name)
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Fair scheduling of the traffic to the cameras on one daisy chain"""
+
+from collections import deque
+
+
+class ViscaScheduler():
+	"""
+	Keeps a queue per camera address and decides which packet goes on
+	the line next.
+
+	Every camera has at most one packet waiting for its ACK or reply, so
+	a slow camera only delays its own queue. Cameras take turns
+	round-robin, and inquiries are sent before queued commands. With a
+	pipelining Visca, commands for a camera with both sockets busy wait
+	in the queue while inquiries for it still go out.
+
+	Installs itself on the Visca object: all submit_packet/send_packet
+	traffic, and so all cmd_* and inq_* methods, go through it.
+	"""
+
+	def __init__(self,visca):
+		self.visca=visca
+		# address -> (inquiries, commands)
+		self.queues={}
+		# round-robin order of the addresses
+		self.order=[]
+		self.next_index=0
+		# address -> future waiting for its first reply
+		self.in_flight={}
+		visca.scheduler=self
+
+	def enqueue(self,address,future):
+		# called with the visca mutex held
+		queues=self.queues.get(address)
+		if queues is None:
+			queues=self.queues[address]=(deque(),deque())
+			self.order.append(address)
+		if future.command:
+			queues[1].append(future)
+		else:
+			queues[0].append(future)
+		future.add_done_callback(lambda future: self._finished(address,future))
+
+	def queued(self,address):
+		"""number of packets for address that have not been sent yet"""
+		queues=self.queues.get(address)
+		if not queues:
+			return 0
+		return len(queues[0])+len(queues[1])
+
+	def _finished(self,address,future):
+		with self.visca.mutex:
+			if self.in_flight.get(address) is future:
+				del self.in_flight[address]
+			else:
+				# finished (failed or timed out) while still queued
+				queues=self.queues.get(address)
+				if queues and future in queues[future.command]:
+					queues[future.command].remove(future)
+		self.pump()
+
+	def _next(self):
+		# called with the visca mutex held
+		count=len(self.order)
+		for kind in (0,1):
+			for i in range(count):
+				index=(self.next_index+i)%count
+				address=self.order[index]
+				if address in self.in_flight:
+					continue
+				queue=self.queues[address][kind]
+				if not queue:
+					continue
+				if kind==1 and self.visca.pipeline and self.visca._sockets_free(address)<=0:
+					continue
+				self.next_index=(index+1)%count
+				return address,queue.popleft()
+		return None
+
+	def pump(self):
+		"""send queued packets for every camera that is ready for one"""
+		failed=[]
+		with self.visca.mutex:
+			while True:
+				entry=self._next()
+				if entry is None:
+					break
+				address,future=entry
+				self.in_flight[address]=future
+				try:
+					self.visca._write_pending(address,future)
+				except Exception as e:
+					del self.in_flight[address]
+					failed.append((future,e))
+		for future,e in failed:
+			future.set_exception(e)
@@ -0,0 +1,668 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Simulated chain of visca cameras
+
+ViscaSimulator plays a daisy chain of cameras. Talk to it in memory with
+
+  Visca(SimTransport(ViscaSimulator(cameras=3)))
+
+or Visca('sim://3'), or over a pseudo terminal with ViscaPtyServer, which
+looks like a serial port to any program.
+"""
+
+import os
+import pty
+import tty
+import time
+import heapq
+import select
+import threading
+
+import commands
+
+SOCKETS=2
+
+# positions of the pan/tilt and zoom axes
+PAN_RANGE=(-1440,1440)
+TILT_RANGE=(-360,360)
+ZOOM_RANGE=(0,0x4000)
+
+# reply payload of every inquiry after power up
+DEFAULTS={
+	'inq_cam_power': '\x02',
+	'inq_cam_version': '\x00\x20\x04\x0e\x00\x00\x02',
+	'inq_cam_id': '\x00\x00\x00\x00',
+	'inq_cam_videosystem': '\x00',
+	'inq_cam_dzoom_mode': '\x03',
+	'inq_cam_focus_mode': '\x02',
+	'inq_cam_focus_pos': '\x01\x00\x00\x00',
+	'inq_cam_wb_mode': '\x00',
+	'inq_cam_ae_mode': '\x00',
+	'inq_cam_slow_shutter_mode': '\x03',
+	'inq_cam_expcomp_mode': '\x03',
+	'inq_cam_backlight_mode': '\x03',
+	}
+
+
+class RealClock():
+	virtual=False
+
+	def time(self):
+		return time.time()
+
+
+class VirtualClock():
+	"""
+	Time that only moves when advanced. The transports advance it to
+	the next scheduled reply whenever the controller waits for data, so
+	a test runs as fast as the packets can be processed.
+	"""
+	virtual=True
+
+	def __init__(self,start=0.0):
+		self.now=start
+
+	def time(self):
+		return self.now
+
+	def advance(self,until):
+		if until>self.now:
+			self.now=until
+
+
+class Axis():
+	"""one motor: a position moving with a constant velocity"""
+
+	def __init__(self,lo,hi,position=0):
+		self.lo=lo
+		self.hi=hi
+		self.start=position
+		self.since=0.0
+		self.velocity=0.0
+		self.target=None
+
+	def position(self,now):
+		position=self.start+self.velocity*(now-self.since)
+		if self.target is not None:
+			if self.velocity>0:
+				position=min(position,self.target)
+			elif self.velocity<0:
+				position=max(position,self.target)
+		return int(round(max(self.lo,min(self.hi,position))))
+
+	def moving(self,now):
+		if not self.velocity:
+			return False
+		position=self.position(now)
+		if self.target is not None:
+			return position!=self.target
+		return self.lo<position<self.hi
+
+	def move_to(self,target,rate,now):
+		"""start moving to target, returns the seconds it takes"""
+		target=max(self.lo,min(self.hi,target))
+		self.start=self.position(now)
+		self.since=now
+		self.target=target
+		distance=target-self.start
+		if not distance or rate<=0:
+			self.velocity=0.0
+			return 0.0
+		self.velocity=rate if distance>0 else -rate
+		return abs(distance)/float(rate)
+
+	def drive(self,velocity,now):
+		"""move until stopped or at the end of the range"""
+		self.start=self.position(now)
+		self.since=now
+		self.target=None
+		self.velocity=float(velocity)
+
+	def stop(self,now):
+		self.drive(0,now)
+
+
+class SimCamera():
+	"""the state of one simulated camera"""
+
+	def __init__(self,index,address=None):
+		self.index=index
+		self.address=address
+		self.values=dict((commands.BY_NAME[name].data,value) for name,value in DEFAULTS.items())
+		# tell the cameras apart by their ID
+		self.values['\x09\x04\x22']=_word(index+1)
+		self.pan=Axis(*PAN_RANGE)
+		self.tilt=Axis(*TILT_RANGE)
+		self.zoom=Axis(*ZOOM_RANGE)
+		# socket number -> the completion event of the command on it
+		self.sockets={}
+		# position memories: number -> (pan, tilt, zoom)
+		self.memories={}
+		# error code for the next command, see ViscaSimulator.inject_error
+		self.inject=None
+		# when the last direct reply is due, replies leave in order
+		self.last_reply=0.0
+
+	def powered(self):
+		return self.values['\x09\x04\x00']=='\x02'
+
+	def moving(self,now):
+		return self.pan.moving(now) or self.tilt.moving(now) or self.zoom.moving(now)
+
+	def stop(self,now):
+		for axis in (self.pan,self.tilt,self.zoom):
+			axis.stop(now)
+
+
+class ViscaSimulator():
+	"""
+	A chain of cameras answering visca packets.
+
+	Every camera has two command sockets. Commands are ACKed after
+	latency plus the time the packet needs on the wire, and complete
+	when the motion they start is done: pan/tilt at pan_rate and
+	tilt_rate position units per second and speed step, zoom at
+	zoom_rate units per second. Other commands take command_time,
+	switching the power power_time. Commands to a camera with both
+	sockets busy get "Command buffer full", commands to a camera that
+	is off "Command not executable".
+
+	Camera state that is not motion is kept as the payload of the
+	inquiry reporting it: a command with the same opcode as an inquiry
+	(01 04 35 05 and 09 04 35 for the white balance mode) sets it.
+
+	With virtual set the simulator runs on a VirtualClock.
+	"""
+
+	latency=0.001
+	command_time=0.01
+	power_time=1.0
+	pan_rate=40.0
+	tilt_rate=30.0
+	zoom_rate=0x4000/2.0
+
+	def __init__(self,cameras=1,virtual=False,baudrate=9600,addressed=True):
+		if virtual:
+			self.clock=VirtualClock()
+		else:
+			self.clock=RealClock()
+		self.baudrate=baudrate
+		self.cameras=[SimCamera(index,index+1 if addressed else None) for index in range(cameras)]
+		self.mutex=threading.RLock()
+		self.buffer=''
+		# [due, sequence, packet, action, alive, reply], reply marking
+		# the direct answers to a packet received
+		self.events=[]
+		self.sequence=0
+		# packets received, for tests
+		self.received=0
+		# when the last packet from the controller was through
+		self.line_free=0.0
+
+	def camera(self,address):
+		for camera in self.cameras:
+			if camera.address==address:
+				return camera
+		return None
+
+	def time(self):
+		return self.clock.time()
+
+	# scheduling
+
+	def _wire(self,length):
+		if not self.baudrate:
+			return 0.0
+		return length*10.0/self.baudrate
+
+	def _schedule(self,due,packet,action=None,reply=False):
+		self.sequence+=1
+		event=[due,self.sequence,packet,action,True,reply]
+		heapq.heappush(self.events,event)
+		return event
+
+	def next_due(self,replies=False):
+		"""
+		when the next event is due, None if nothing is scheduled. With
+		replies set only direct answers to a packet count, not
+		completions and other events that come later on their own.
+		"""
+		with self.mutex:
+			while self.events and not self.events[0][4]:
+				heapq.heappop(self.events)
+			if replies:
+				dues=[event[0] for event in self.events if event[4] and event[5]]
+				return min(dues) if dues else None
+			if not self.events:
+				return None
+			return self.events[0][0]
+
+	def pop_due(self):
+		"""the bytes of all replies due by now"""
+		with self.mutex:
+			now=self.clock.time()
+			out=[]
+			while self.events and self.events[0][0]<=now:
+				due,sequence,packet,action,alive,reply=heapq.heappop(self.events)
+				if not alive:
+					continue
+				if action:
+					action()
+				if packet:
+					out.append(packet)
+			return ''.join(out)
+
+	def advance(self,replies=False):
+		"""
+		on a VirtualClock, jump to the next event (see next_due).
+		returns False if there is none.
+		"""
+		due=self.next_due(replies)
+		if due is None:
+			return False
+		self.clock.advance(due)
+		return True
+
+	# faults
+
+	def inject_error(self,address,code):
+		"""answer the next command to address with error code"""
+		with self.mutex:
+			self.camera(address).inject=code
+
+	def inject_network_change(self,address=1):
+		"""a camera reports a change of the chain (0x38)"""
+		with self.mutex:
+			self._schedule(self.clock.time()+self.latency,self._header(address)+'\x38\xff')
+
+	def plug(self):
+		"""add an unaddressed camera at the end of the chain"""
+		with self.mutex:
+			camera=SimCamera(max([c.index for c in self.cameras]+[-1])+1)
+			self.cameras.append(camera)
+			self.inject_network_change(self.cameras[0].address or 1)
+			return camera
+
+	def unplug(self,index=-1):
+		"""remove a camera from the chain, the last one by default"""
+		with self.mutex:
+			camera=self.cameras.pop(index)
+			self._clear(camera,self.clock.time())
+			if self.cameras:
+				self.inject_network_change(self.cameras[0].address or 1)
+			return camera
+
+	# packets
+
+	def receive(self,data,baudrate=None):
+		"""bytes from the controller"""
+		with self.mutex:
+			if baudrate and self.baudrate and baudrate!=self.baudrate:
+				# the cameras see garbage at the wrong rate
+				self.buffer=''
+				return
+			self.buffer+=data
+			while True:
+				end=self.buffer.find('\xff')
+				if end<0:
+					break
+				packet=self.buffer[:end+1]
+				self.buffer=self.buffer[end+1:]
+				self.received+=1
+				self.handle(packet)
+
+	def _header(self,address):
+		return chr(0x80|(address<<4))
+
+	def _reply(self,camera,now,payload):
+		packet=self._header(camera.address)+payload+'\xff'
+		due=max(now+self.latency,camera.last_reply)+self._wire(len(packet))
+		camera.last_reply=due
+		return self._schedule(due,packet,reply=True)
+
+	def handle(self,packet):
+		if len(packet)<3:
+			return
+		# packets arrive one after the other
+		now=max(self.clock.time(),self.line_free)+self._wire(len(packet))
+		self.line_free=now
+		header=ord(packet[0])
+		if header==0x88:
+			self._broadcast(packet,now)
+			return
+		if header&0xf0!=0x80:
+			return
+		camera=self.camera(header&0x0f)
+		if camera is None:
+			return
+		data=packet[1:-1]
+		qq=ord(data[0])
+		if qq&0xf0==0x20:
+			self._cancel(camera,qq&0x0f,now)
+		elif data=='\x01\x00\x01':
+			self._clear(camera,now)
+			self._reply(camera,now,'\x50')
+		elif qq==0x09:
+			self._inquiry(camera,data,now)
+		elif qq==0x01:
+			self._command(camera,data,now)
+		else:
+			self._reply(camera,now,'\x60\x02')
+
+	def _broadcast(self,packet,now):
+		data=packet[1:-1]
+		if data[:1]=='\x30' and len(data)==2:
+			# address set: every camera takes the next address and
+			# passes the packet on
+			address=ord(data[1])
+			for camera in self.cameras:
+				camera.address=address
+				address+=1
+			packet='\x88\x30'+chr(address)+'\xff'
+		elif data=='\x01\x00\x01':
+			for camera in self.cameras:
+				self._clear(camera,now)
+		elif data[:1]=='\x01':
+			for camera in self.cameras:
+				if camera.address is not None:
+					self._execute(camera,data,now)
+		# the packet comes back around the chain
+		self._schedule(now+self.latency*len(self.cameras)+self._wire(len(packet)),packet,reply=True)
+
+	def _clear(self,camera,now):
+		for event in camera.sockets.values():
+			event[4]=False
+		camera.sockets.clear()
+		camera.stop(now)
+
+	def _cancel(self,camera,socket,now):
+		event=camera.sockets.pop(socket,None)
+		if event is None:
+			self._reply(camera,now,chr(0x60|socket)+'\x05')
+			return
+		event[4]=False
+		camera.stop(now)
+		self._reply(camera,now,chr(0x60|socket)+'\x04')
+
+	def _inquiry(self,camera,data,now):
+		if data=='\x09\x04\x47':
+			self._reply(camera,now,'\x50'+_word(camera.zoom.position(now)))
+		elif data=='\x09\x06\x12':
+			self._reply(camera,now,'\x50'+_word(camera.pan.position(now))+_word(camera.tilt.position(now)))
+		elif data in camera.values:
+			self._reply(camera,now,'\x50'+camera.values[data])
+		else:
+			command=commands.lookup(data)
+			if command is None or not command.reply:
+				self._reply(camera,now,'\x60\x02')
+				return
+			# a setting never changed, report zero
+			length=sum(1 if encoding==commands.BYTE else 4 for offset,encoding in command.reply)
+			self._reply(camera,now,'\x50'+'\x00'*length)
+
+	def _command(self,camera,data,now):
+		if camera.inject is not None:
+			code,camera.inject=camera.inject,None
+			if code in (0x02,0x03):
+				self._reply(camera,now,'\x60'+chr(code))
+			else:
+				self._reply(camera,now,'\x61'+chr(code))
+			return
+		if commands.lookup(data) is None:
+			self._reply(camera,now,'\x60\x02')
+			return
+		for socket in range(1,SOCKETS+1):
+			if socket not in camera.sockets:
+				break
+		else:
+			self._reply(camera,now,'\x60\x03')
+			return
+		if not camera.powered() and data[:3]!='\x01\x04\x00':
+			self._reply(camera,now,chr(0x60|socket)+'\x41')
+			return
+		duration=self._execute(camera,data,now)
+		if duration is None:
+			self._reply(camera,now,chr(0x60|socket)+'\x41')
+			return
+		ack=self._reply(camera,now,chr(0x40|socket))
+		def _done():
+			camera.sockets.pop(socket,None)
+		packet=self._header(camera.address)+chr(0x50|socket)+'\xff'
+		camera.sockets[socket]=self._schedule(ack[0]+duration+self._wire(len(packet)),packet,_done)
+
+	def _execute(self,camera,data,now):
+		"""
+		apply a command to camera, returns the seconds until it completes
+		or None if it can't be executed now
+		"""
+		opcode=data[:3]
+		if opcode=='\x01\x04\x00':
+			value=data[3:4]
+			def _switch():
+				camera.values['\x09\x04\x00']=value
+			if value!=camera.values['\x09\x04\x00']:
+				self._schedule(now+self.power_time,None,_switch)
+				if value=='\x03':
+					camera.stop(now)
+				return self.power_time
+			return self.command_time
+		if opcode=='\x01\x04\x07':
+			value=ord(data[3])
+			if value==0:
+				camera.zoom.stop(now)
+			else:
+				# 02/03 tele/wide at the standard speed, 2p/3p at speed p
+				speed=value&0x0f if value&0xf0 else 2
+				rate=self.zoom_rate*(speed+1)/8.0
+				if value==0x03 or value&0xf0==0x30:
+					rate=-rate
+				camera.zoom.drive(rate,now)
+			return 0.0
+		if opcode=='\x01\x04\x47':
+			return camera.zoom.move_to(_unword(data[3:7]),self.zoom_rate,now)
+		if opcode=='\x01\x06\x01':
+			ps,ts,lr,ud=[ord(c) for c in data[3:7]]
+			camera.pan.drive({1:-1,2:1}.get(lr,0)*ps*self.pan_rate,now)
+			camera.tilt.drive({1:1,2:-1}.get(ud,0)*ts*self.tilt_rate,now)
+			return 0.0
+		if opcode=='\x01\x06\x02':
+			ps,ts=ord(data[3]),ord(data[4])
+			return max(camera.pan.move_to(_signed(_unword(data[5:9])),ps*self.pan_rate,now),
+				camera.tilt.move_to(_signed(_unword(data[9:13])),ts*self.tilt_rate,now))
+		if opcode=='\x01\x06\x04':
+			return max(camera.pan.move_to(0,0x18*self.pan_rate,now),camera.tilt.move_to(0,0x17*self.tilt_rate,now))
+		if opcode=='\x01\x06\x05':
+			camera.pan.move_to(0,0x18*self.pan_rate,now)
+			camera.tilt.move_to(0,0x17*self.tilt_rate,now)
+			return (PAN_RANGE[1]-PAN_RANGE[0])/(0x18*self.pan_rate)
+		if opcode=='\x01\x04\x3f':
+			func,num=ord(data[3]),ord(data[4])
+			if camera.moving(now):
+				return None
+			if func==0:
+				camera.memories.pop(num,None)
+			elif func==1:
+				camera.memories[num]=(camera.pan.position(now),camera.tilt.position(now),camera.zoom.position(now))
+			elif num in camera.memories:
+				pan,tilt,zoom=camera.memories[num]
+				return max(camera.pan.move_to(pan,0x18*self.pan_rate,now),
+					camera.tilt.move_to(tilt,0x17*self.tilt_rate,now),
+					camera.zoom.move_to(zoom,self.zoom_rate,now))
+			return self.command_time
+		inquiry='\x09'+data[1:3]
+		value=data[3:]
+		if inquiry in camera.values and value=='\x10':
+			# toggle between on (2) and off (3)
+			value=chr(ord(camera.values[inquiry])^0x01)
+		command=commands.lookup(inquiry)
+		if command and command.reply and len(value)==sum(1 if encoding==commands.BYTE else 4 for offset,encoding in command.reply):
+			camera.values[inquiry]=value
+		return self.command_time
+
+
+def _word(value):
+	value&=0xffff
+	return chr(value>>12)+chr((value>>8)&0x0f)+chr((value>>4)&0x0f)+chr(value&0x0f)
+
+def _unword(data):
+	return ((ord(data[0])&0x0f)<<12)|((ord(data[1])&0x0f)<<8)|((ord(data[2])&0x0f)<<4)|(ord(data[3])&0x0f)
+
+def _signed(value):
+	if value&0x8000:
+		return value-0x10000
+	return value
+
+
+class SimTransport():
+	"""
+	In memory transport to a ViscaSimulator, with the serial port API
+	Visca uses (see pyviscalib.transport).
+	"""
+
+	# on virtual time, completions are only delivered once nothing was
+	# written for this many (real) seconds
+	idle=0.005
+
+	def __init__(self,simulator,timeout=2):
+		self.simulator=simulator
+		self.timeout=timeout
+		self.baudrate=simulator.baudrate
+		self.buffer=''
+		self.open=True
+		self.cond=threading.Condition()
+		self.last_write=0
+
+	def isOpen(self):
+		return self.open
+
+	def close(self):
+		with self.cond:
+			self.open=False
+			self.cond.notify_all()
+
+	def fileno(self):
+		raise IOError("SimTransport has no file descriptor, use ViscaPtyServer")
+
+	def write(self,data):
+		self.simulator.receive(str(data),self.baudrate)
+		with self.cond:
+			self.last_write=time.time()
+			self.cond.notify_all()
+
+	def _collect(self):
+		self.buffer+=self.simulator.pop_due()
+
+	def inWaiting(self):
+		with self.cond:
+			self._collect()
+			return len(self.buffer)
+
+	def flushInput(self):
+		with self.cond:
+			self._collect()
+			self.buffer=''
+
+	def read(self,size=1):
+		end=None
+		if self.timeout is not None:
+			end=time.time()+self.timeout
+		with self.cond:
+			while self.open:
+				self._collect()
+				if self.buffer:
+					break
+				simulator=self.simulator
+				if simulator.clock.virtual:
+					# answers come at once, later events when the
+					# controller has gone quiet
+					quiet=time.time()-self.last_write>=self.idle
+					if simulator.advance(not quiet):
+						continue
+					wait=self.idle
+				else:
+					due=simulator.next_due()
+					wait=0.1
+					if due is not None:
+						wait=min(wait,max(0,due-simulator.time()))
+				if end is not None:
+					remaining=end-time.time()
+					if remaining<=0:
+						break
+					wait=min(wait,remaining)
+				self.cond.wait(wait)
+			data=self.buffer[:size]
+			self.buffer=self.buffer[size:]
+			return data
+
+
+class ViscaPtyServer():
+	"""
+	Serves a ViscaSimulator on a pseudo terminal. port is the device
+	name of the slave side, open it like a serial port.
+	"""
+
+	idle=SimTransport.idle
+
+	def __init__(self,simulator):
+		self.simulator=simulator
+		self.last_receive=0
+		self.master,self.slave=pty.openpty()
+		tty.setraw(self.slave)
+		self.port=os.ttyname(self.slave)
+		self.running=False
+		self.thread=None
+
+	def start(self):
+		self.running=True
+		self.thread=threading.Thread(target=self.serve,name='visca-pty-server')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running=False
+		if self.thread:
+			self.thread.join()
+			self.thread=None
+		os.close(self.master)
+		os.close(self.slave)
+
+	def serve(self):
+		simulator=self.simulator
+		while self.running:
+			out=simulator.pop_due()
+			if out:
+				os.write(self.master,out)
+				continue
+			if simulator.clock.virtual:
+				quiet=time.time()-self.last_receive>=self.idle
+				if simulator.advance(not quiet):
+					continue
+				wait=self.idle
+			else:
+				due=simulator.next_due()
+				wait=0.1
+				if due is not None:
+					wait=min(wait,max(0,due-simulator.time()))
+			ready,_,_=select.select([self.master],[],[],wait)
+			if ready:
+				simulator.receive(os.read(self.master,1024))
+				self.last_receive=time.time()
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Packet trace recorder and capture file decoder
+
+Every Visca keeps the last packets it sent and received in a ViscaTrace.
+flush() appends them to a capture file, which can be printed later with
+
+  python -m pyviscalib.trace capture.vtrace
+"""
+
+import sys
+import time
+import struct
+import threading
+
+import commands
+
+SENT=0
+RECEIVED=1
+
+TITLES={SENT: 'sent', RECEIVED: 'recv'}
+
+# longest packet kept, longer ones (garbage on the line) are truncated
+MAXLEN=16
+
+# timestamp, direction, camera, length, packet bytes
+RECORD=struct.Struct('<dbbB%ds' % MAXLEN)
+
+MAGIC='VTRC'
+FILE_HEADER=struct.Struct('<4sHH')
+VERSION=1
+
+
+class ViscaTrace():
+	"""
+	Ring buffer with the last size packets. The records are packed into
+	one preallocated bytearray, so recording a packet costs a single
+	struct.pack_into and never allocates.
+	"""
+
+	def __init__(self,size=4096):
+		self.size=size
+		self.buffer=bytearray(size*RECORD.size)
+		# number of packets recorded so far, and how many of those were
+		# flushed to the capture file
+		self.count=0
+		self.flushed=0
+		self.dropped=0
+		self.mutex=threading.Lock()
+
+	def __len__(self):
+		return min(self.count,self.size)
+
+	def record(self,direction,camera,packet):
+		with self.mutex:
+			RECORD.pack_into(self.buffer,(self.count%self.size)*RECORD.size,time.time(),direction,camera,min(len(packet),MAXLEN),packet)
+			self.count+=1
+
+	def _unpack(self,index):
+		timestamp,direction,camera,length,data=RECORD.unpack_from(self.buffer,(index%self.size)*RECORD.size)
+		return timestamp,direction,camera,data[:length]
+
+	def records(self,since=0):
+		"""
+		(timestamp, direction, camera, packet) for the recorded packets
+		still in the buffer, oldest first, starting at number since
+		"""
+		with self.mutex:
+			start=max(since,self.count-self.size)
+			return [self._unpack(index) for index in range(start,self.count)]
+
+	def clear(self):
+		with self.mutex:
+			self.count=0
+			self.flushed=0
+
+	def flush(self,filename):
+		"""
+		append the packets recorded since the last flush to the capture
+		file filename, returns the number of packets written
+		"""
+		with self.mutex:
+			start=max(self.flushed,self.count-self.size)
+			self.dropped+=start-self.flushed
+			end=self.count
+			chunks=[]
+			for index in range(start,end):
+				offset=(index%self.size)*RECORD.size
+				chunks.append(str(self.buffer[offset:offset+RECORD.size]))
+			self.flushed=end
+		with open(filename,'ab') as f:
+			if f.tell()==0:
+				f.write(FILE_HEADER.pack(MAGIC,VERSION,RECORD.size))
+			f.write(''.join(chunks))
+		return len(chunks)
+
+
+def read_capture(filename):
+	"""yield (timestamp, direction, camera, packet) from a capture file"""
+	with open(filename,'rb') as f:
+		magic,version,size=FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+		if magic!=MAGIC or version!=VERSION or size!=RECORD.size:
+			raise ValueError("%s is not a visca trace capture" % filename)
+		while True:
+			data=f.read(RECORD.size)
+			if len(data)<RECORD.size:
+				return
+			timestamp,direction,camera,length,packet=RECORD.unpack(data)
+			yield timestamp,direction,camera,packet[:length]
+
+
+def format_packet(packet,title=None):
+	"""the human readable description of packet, as printed by Visca.dump"""
+	if not packet:
+		return ''
+
+	header=ord(packet[0])
+	term=ord(packet[-1:])
+	qq=ord(packet[1]) if len(packet)>1 else 0
+
+	sender = (header&0b01110000)>>4
+	broadcast = (header&0b1000)>>3
+	recipient = (header&0b0111)
+
+	if broadcast:
+		recipient_s="*"
+	else:
+		recipient_s=str(recipient)
+
+	lines=["-----"]
+
+	if title:
+		lines.append("packet (%s) [%d => %s] len=%d: %s" % (title,sender,recipient_s,len(packet),packet.encode('hex')))
+	else:
+		lines.append("packet [%d => %s] len=%d: %s" % (sender,recipient_s,len(packet),packet.encode('hex')))
+
+	command=commands.lookup(packet[1:-1])
+	if command:
+		lines.append(" Command....: %s" % command.name)
+
+	lines.append(" QQ.........: %02x" % qq)
+
+	if qq==0x01:
+		lines.append("              (Command)")
+	if qq==0x09:
+		lines.append("              (Inquiry)")
+
+	if len(packet)>3:
+		rr=ord(packet[2])
+		lines.append(" RR.........: %02x" % rr)
+
+		if rr==0x00:
+			lines.append("              (Interface)")
+		if rr==0x04:
+			lines.append("              (Camera [1])")
+		if rr==0x06:
+			lines.append("              (Pan/Tilter)")
+
+	if len(packet)>4:
+		data=packet[3:-1]
+		lines.append(" Data.......: %s" % data.encode('hex'))
+	else:
+		lines.append(" Data.......: None")
+
+	if not term==0xff:
+		lines.append("ERROR: Packet not terminated correctly")
+		return '\n'.join(lines)
+
+	messagetype=(qq & 0b11110000)>>4
+	socketno=(qq & 0b1111)
+
+	if len(packet)==3 and messagetype==4:
+		lines.append(" packet: ACK for socket %02x" % socketno)
+
+	if len(packet)==3 and messagetype==5:
+		lines.append(" packet: COMPLETION for socket %02x" % socketno)
+
+	if len(packet)>3 and messagetype==5:
+		ret=packet[2:-1].encode('hex')
+		lines.append(" packet: COMPLETION for socket %02x, data=%s" % (socketno,ret))
+
+	if len(packet)==4 and messagetype==6:
+		lines.append(" packet: ERROR!")
+
+		errcode  = ord(packet[2])
+
+		#these two are special, socket is zero and has no meaning:
+		if errcode==0x02 and socketno==0:
+			lines.append("        : Syntax Error")
+		if errcode==0x03 and socketno==0:
+			lines.append("        : Command Buffer Full")
+
+		if errcode==0x04:
+			lines.append("        : Socket %i: Command canceled" % socketno)
+
+		if errcode==0x05:
+			lines.append("        : Socket %i: Invalid socket selected" % socketno)
+
+		if errcode==0x41:
+			lines.append("        : Socket %i: Command not executable" % socketno)
+
+	if len(packet)==3 and qq==0x38:
+		lines.append("Network Change - we should immedeately issue a renumbering!")
+
+	return '\n'.join(lines)
+
+
+def main(argv):
+	if len(argv)!=2:
+		print >>sys.stderr, "usage: python -m pyviscalib.trace capture.vtrace"
+		return 2
+	for timestamp,direction,camera,packet in read_capture(argv[1]):
+		stamp=time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(timestamp))
+		print "%s.%06d cam=%d" % (stamp,int((timestamp%1)*1000000),camera)
+		print format_packet(packet,TITLES.get(direction))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Eased pan/tilt/zoom moves along keyframed paths"""
+
+import math
+import time
+import threading
+
+SPEED='speed'
+WAYPOINTS='waypoints'
+
+
+def linear(x):
+	return x
+
+def ease_in_out(x):
+	return x*x*(3-2*x)
+
+
+class Trajectory():
+	"""
+	A path through keyframes (t, pan, tilt, zoom), t in seconds from the
+	start. An axis that is None in a keyframe holds its previous value,
+	in the first keyframe it starts where the camera is. Between
+	keyframes every axis follows the ease function.
+
+	The rates convert between positions and visca speeds: pan_rate and
+	tilt_rate are position units per second per speed step, zoom_rate
+	is units per second per zoom speed step. Measure them for your
+	camera model, the defaults match the simulator.
+	"""
+
+	pan_rate=40.0
+	tilt_rate=30.0
+	zoom_rate=0x4000/2.0/8
+
+	def __init__(self,keyframes,rate=10.0,ease=ease_in_out):
+		self.keyframes=sorted(keyframes)
+		if not self.keyframes or self.keyframes[0][0]!=0:
+			raise ValueError("The first keyframe has to be at t=0")
+		self.rate=rate
+		self.ease=ease
+
+	def duration(self):
+		return self.keyframes[-1][0]
+
+	def resolve(self,start):
+		"""the keyframes with every None replaced, start is (pan, tilt, zoom)"""
+		resolved=[]
+		previous=list(start)
+		for keyframe in self.keyframes:
+			values=[previous[axis] if keyframe[axis+1] is None else keyframe[axis+1] for axis in range(3)]
+			resolved.append((keyframe[0],)+tuple(values))
+			previous=values
+		return resolved
+
+	def position(self,keyframes,t):
+		"""(pan, tilt, zoom) at t on the resolved keyframes"""
+		for index in range(1,len(keyframes)):
+			t1=keyframes[index][0]
+			if t<=t1 or index==len(keyframes)-1:
+				t0=keyframes[index-1][0]
+				if t1<=t0:
+					x=1.0
+				else:
+					x=self.ease(max(0.0,min(1.0,(t-t0)/float(t1-t0))))
+				a=keyframes[index-1]
+				b=keyframes[index]
+				return tuple(a[axis]+(b[axis]-a[axis])*x for axis in (1,2,3))
+		return tuple(keyframes[0][1:])
+
+	def times(self):
+		step=1.0/self.rate
+		count=int(math.ceil(self.duration()*self.rate))
+		return [min(i*step,self.duration()) for i in range(count+1)]
+
+	def plan_speeds(self,start):
+		"""
+		[(t, pan speed, tilt speed, zoom speed, expected position)] with
+		signed visca speeds, held from t until the next entry. The
+		position the quantized speeds actually reach is carried along,
+		so rounding errors are made up by the following steps.
+		"""
+		keyframes=self.resolve(start)
+		times=self.times()
+		plan=[]
+		reached=list(keyframes[0][1:])
+		for t,next_t in zip(times,times[1:]):
+			dt=next_t-t
+			target=self.position(keyframes,next_t)
+			speeds=[]
+			for axis,rate,top in ((0,self.pan_rate,0x18),(1,self.tilt_rate,0x17),(2,self.zoom_rate,8)):
+				velocity=(target[axis]-reached[axis])/dt
+				speed=int(round(abs(velocity)/rate))
+				speed=min(speed,top)
+				if velocity<0:
+					speed=-speed
+				reached[axis]+=speed*rate*dt
+				speeds.append(speed)
+			plan.append((t,speeds[0],speeds[1],speeds[2],tuple(reached)))
+		plan.append((times[-1],0,0,0,tuple(keyframes[-1][1:])))
+		return plan
+
+	def plan_waypoints(self,start):
+		"""
+		[(t, pan, tilt, zoom, ps, ts)]: absolute positions with the pan
+		and tilt speeds that get there by the next waypoint
+		"""
+		keyframes=self.resolve(start)
+		times=self.times()
+		plan=[]
+		previous=keyframes[0][1:]
+		for t,next_t in zip(times,times[1:]):
+			dt=next_t-t
+			pan,tilt,zoom=self.position(keyframes,next_t)
+			ps=int(math.ceil(abs(pan-previous[0])/(dt*self.pan_rate)))
+			ts=int(math.ceil(abs(tilt-previous[1])/(dt*self.tilt_rate)))
+			plan.append((t,int(round(pan)),int(round(tilt)),int(round(zoom)),max(1,min(0x18,ps)),max(1,min(0x17,ts))))
+			previous=(pan,tilt,zoom)
+		return plan
+
+
+class TrajectoryPlayer():
+	"""
+	Plays a Trajectory on one camera.
+
+	prepare() reads the start position (from the poller if one is given,
+	else by inquiry, which the cache answers if the Visca has one) and
+	turns the plan into encoded packets. The send loop then only waits
+	for the time of each step and submits its packets without waiting
+	for replies, so the pan/tilt and the zoom command of a step run on
+	their own command sockets. A packet that gets no reply is given up
+	after the first timeout of the retry policy, see Visca.submit. At
+	the end the final keyframe is sent as absolute positions, correcting
+	what the speed commands missed.
+
+	mode is SPEED for a stream of cmd_ptd and zoom speed commands, or
+	WAYPOINTS for cmd_ptd_abs and cmd_cam_zoom_direct. A waypoint for an
+	axis that is still moving to the previous one is skipped, the
+	camera then goes straight to the next. Use a pipelining Visca, so
+	the final positions wait for a free socket instead of failing.
+	"""
+
+	def __init__(self,visca,device,trajectory,mode=SPEED,poller=None):
+		self.visca=visca
+		self.device=device
+		self.trajectory=trajectory
+		self.mode=mode
+		self.poller=poller
+		# [(t, [packet, ...])]
+		self.steps=None
+		self.running=False
+		self.thread=None
+		self.late=0
+		self.skipped=0
+
+	def start_position(self):
+		if self.poller:
+			state=self.poller.state(self.device)
+			if state.pan is not None and state.zoom is not None:
+				return (state.pan,state.tilt,state.zoom)
+		pan,tilt=self.visca.inq_cam_pan_tilt_pos(self.device)
+		return (pan,tilt,self.visca.inq_cam_zoom_pos(self.device))
+
+	def _packet(self,name,*values):
+		return self.visca.template(self.device,name).encode(values)
+
+	def _ptd(self,pan,tilt):
+		if not pan and not tilt:
+			return self._packet('cmd_ptd_stop')
+		lr=0x01 if pan<0 else 0x02 if pan>0 else 0x03
+		ud=0x01 if tilt>0 else 0x02 if tilt<0 else 0x03
+		return self._packet('cmd_ptd',max(1,abs(pan)),max(1,abs(tilt)),lr,ud)
+
+	def _zoom(self,speed):
+		if not speed:
+			return self._packet('cmd_cam_zoom_stop')
+		if speed>0:
+			return self._packet('cmd_cam_zoom_tele_speed',speed-1)
+		return self._packet('cmd_cam_zoom_wide_speed',-speed-1)
+
+	def _absolute(self,pan,tilt,zoom,ps=0x18,ts=0x14):
+		return [self._packet('cmd_ptd_abs',ts,ps,int(round(pan)),int(round(tilt))),
+			self._packet('cmd_cam_zoom_direct',int(round(zoom)))]
+
+	def prepare(self):
+		start=self.start_position()
+		steps=[]
+		if self.mode==SPEED:
+			previous=None
+			for t,pan,tilt,zoom,expected in self.trajectory.plan_speeds(start):
+				packets=[]
+				# only what changed goes on the bus
+				if previous is None or (pan,tilt)!=previous[:2]:
+					packets.append(self._ptd(pan,tilt))
+				if previous is None or zoom!=previous[2]:
+					packets.append(self._zoom(zoom))
+				previous=(pan,tilt,zoom)
+				if packets:
+					steps.append((t,packets))
+		else:
+			for t,pan,tilt,zoom,ps,ts in self.trajectory.plan_waypoints(start):
+				steps.append((t,self._absolute(pan,tilt,zoom,ps,ts)))
+		final=self.trajectory.resolve(start)[-1]
+		steps.append((final[0],self._absolute(*final[1:])))
+		self.steps=steps
+		return steps
+
+	def start(self):
+		if self.steps is None:
+			self.prepare()
+		self.running=True
+		self.thread=threading.Thread(target=self.run,name='visca-trajectory')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running=False
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread=None
+
+	def join(self,timeout=None):
+		if self.thread:
+			self.thread.join(timeout)
+
+	def run(self):
+		"""play the prepared steps in the calling thread"""
+		if self.steps is None:
+			self.prepare()
+		self.running=True
+		visca=self.visca
+		device=self.device
+		waypoints=self.mode==WAYPOINTS
+		last=len(self.steps)-1
+		# the latest request per axis
+		moving=[None,None]
+		started=time.time()
+		for index,(t,packets) in enumerate(self.steps):
+			if not self.running:
+				break
+			delay=started+t-time.time()
+			if delay>0:
+				time.sleep(delay)
+			else:
+				self.late+=1
+			for axis,packet in enumerate(packets):
+				if waypoints and index<last and moving[axis] and not _finished(moving[axis]):
+					self.skipped+=1
+					continue
+				moving[axis]=visca.submit(device,packet)
+		if not self.running:
+			visca.submit(device,self._packet('cmd_ptd_stop'))
+			visca.submit(device,self._packet('cmd_cam_zoom_stop'))
+		self.running=False
+
+def _finished(future):
+	# the request was answered and, if it was ACKed, the command completed
+	if not future.done():
+		return False
+	if future.exception() is not None:
+		return True
+	handle=future.result()
+	return not hasattr(handle,'ack') or handle.done()
@@ -0,0 +1,287 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Transports carrying visca packets: serial, raw TCP and VISCA over IP
+
+A transport offers the part of the pyserial API Visca uses: read(size)
+blocking up to the timeout, inWaiting(), write(), flushInput(),
+isOpen(), close(), fileno() and a baudrate attribute. serial.Serial is
+used as is for serial ports.
+"""
+
+import serial
+import socket
+import select
+import struct
+import threading
+import time
+import fcntl
+import termios
+import array
+
+
+VISCA_IP_PORT=52381
+
+# VISCA over IP payload types
+IP_COMMAND=0x0100
+IP_INQUIRY=0x0110
+IP_REPLY=0x0111
+IP_DEVICE_SETTING=0x0120
+IP_CONTROL=0x0200
+IP_CONTROL_REPLY=0x0201
+
+IP_HEADER=struct.Struct('>HHI')
+
+
+def open_transport(portname,baudrate=9600,timeout=2):
+	"""
+	open the transport for portname:
+
+	  tcp://host:port      raw visca packets over a TCP connection
+	  udp://host[:port]    VISCA over IP, port 52381 by default
+	  sim://N[?virtual]    N simulated cameras, see pyviscalib.simulator
+	  anything else        a serial device
+
+	a transport object is returned unchanged.
+	"""
+	if not isinstance(portname,basestring):
+		return portname
+	if portname.startswith('tcp://'):
+		host,port=_split_address(portname[6:],None)
+		return TCPTransport(host,port,timeout)
+	if portname.startswith('udp://'):
+		host,port=_split_address(portname[6:],VISCA_IP_PORT)
+		return UDPTransport(host,port,timeout)
+	if portname.startswith('sim://'):
+		from simulator import ViscaSimulator, SimTransport
+		cameras,_,options=portname[6:].partition('?')
+		return SimTransport(ViscaSimulator(int(cameras or 1),virtual=options=='virtual',baudrate=baudrate),timeout)
+	return serial.Serial(portname,baudrate,timeout=timeout,stopbits=1,bytesize=8,rtscts=False, dsrdtr=False)
+
+def _split_address(address,default_port):
+	host,_,port=address.partition(':')
+	if port:
+		return host,int(port)
+	if default_port is None:
+		raise ValueError("No port in address '%s'" % address)
+	return host,default_port
+
+
+class TCPTransport():
+	"""visca packets as a plain byte stream over TCP, e.g. to a serial server"""
+
+	baudrate=None
+
+	def __init__(self,host,port,timeout=2):
+		self.timeout=timeout
+		self.sock=socket.create_connection((host,port))
+		self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def isOpen(self):
+		return self.sock is not None
+
+	def close(self):
+		if self.sock:
+			self.sock.close()
+			self.sock=None
+
+	def inWaiting(self):
+		count=array.array('i',[0])
+		fcntl.ioctl(self.sock.fileno(),termios.FIONREAD,count,True)
+		return count[0]
+
+	def flushInput(self):
+		while self.inWaiting():
+			self.sock.recv(4096)
+
+	def read(self,size=1):
+		if self.timeout is not None:
+			ready,_,_=select.select([self.sock],[],[],self.timeout)
+			if not ready:
+				return ''
+		data=self.sock.recv(size)
+		if not data:
+			self.close()
+		return data
+
+	def write(self,data):
+		self.sock.sendall(data)
+
+
+class UDPTransport():
+	"""
+	VISCA over IP: every packet travels in a UDP datagram with an 8 byte
+	header (payload type, payload length, sequence number).
+
+	Each message gets the next sequence number and the camera echoes it
+	in its replies. On open, and when the camera reports a sequence
+	number error, the sequence numbers are reset with the RESET control
+	command.
+
+	Lost datagrams are not sent again here: a packet without reply is
+	resent by Visca according to its retry_policy, which also knows to
+	drop the replies to both copies.
+	"""
+
+	baudrate=None
+
+	def __init__(self,host,port=VISCA_IP_PORT,timeout=2):
+		self.address=(host,port)
+		self.timeout=timeout
+		self.sock=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.sock.connect(self.address)
+		self.mutex=threading.Lock()
+		self.buffer=''
+		self.sequence=0
+		self.reset()
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def isOpen(self):
+		return self.sock is not None
+
+	def close(self):
+		if self.sock:
+			self.sock.close()
+			self.sock=None
+
+	def reset(self):
+		"""reset the sequence numbers on both sides"""
+		with self.mutex:
+			self.sequence=0
+			self.sock.send(IP_HEADER.pack(IP_CONTROL,1,0)+'\x01')
+
+	def write(self,data):
+		if data[:1]=='\x88':
+			kind=IP_DEVICE_SETTING
+		elif data[1:2]=='\x09':
+			kind=IP_INQUIRY
+		else:
+			kind=IP_COMMAND
+		with self.mutex:
+			self.sequence=(self.sequence+1)&0xffffffff
+			self.sock.send(IP_HEADER.pack(kind,len(data),self.sequence)+str(data))
+
+	def _receive(self):
+		# take all waiting datagrams, returns True if any visca data came in
+		got=False
+		while True:
+			ready,_,_=select.select([self.sock],[],[],0)
+			if not ready:
+				return got
+			datagram=self.sock.recv(2048)
+			if len(datagram)<IP_HEADER.size:
+				continue
+			kind,length,sequence=IP_HEADER.unpack_from(datagram)
+			payload=datagram[IP_HEADER.size:IP_HEADER.size+length]
+			if kind==IP_REPLY:
+				self.buffer+=payload
+				got=True
+			elif kind==IP_CONTROL_REPLY and payload[:1]=='\x0f':
+				print 'visca: VISCA over IP error %s' % payload.encode('hex')
+				if payload=='\x0f\x01':
+					# sequence number abnormality
+					self.reset()
+
+	def inWaiting(self):
+		self._receive()
+		return len(self.buffer)
+
+	def flushInput(self):
+		self._receive()
+		self.buffer=''
+
+	def read(self,size=1):
+		end=None
+		if self.timeout is not None:
+			end=time.time()+self.timeout
+		while not self._receive():
+			if self.buffer:
+				break
+			wait=None
+			if end is not None:
+				wait=end-time.time()
+				if wait<=0:
+					return ''
+			select.select([self.sock],[],[],wait)
+		data=self.buffer[:size]
+		self.buffer=self.buffer[size:]
+		return data
+
+
+class ViscaIPServer():
+	"""
+	Local VISCA over IP endpoint for testing without cameras.
+
+	Unwraps every datagram, passes the visca packet to handler(packet),
+	which returns a list of reply packets, and sends those back with the
+	sequence number of the request. The default handler ACKs and
+	completes every command and answers inquiries with a syntax error.
+	"""
+
+	def __init__(self,handler=None,host='127.0.0.1',port=0):
+		self.handler=handler or self.default_handler
+		self.sock=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.sock.bind((host,port))
+		self.address=self.sock.getsockname()
+		self.running=False
+		self.thread=None
+
+	def url(self):
+		return 'udp://%s:%d' % self.address
+
+	def default_handler(self,packet):
+		if packet[1:2]=='\x01':
+			return ['\x90\x41\xff','\x90\x51\xff']
+		return ['\x90\x60\x02\xff']
+
+	def start(self):
+		self.running=True
+		self.thread=threading.Thread(target=self.serve,name='visca-ip-server')
+		self.thread.daemon=True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.running=False
+		if self.thread:
+			self.thread.join()
+			self.thread=None
+		self.sock.close()
+
+	def serve(self):
+		while self.running:
+			ready,_,_=select.select([self.sock],[],[],0.1)
+			if not ready:
+				continue
+			datagram,client=self.sock.recvfrom(2048)
+			if len(datagram)<IP_HEADER.size:
+				continue
+			kind,length,sequence=IP_HEADER.unpack_from(datagram)
+			payload=datagram[IP_HEADER.size:IP_HEADER.size+length]
+			if kind==IP_CONTROL:
+				self.sock.sendto(IP_HEADER.pack(IP_CONTROL_REPLY,1,sequence)+'\x01',client)
+				continue
+			for reply in self.handler(payload):
+				self.sock.sendto(IP_HEADER.pack(IP_REPLY,len(reply),sequence)+reply,client)
@@ -20,258 +20,957 @@
 
 """PyVisca by Florian Streibelt <pyvisca@f-streibelt.de>"""
 
-import serial,sys
+import os
+import json
+import difflib
+import heapq
 import time
+import atexit
+import threading
+from collections import deque
 from thread import allocate_lock
+from transport import open_transport
+from trace import ViscaTrace, SENT, RECEIVED, format_packet
+from metrics import ViscaMetrics
+import commands
+from commands import BYTE, NIBBLE
 
 class ViscaError(RuntimeError):
 	pass
 
 class ViscaNetworkChange(RuntimeError):
 	pass
-	
-class Visca():
-	DEBUG=False
 
-	def __init__(self,portname="/dev/ttyUSB0"):
-		self.serialport=None
-		self.mutex = allocate_lock()
-		self.portname=portname
-		self.open_port()
-		self.socket_in_use = {}
-		self.socket_completed = {}
+class ViscaTimeout(ViscaError):
+	pass
 
-	def open_port(self):
+class ViscaReplyError(ViscaError):
+	"""an error reply from a camera, with its error code and socket"""
+	def __init__(self,message,code=None,socket=0,packet=None):
+		ViscaError.__init__(self,message)
+		self.code=code
+		self.socket=socket
+		self.packet=packet
 
-		with self.mutex:
+class ViscaSyntaxError(ViscaReplyError):
+	pass
 
-			if (self.serialport == None):
-				try:
-					self.serialport = serial.Serial(self.portname,9600,timeout=2,stopbits=1,bytesize=8,rtscts=False, dsrdtr=False)
-					self.serialport.flushInput()
-				except Exception as e:
-					print ("Exception opening serial port '%s' for display: %s\n" % (self.portname,e))
-					raise e
-					self.serialport = None
+class ViscaBufferFull(ViscaReplyError):
+	pass
 
-	def dump(self,packet,title=None):
-		if not self.DEBUG: return
-		if not packet or len(packet)==0:
-			return
+class ViscaCanceled(ViscaReplyError):
+	pass
 
-		header=ord(packet[0])
-		term=ord(packet[-1:])
-		qq=ord(packet[1])
+class ViscaInvalidSocket(ViscaReplyError):
+	pass
 
-		sender = (header&0b01110000)>>4
-		broadcast = (header&0b1000)>>3
-		recipient = (header&0b0111)
+class ViscaNotExecutable(ViscaReplyError):
+	pass
+
+# error code -> exception class, message
+ERRORS={
+	0x02: (ViscaSyntaxError, "Syntax error"),
+	0x03: (ViscaBufferFull, "Command buffer full"),
+	0x04: (ViscaCanceled, "Command canceled on socket %d"),
+	0x05: (ViscaInvalidSocket, "Invalid socket %d"),
+	0x41: (ViscaNotExecutable, "Command not currently executable on socket %d"),
+	}
+
+def reply_error(packet):
+	"""the exception for an error reply packet"""
+	socketno=ord(packet[1])&0b00001111
+	if len(packet)!=4:
+		return ViscaReplyError("Received visca error: Malformed error reply, raw=%s" % packet.encode('hex'),None,socketno,packet)
+	code=ord(packet[2])
+	cls,message=ERRORS.get(code,(ViscaReplyError,None))
+	if message is None:
+		message="Code=0x%02x, socketno=%d, raw=%s" % (code,socketno,packet.encode('hex'))
+	elif '%d' in message:
+		message=message % socketno
+	return cls("Received visca error: %s" % message,code,socketno,packet)
+
+# what a reply is, looked up by its second byte
+REPLY_INQUIRY=0
+REPLY_ACK=1
+REPLY_COMPLETION=2
+REPLY_ERROR=3
+REPLY_NETWORK_CHANGE=4
+
+def _reply_kinds():
+	kinds=[REPLY_INQUIRY]*256
+	for qq in range(256):
+		messagetype=qq>>4
+		if messagetype==4:
+			kinds[qq]=REPLY_ACK
+		elif messagetype==5 and qq&0b00001111:
+			kinds[qq]=REPLY_COMPLETION
+		elif messagetype==6:
+			kinds[qq]=REPLY_ERROR
+	kinds[0x38]=REPLY_NETWORK_CHANGE
+	return tuple(kinds)
+
+REPLY_KINDS=_reply_kinds()
+
+def _senders():
+	senders=[(header&0b01110000)>>4 for header in range(256)]
+	# replies to broadcasts travel around the daisy chain unchanged
+	senders[0x88]=-1
+	return tuple(senders)
+
+# sender address by the first byte of a reply, -1 for broadcasts
+SENDERS=_senders()
+
+# reader threads are daemons, they stop quietly when the interpreter
+# exits instead of tripping over the modules being torn down
+_running=True
+
+def _exiting():
+	global _running
+	_running=False
+
+atexit.register(_exiting)
+
+class ViscaFuture():
+	"""
+	Result of a request that is finished by the reader thread.
+
+	Poll it with done(), block on it with wait() or result() and chain
+	further processing with then(), which returns a new future for the
+	value returned by the callback.
+	"""
+
+	def __init__(self):
+		self.cond=threading.Condition()
+		self.finished=False
+		self.value=None
+		self.error=None
+		self.callbacks=[]
+
+	def done(self):
+		return self.finished
+
+	def set_result(self,value):
+		self._finish(value,None)
+
+	def set_exception(self,error):
+		self._finish(None,error)
+
+	def _finish(self,value,error):
+		with self.cond:
+			if self.finished:
+				return
+			self.value=value
+			self.error=error
+			self.finished=True
+			self.cond.notify_all()
+			callbacks=self.callbacks
+			self.callbacks=[]
+		for fn in callbacks:
+			fn(self)
+
+	def add_done_callback(self,fn):
+		with self.cond:
+			if not self.finished:
+				self.callbacks.append(fn)
+				return
+		fn(self)
 
-		if broadcast:
-			recipient_s="*"
+	def wait(self,timeout=None):
+		"""
+		wait until finished, at most timeout seconds (None: forever).
+		returns done()
+		"""
+		with self.cond:
+			if timeout is None:
+				while not self.finished:
+					self.cond.wait()
+			else:
+				end=time.time()+timeout
+				while not self.finished:
+					remaining=end-time.time()
+					if remaining<=0:
+						break
+					self.cond.wait(remaining)
+		return self.finished
+
+	def exception(self,timeout=None):
+		if not self.wait(timeout):
+			raise ViscaTimeout("Timeout waiting for reply")
+		return self.error
+
+	def result(self,timeout=None):
+		if not self.wait(timeout):
+			raise ViscaTimeout("Timeout waiting for reply")
+		if self.error is not None:
+			raise self.error
+		return self.value
+
+	def then(self,fn):
+		chained=ViscaFuture()
+		def _chain(future):
+			if future.error is not None:
+				chained.set_exception(future.error)
+				return
+			try:
+				chained.set_result(fn(future.value))
+			except Exception as e:
+				chained.set_exception(e)
+		self.add_done_callback(_chain)
+		return chained
+
+class ViscaCommand(ViscaFuture):
+	"""
+	Handle for a command the camera has accepted. Created from the ACK,
+	finished with the completion packet or with the error the camera
+	reports for the socket.
+	"""
+
+	def __init__(self,ack):
+		ViscaFuture.__init__(self)
+		self.ack=ack
+		self.device=(ord(ack[0])&0b01110000)>>4
+		self.socket=ord(ack[1])&0b1111
+		# the command and when it was sent, set when the ACK is
+		# matched with its request
+		self.packet=None
+		self.sent_at=None
+
+	def __repr__(self):
+		return '<ViscaCommand cam=%d socket=%d done=%s>' % (self.device,self.socket,self.finished)
+
+class ViscaRetryPolicy():
+	"""
+	How send_packet deals with packets that get no reply.
+
+	The timeout for a packet is the time it and its longest expected
+	reply need on the wire at the current baud rate, plus turnaround
+	for the camera to answer, multiplied by backoff for every retry and
+	capped at max_timeout. A packet is sent retries more times before
+	giving up. With the defaults a packet that gets no reply is given up
+	after well under two seconds. Once every camera on the bus has left clear_after packets
+	in a row without reply the bus is reset with cmd_if_clear_all (0
+	disables that). A single camera that is missing never clears the
+	bus, the commands running on the others would be canceled.
+	"""
+	retries=2
+	turnaround=0.2
+	backoff=2.0
+	max_timeout=2.0
+	clear_after=3
+
+	def __init__(self,**kwargs):
+		for name,value in kwargs.items():
+			if not hasattr(self,name):
+				raise TypeError("Unknown retry policy setting '%s'" % name)
+			setattr(self,name,value)
+
+	def timeout(self,baudrate,packet_length,reply_length,attempt):
+		if baudrate:
+			# 8 data bits plus start and stop bit per byte
+			wire=(packet_length+reply_length)*10.0/baudrate
 		else:
-			recipient_s=str(recipient)
+			wire=0
+		return min(self.max_timeout,(wire+self.turnaround)*self.backoff**attempt)
 
-		print "-----"
+class ViscaTemplate():
+	"""
+	Preassembled packet (header, data and terminator) for one command to
+	one recipient. encode() patches the parameters into the buffer in
+	place, so sending needs no string building.
+	"""
 
-		if title:
-			print "packet (%s) [%d => %s] len=%d: %s" % (title,sender,recipient_s,len(packet),packet.encode('hex'))
+	def __init__(self,recipient,data,fields):
+		if recipient==-1:
+			header=0x88
 		else:
-			print "packet [%d => %s] len=%d: %s" % (sender,sender,recipient_s,len(packet),packet.encode('hex'))
+			header=0x80|(recipient&0b111)
+		self.buffer=bytearray(chr(header)+data+'\xff')
+		# offsets in the buffer, past the header
+		self.fields=tuple((offset+1,encoding) for offset,encoding in fields)
+		self.command=recipient!=-1 and data[:1]=='\x01'
+		self.lock=allocate_lock()
+
+	def encode(self,values):
+		"""
+		patch values into the parameters and return the packet. Values
+		are taken modulo their field size, so negative positions end up
+		in two's complement.
+		"""
+		buf=self.buffer
+		with self.lock:
+			for (offset,encoding),value in zip(self.fields,values):
+				if encoding==BYTE:
+					buf[offset]=value&0xff
+				elif encoding==NIBBLE:
+					buf[offset]=(buf[offset]&0xf0)|(value&0x0f)
+				else:
+					buf[offset]=(value>>12)&0x0f
+					buf[offset+1]=(value>>8)&0x0f
+					buf[offset+2]=(value>>4)&0x0f
+					buf[offset+3]=value&0x0f
+			# the future keeps this as the packet to resend if needed
+			return str(buf)
+
+class ViscaFramer():
+	"""
+	Splits the byte stream read from the bus into packets.
+
+	Data is fed in whatever chunks the port hands us. Every complete
+	packet (ending in the 0xff terminator) is queued, a trailing partial
+	packet is kept until the rest of it arrives with a later feed().
+	"""
+	MAXLEN=16
+
+	def __init__(self):
+		self.buffer=''
+		self.packets=deque()
+
+	def __len__(self):
+		return len(self.packets)
+
+	def feed(self,data):
+		if not data:
+			return
+		buf=self.buffer+data
+		start=0
+		while True:
+			end=buf.find('\xff',start)
+			if end<0:
+				break
+			self.packets.append(buf[start:end+1])
+			start=end+1
+		buf=buf[start:]
+		if len(buf)>=self.MAXLEN:
+			# no terminator within the maximum packet length, pass the
+			# garbage on so the parser can complain about it
+			self.packets.append(buf)
+			buf=''
+		self.buffer=buf
+
+	def get(self):
+		if not self.packets:
+			return None
+		return self.packets.popleft()
+
+	def reset(self):
+		self.buffer=''
+		self.packets.clear()
 
-		print " QQ.........: %02x" % qq
+class Visca():
+	DEBUG=False
 
-		if qq==0x01:
-			print "              (Command)"
-		if qq==0x09:
-			print "              (Inquiry)"
+	# command buffers (sockets) per camera
+	SOCKETS=2
 
-		if len(packet)>3:
-			rr=ord(packet[2])
-			print " RR.........: %02x" % rr
+	# rates tried by detect_baudrate, fastest first
+	BAUDRATES=(115200,38400,19200,9600)
 
-			if rr==0x00:
-				print "              (Interface)"
-			if rr==0x04:
-				print "              (Camera [1])"
-			if rr==0x06:
-				print "              (Pan/Tilter)"
+	# seconds to wait for the address set reply at each rate
+	detect_timeout=0.5
 
-		if len(packet)>4:
-			data=packet[3:-1]
-			print " Data.......: %s" % data.encode('hex')
-		else:
-			print " Data.......: None"
+	# packets kept in the trace ring buffer
+	TRACE_SIZE=4096
 
-		if not term==0xff:
-			print "ERROR: Packet not terminated correctly"
-			return
+	# the reader thread gives up after this many read errors in a row
+	READ_ERRORS=3
+
+	# longest read of the reader thread, so timers added meanwhile (see
+	# submit) run about in time
+	TIMER_SLACK=0.05
 
-		if len(packet)==3 and ((qq & 0b11110000)>>4)==4:
-			socketno = (qq & 0b1111)
-			print " packet: ACK for socket %02x" % socketno
+	# re-enumerate the bus by itself when a camera reports a network
+	# change, see renumber. Otherwise everything waiting fails with
+	# ViscaNetworkChange.
+	renumber_on_change=True
+	# passes of address set and interface clear before giving up
+	renumber_attempts=3
 
-		if len(packet)==3 and ((qq & 0b11110000)>>4)==5:
-			socketno = (qq & 0b1111)
-			print " packet: COMPLETION for socket %02x" % socketno
+	def __init__(self,portname="/dev/ttyUSB0",pipeline=False,baudrate=9600,retry_policy=None,cache=None,lazy=False,threaded=True):
+		"""
+		with pipeline set, commands to a camera that has both sockets
+		busy are queued and sent as soon as one of them completes, and
+		commands the camera rejects with "Command buffer full" are resent
+		the same way, instead of failing.
+
+		baudrate='auto' runs detect_baudrate() after opening the port.
+
+		portname is a serial device, tcp://host:port for raw visca over
+		TCP, udp://host[:port] for VISCA over IP, or a transport object,
+		see pyviscalib.transport.
+
+		retry_policy is a ViscaRetryPolicy, the defaults are used if not
+		given.
+
+		cache is an optional pyviscalib.cache.ViscaCache for inquiry
+		replies.
+
+		with lazy set the port is opened (and the baud rate detected)
+		when the first packet is sent instead of here.
+
+		with threaded set a reader thread takes the replies from the
+		port. Otherwise call feed() whenever the port is readable and
+		run_timers() when next_timer() is due, see pyviscalib.controller.
+		"""
+		self.pipeline=pipeline
+		self.lazy=lazy
+		self.threaded=threaded
+		self.baudrate=baudrate
+		self.retry_policy=retry_policy or ViscaRetryPolicy()
+		self.cache=cache
+		self.counters={'retries':0,'timeouts':0,'recoveries':0,'renumbers':0,'duplicates':0}
+		# packets in a row that got no reply, per recipient. A reply
+		# from a camera puts it back to 0.
+		self.failures={}
+		self.recovering=False
+		# recipient -> [count, deadline, command, reply length] of the
+		# replies still due for a resent packet that was answered already
+		self.duplicates={}
+		# when the last packet and the last command were written
+		self.last_write=0
+		self.last_command=0
+		self.transport=None
+		self.mutex = allocate_lock()
+		self.portname=portname
+		self.framer=ViscaFramer()
+		self.reader=None
+		self.running=False
+		# futures waiting for the first reply, per recipient, oldest first
+		self.pending = {}
+		# ViscaCommand handles per (camera, socket)
+		self.socket_in_use = {}
+		self.socket_completed = {}
+		# pipelined commands waiting for a free socket, per camera
+		self.deferred = {}
+		# set by ViscaScheduler when it takes over deciding what to send
+		self.scheduler = None
+		# (recipient, template name) -> ViscaTemplate
+		self.templates = {}
+		# the last packets sent and received, see pyviscalib.trace
+		self.trace = ViscaTrace(self.TRACE_SIZE)
+		# latencies, retries, timeouts and errors per camera and command
+		self.metrics = ViscaMetrics()
+		# number of cameras found by the last address set
+		self.devices = None
+		# address -> identity of the camera there, see renumber
+		self.topology = {}
+		# the future of the renumbering under way. Meanwhile packets
+		# are not written but kept in paused, as (recipient, future).
+		self.renumbering = None
+		self.renumber_again = False
+		self.paused = deque()
+		# called as fn(mapping) after the bus was renumbered, see renumber
+		self.renumber_handlers = []
+		# handlers by reply kind, see REPLY_KINDS
+		self.reply_handlers = (self._on_inquiry_reply, self._on_ack, self._on_completion, self._on_error, self._on_network_change)
+		# see startup
+		self.topology_file = None
+		# (deadline, sequence, fn, args) run by the thread reading the
+		# port, see _call_later
+		self.timers = []
+		self.timer_sequence = 0
+		# called when a timer is added that is due before all others,
+		# for a loop reading the port that is not ours
+		self.timer_added = None
+		if not lazy:
+			self._open()
+
+	def _open(self):
+		self.open_port()
+		if self.baudrate == 'auto':
+			self.detect_baudrate()
+
+	def _ensure_open(self):
+		# the first packet of a lazy Visca opens the port
+		if self.transport is None and self.lazy:
+			self.lazy = False
+			try:
+				self._open()
+			except:
+				self.lazy = True
+				raise
 
-		if len(packet)>3 and ((qq & 0b11110000)>>4)==5:
-			socketno = (qq & 0b1111)
-			ret=packet[2:-1].encode('hex')
-			print " packet: COMPLETION for socket %02x, data=%s" % (socketno,ret)
+	def open_port(self):
 
-		if len(packet)==4 and ((qq & 0b11110000)>>4)==6:
-			print " packet: ERROR!"
+		with self.mutex:
 
-			socketno = (qq & 0b00001111)
-			errcode  = ord(packet[2])
+			if (self.transport == None):
+				try:
+					if self.baudrate == 'auto':
+						rate = self.BAUDRATES[-1]
+					else:
+						rate = self.baudrate
+					self.transport = open_transport(self.portname,rate,timeout=2)
+					self.transport.flushInput()
+					self.framer.reset()
+				except Exception as e:
+					print ("Exception opening port '%s' for display: %s\n" % (self.portname,e))
+					raise e
+					self.transport = None
 
-			#these two are special, socket is zero and has no meaning:
-			if errcode==0x02 and socketno==0:
-				print "        : Syntax Error"
-			if errcode==0x03 and socketno==0:
-				print "        : Command Buffer Full"
+				self.running=True
+				if self.threaded:
+					self.start_reader()
 
+	@property
+	def serialport(self):
+		"""the transport, under its name from before there were others"""
+		return self.transport
 
-			if errcode==0x04:
-				print "        : Socket %i: Command canceled" % socketno
+	def start_reader(self):
+		"""read the port on a thread of our own"""
+		self.threaded=True
+		self.reader=threading.Thread(target=self._reader_loop,name='visca-reader %s' % self.portname)
+		self.reader.daemon=True
+		self.reader.start()
 
-			if errcode==0x05:
-				print "        : Socket %i: Invalid socket selected" % socketno
+	def set_baudrate(self,rate):
+		"""
+		switch the port to another rate. The cameras have to be set to
+		the same rate, see detect_baudrate.
+		"""
+		with self.mutex:
+			if self.transport is not None:
+				self.transport.baudrate=rate
+				self.transport.flushInput()
+			self.framer.reset()
+			self.baudrate=rate
 
-			if errcode==0x41:
-				print "        : Socket %i: Command not executable" % socketno
+	def detect_baudrate(self,rates=None):
+		"""
+		find the rate the cameras are set to. Sends the address set
+		broadcast at each rate, fastest first, and keeps the first rate
+		that gets a clean reply. Note this (re)numbers the cameras.
+		returns the rate.
+		"""
+		for rate in rates or self.BAUDRATES:
+			self.set_baudrate(rate)
+			future = self.submit_packet(-1, '\x30\x01')
+			if not future.wait(self.detect_timeout):
+				self._forget_pending(-1, future)
+				future.set_exception(ViscaTimeout("Timeout waiting for reply"))
+				continue
+			try:
+				devices = self._check_adress_set(future.result(), 1)
+			except ViscaError:
+				continue
+			if self.DEBUG: print "debug: %i devices answering at %d baud" % (devices, rate)
+			return rate
+		raise ViscaError("No devices answering at any of %s baud" % (rates or self.BAUDRATES,))
+
+	def close(self):
+		"""
+		stop the reader thread and close the port. Requests still
+		waiting for a reply fail with a ViscaError.
+		"""
+		self.lazy=False
+		with self.mutex:
+			if self.transport == None:
+				return
+			self.running=False
+		if self.reader and self.reader is not threading.current_thread():
+			self.reader.join()
+		self.reader=None
+		with self.mutex:
+			self.transport.close()
+			self.transport=None
+		self._fail_all(ViscaError('Port closed'))
 
-		if len(packet)==3 and qq==0x38:
-			print "Network Change - we should immedeately issue a renumbering!"
+	def dump(self,packet,title=None):
+		if not self.DEBUG: return
+		if not packet or len(packet)==0:
+			return
+		print format_packet(packet,title)
 
 	def parse_reply_packet(self, packet):
+		"""
+		check a reply, raising ViscaNetworkChange or the ViscaReplyError
+		for error replies. returns the packet.
+		"""
 		if not packet or len(packet) < 2:
 			return
 
-		header=ord(packet[0])
-		term=ord(packet[-1:])
-		qq=ord(packet[1])
-
-		sender = (header&0b01110000)>>4
-		broadcast = (header&0b1000)>>3
-		recipient = (header&0b0111)
-
-		if not term==0xff:
+		if packet[-1] != '\xff':
 			raise ViscaError("Packet not terminated correctly")
 
-		if len(packet)==3 and qq==0x38:
+		kind = REPLY_KINDS[ord(packet[1])]
+		if kind == REPLY_NETWORK_CHANGE and len(packet) == 3:
 			raise ViscaNetworkChange("Network Change - we should immedeately issue a renumbering!")
+		if kind == REPLY_ERROR:
+			raise reply_error(packet)
 
-		socketno = qq & 0b00001111
-		messagetype = (qq & 0b11110000)>>4
-
-		if len(packet)==4 and messagetype==6:
-			errcode  = ord(packet[2])
-
-			message = "Code=0x%02x, socketno=%d, raw=%s" % (errcode, socketno, packet.encode('hex'))
-
-			#these two are special, socket is zero and has no meaning:
-			if errcode==0x02 and socketno==0:
-				message = "Syntax error"
-			if errcode==0x03 and socketno==0:
-				message = "Command buffer full"
-			if errcode==0x04:
-				message = "Command canceled on socket %d" % socketno
-			if errcode==0x05:
-				message = "Invalid socket %d" % socketno
-			if errcode==0x41:
-				message = "Command not currently executable on socket %d" % socketno
-			raise ViscaError("Received visca error: %s" % message)
-
-		# It is a valid reply. Check whether it's an ack/completion and update
-		# the statuses
-		self.adjust_socket_status(sender, socketno, messagetype)
 		return packet
 
-	def adjust_socket_status(self, sender, socketno, messagetype):
+	def adjust_socket_status(self, sender, socketno, messagetype, packet):
+		"""
+		keep track of the command sockets. An ACK creates the
+		ViscaCommand handle for its socket, a completion finishes it.
+		returns the handle, or None for anything else.
+		"""
 		if socketno == 0:
 			# Inquiry reply, probably
-			return
+			return None
+		key = (sender, socketno)
 		if messagetype == 4:
 			# ACK. Mark the socket as in-use (awaiting a completion).
-			if (sender, socketno) in self.socket_in_use:
-				raise ViscaError("Received ACK for in-use socket, cam=%d socket=%d" % (sender, socket))
-			self.socket_in_use[(sender, socketno)] = True
-			if (sender, socketno) in self.socket_completed:
-				print 'Warning: received ACK for cam=%d socket=%d for which we had an earlier outstanding command' % (sender, socket)
-				del socket_completed[(sender, socketno)]
-			return
+			handle = self._new_command(packet)
+			with self.mutex:
+				old = self.socket_in_use.get(key)
+				self.socket_in_use[key] = handle
+				self.socket_completed.pop(key, None)
+			if old:
+				print 'Warning: received ACK for cam=%d socket=%d for which we had an earlier outstanding command' % (sender, socketno)
+				old.set_exception(ViscaError("Received ACK for in-use socket, cam=%d socket=%d" % (sender, socketno)))
+			return handle
 		if messagetype == 5:
 			# Completion. Mark socket as done.
-			if not (sender, socketno) in self.socket_in_use:
-				print 'Warning: received completion for cam=%d socket=%d for which we had no ACK' % (sender, socket)
+			with self.mutex:
+				handle = self.socket_in_use.pop(key, None)
+				if handle:
+					self.socket_completed[key] = handle
+			if not handle:
+				print 'Warning: received completion for cam=%d socket=%d for which we had no ACK' % (sender, socketno)
+				return None
+			if handle.sent_at is not None:
+				self.metrics.completion(sender, handle.packet, time.time() - handle.sent_at)
+			handle.set_result(packet)
+			self._release_socket(sender)
+			return handle
+		return None
+
+	def dispatch_packet(self, packet):
+		"""
+		hand a received packet to whoever is waiting for it. ACKs, inquiry
+		replies and errors in place of an ACK finish the oldest request
+		pending for the sender, completions and errors on a running
+		command finish the handle of its socket.
+
+		The reply kind is looked up from the second byte and the packet
+		goes straight to the handler for it.
+		"""
+		if not packet or len(packet) < 2:
+			return
+
+		sender = SENDERS[ord(packet[0])]
+		self.failures[sender] = 0
+		if packet[-1] != '\xff':
+			self._dispatch_error(sender, packet, ViscaError("Packet not terminated correctly"))
+			return
+
+		qq = ord(packet[1])
+		self.reply_handlers[REPLY_KINDS[qq]](sender, qq & 0b00001111, packet)
+
+	def _on_inquiry_reply(self, sender, socketno, packet):
+		if self.duplicates and self._duplicate(sender, False, len(packet)):
+			return
+		self._resolve_pending(sender, packet, packet, None)
+
+	def _on_ack(self, sender, socketno, packet):
+		handle = self.adjust_socket_status(sender, socketno, 4, packet)
+		# the handle of a duplicate stays on its socket, the camera runs
+		# the command twice
+		if self.duplicates and self._duplicate(sender, True, len(packet)):
+			return
+		self._resolve_pending(sender, packet, handle, None)
+
+	def _on_completion(self, sender, socketno, packet):
+		self.adjust_socket_status(sender, socketno, 5, packet)
+
+	def _on_error(self, sender, socketno, packet):
+		self._dispatch_error(sender, packet, reply_error(packet))
+
+	def _on_network_change(self, sender, socketno, packet):
+		if len(packet) != 3:
+			self._on_inquiry_reply(sender, socketno, packet)
+			return
+		if not self.renumber_on_change:
+			self._fail_all(ViscaNetworkChange("Network Change - we should immedeately issue a renumbering!"))
+			return
+		if self.DEBUG: print "debug: network change reported by cam %d, renumbering" % sender
+		self._start_renumber()
+
+	def _dispatch_error(self, sender, packet, error):
+		socketno = getattr(error, 'socket', 0)
+		errcode = getattr(error, 'code', None)
+		if errcode != 0x04 and self.duplicates and self._duplicate(sender, None, len(packet)):
+			return
+		if errcode == 0x03 and socketno == 0 and self._defer_rejected(sender):
+			return
+		if socketno:
+			key = (sender, socketno)
+			with self.mutex:
+				handle = self.socket_in_use.get(key)
+				# not executable is also sent instead of an ACK
+				if handle and (errcode == 0x04 or not self.pending.get(sender)):
+					del self.socket_in_use[key]
+					self.socket_completed[key] = handle
+				else:
+					handle = None
+			if handle:
+				if handle.packet and errcode is not None:
+					self.metrics.error(sender, handle.packet, errcode)
+				handle.set_exception(error)
+				self._release_socket(sender)
 				return
-			del self.socket_in_use[(sender, socketno)]
-			self.socket_completed[(sender, socketno)] = True
-			
+		self._resolve_pending(sender, packet, None, error)
+
+	def _resolve_pending(self, sender, packet, reply, error):
+		with self.mutex:
+			waiting = self.pending.get(sender)
+			future = waiting and waiting.popleft()
+		if not future:
+			print 'visca: ignoring unexpected packet %s' % packet.encode('hex')
+			return
+		resent = getattr(future, 'resent', 0)
+		if resent and future.sent_at is not None:
+			# the reply to each send is still to come, unless the
+			# camera missed the packet
+			self.duplicates[sender] = [resent, future.sent_at + self._packet_timeout(future, resent),
+				future.command, len(packet)]
+		if error is not None:
+			code = getattr(error, 'code', None)
+			if code is not None:
+				self.metrics.error(sender, future.packet, code)
+			future.set_exception(error)
+			if future.command:
+				self._release_socket(sender)
+		else:
+			if future.sent_at is not None:
+				self.metrics.ack(sender, future.packet, time.time() - future.sent_at)
+			if hasattr(reply, 'ack'):
+				reply.packet = future.packet
+				reply.sent_at = future.sent_at
+			future.set_result(reply)
+
+	def _forget_pending(self, recipient, future):
+		with self.mutex:
+			waiting = self.pending.get(recipient)
+			if waiting and future in waiting:
+				waiting.remove(future)
+		if future.command:
+			self._release_socket(recipient)
+
+	def _fail_all(self, error):
+		with self.mutex:
+			futures = [f for waiting in self.pending.values() for f in waiting]
+			futures += [f for waiting in self.deferred.values() for f in waiting]
+			futures += self.socket_in_use.values()
+			self.pending.clear()
+			self.deferred.clear()
+			self.socket_in_use.clear()
+		for future in futures:
+			future.set_exception(error)
+
+	def _sockets_free(self, device):
+		# called with the mutex held
+		busy = 0
+		for future in self.pending.get(device, ()):
+			if future.command:
+				busy += 1
+		for cam, socketno in self.socket_in_use:
+			if cam == device:
+				busy += 1
+		return self.SOCKETS - busy
+
+	def _release_socket(self, device):
+		"""
+		a command on device finished or was rejected, send queued
+		pipelined commands while there are free sockets.
+		"""
+		failed = []
+		with self.mutex:
+			queue = self.deferred.get(device)
+			while queue and self._sockets_free(device) > 0:
+				future = queue.popleft()
+				try:
+					self._write_pending(device, future)
+				except Exception as e:
+					failed.append((future, e))
+		for future, e in failed:
+			future.set_exception(e)
+		if self.scheduler:
+			self.scheduler.pump()
+
+	def _defer_rejected(self, device):
+		"""
+		the camera answered "Command buffer full". In pipeline mode the
+		command is queued again, to be resent when one of the commands
+		still running on that camera completes.
+		"""
+		if not self.pipeline:
+			return False
+		with self.mutex:
+			waiting = self.pending.get(device)
+			if not waiting or not waiting[0].command:
+				return False
+			for cam, socketno in self.socket_in_use:
+				if cam == device:
+					break
+			else:
+				# nothing of ours is running there, retrying won't help
+				return False
+			future = waiting.popleft()
+			future.sent_at = None
+			self.deferred.setdefault(device, deque()).appendleft(future)
+		if self.DEBUG: print "debug: command buffer of cam %d full, resending later" % device
+		return True
+
 	def wait_for_cmd_completion(self, packet, timeout=-1):
-		if not packet or len(packet) != 3:
-			raise ViscaError('wait_for_cmd_completion expects an ACK packet argument')
+		"""
+		wait for the command to complete and return the completion
+		packet. Takes the ViscaCommand returned by the cmd_* methods, or
+		the ACK packet of the command.
+		"""
+		if isinstance(packet, ViscaCommand):
+			handle = packet
+			key = (handle.device, handle.socket)
+		else:
+			if not packet or len(packet) != 3:
+				raise ViscaError('wait_for_cmd_completion expects an ACK packet argument')
 
-		header=ord(packet[0])
-		qq=ord(packet[1])
+			header=ord(packet[0])
+			qq=ord(packet[1])
 
-		sender = (header&0b01110000)>>4
-		socketno = qq & 0b00001111
-		messagetype = (qq & 0b11110000)>>4
+			sender = (header&0b01110000)>>4
+			socketno = qq & 0b00001111
+			messagetype = (qq & 0b11110000)>>4
 
-		if messagetype != 4:
-			raise ViscaError('wait_for_cmd_completion expects an ACK packet argument')
+			if messagetype != 4:
+				raise ViscaError('wait_for_cmd_completion expects an ACK packet argument')
 
-		now = time.time()
-		while not (sender, socketno) in self.socket_completed:
-			if timeout > 0 and time.time() > now + timeout:
-				raise ViscaError("Timeout waiting for command completion")
-			self.recv_packet()
-		del self.socket_completed[(sender, socketno)]
-		
-	def recv_packet(self,extra_title=None):
-		# read up to 16 bytes until 0xff
-		packet=''
-		count=0
-		while count<16:
-			s=self.serialport.read(1)
-			if s:
-				byte = ord(s)
-				count+=1
-				packet=packet+chr(byte)
-			else:
-				print "ERROR: Timeout waiting for reply"
+			key = (sender, socketno)
+			with self.mutex:
+				handle = self.socket_in_use.get(key) or self.socket_completed.get(key)
+			if not handle:
+				raise ViscaError('No command outstanding for cam=%d socket=%d' % key)
+
+		if timeout <= 0:
+			timeout = None
+		if not handle.wait(timeout):
+			raise ViscaError("Timeout waiting for command completion")
+		with self.mutex:
+			if self.socket_completed.get(key) is handle:
+				del self.socket_completed[key]
+		return handle.result()
+
+	def _new_future(self):
+		return ViscaFuture()
+
+	def _new_command(self, ack):
+		return ViscaCommand(ack)
+
+	def _read_available(self):
+		"""
+		read everything the port has for us in one go. If nothing is
+		waiting, block for a single byte (bounded by the port timeout).
+		returns False on timeout.
+		"""
+		data=self.transport.read(max(1,self.transport.inWaiting()))
+		if not data:
+			return False
+		self.framer.feed(data)
+		return True
+
+	def recv_packet(self):
+		"""
+		take the next packet from the port and dispatch it. Runs on the
+		reader thread, returns None if nothing complete arrived within
+		the port timeout.
+		"""
+		packet=self.framer.get()
+		if packet is None:
+			if not self._read_available():
+				if self.framer.buffer:
+					print 'visca: discarding incomplete packet %s' % self.framer.buffer.encode('hex')
+					self.framer.buffer=''
+				return None
+			packet=self.framer.get()
+			if packet is None:
+				return None
+
+		self._received(packet)
+		return packet
+
+	def feed(self):
+		"""
+		read what the port has and dispatch every complete packet. For a
+		Visca without reader thread, call it when the port is readable.
+		It never blocks, and raises ViscaError when the other end closed
+		the port.
+		"""
+		waiting=self.transport.inWaiting()
+		if not waiting:
+			# readable without visca data: the end of the stream, or
+			# e.g. a VISCA over IP control reply. A read that can't
+			# block tells which.
+			if self.transport.timeout != 0:
+				self.transport.timeout = 0
+			waiting=1
+		data=self.transport.read(waiting)
+		if not data:
+			if not self.transport.isOpen():
+				raise ViscaError('Port closed by the other end')
+			return
+		self.framer.feed(data)
+		while True:
+			packet=self.framer.get()
+			if packet is None:
 				break
-			if byte==0xff:
+			self._received(packet)
+
+	def _received(self,packet):
+		self.trace.record(RECEIVED,SENDERS[ord(packet[0])],packet)
+		self.dump(packet,"recv")
+		self.dispatch_packet(packet)
+
+	def _reader_loop(self):
+		port_timeout = self.transport.timeout
+		errors = 0
+		while self.running and _running:
+			try:
+				# no longer than the next timer, timers added by other
+				# threads during a read run when it returns
+				timeout = self.TIMER_SLACK
+				if port_timeout is not None:
+					timeout = min(timeout, port_timeout)
+				deadline = self.next_timer()
+				if deadline is not None:
+					timeout = min(timeout, max(0.02, deadline - time.time()))
+				if self.transport.timeout != timeout:
+					self.transport.timeout = timeout
+				self.recv_packet()
+				self.run_timers()
+				errors = 0
+			except Exception as e:
+				if not self.running or not _running:
+					break
+				errors += 1
+				if errors < self.READ_ERRORS and self.transport.isOpen():
+					print 'visca: reader thread: %s' % e
+					time.sleep(0.1 * errors)
+					continue
+				# nothing will be read any more, don't leave requests
+				# waiting for their timeouts
+				print 'visca: reader thread stopped: %s' % e
+				self.running = False
+				self._fail_all(ViscaError('Reading the port failed: %s' % e))
 				break
 
-		if extra_title:
-			self.dump(packet,"recv: %s" % extra_title)
-		else:
-			self.dump(packet,"recv")
-		return self.parse_reply_packet(packet)
-
 
 	def _write_packet(self,packet):
 
-		if not self.serialport.isOpen():
-			raise ViscaError('Serial port is not open')
+		if self.transport is None or not self.transport.isOpen():
+			raise ViscaError('Port is not open')
 
-		# lets see if a completion message or someting
-		# else waits in the buffer. If yes dump it.
-		if self.serialport.inWaiting():
-			if 1 or self.DEBUG:
-				print 'visca._write_packet: reading old packet...'
-			self.recv_packet("ignored")
-
-		self.serialport.write(packet)
+		# recorded first, fast replies may be read before write returns
+		header=ord(packet[0])
+		self.trace.record(SENT,-1 if header==0x88 else header&0b0111,packet)
+		self.transport.write(packet)
+		self.last_write=time.time()
 		self.dump(packet,"sent")
 
 
 
-	def send_packet(self,recipient,data):
+	def make_packet(self,recipient,data):
 		"""
 		according to the documentation:
 
@@ -309,15 +1008,240 @@ class Visca():
 
 		terminator=0xff
 
-		packet = chr(header)+data+chr(terminator)
+		return chr(header)+data+chr(terminator)
+
+	def submit_packet(self,recipient,data):
+		"""
+		send a packet without waiting. Returns a ViscaFuture for the first
+		reply: a ViscaCommand handle if the camera ACKs the packet, the
+		reply packet otherwise.
+		"""
+		return self._submit(recipient, self.make_packet(recipient,data), data[:1] == '\x01')
+
+	def _submit(self,recipient,packet,command):
+		self._ensure_open()
+		future = self._new_future()
+		future.packet = packet
+		future.command = command and recipient != -1
+		future.sent_at = None
+
+		if self.cache:
+			data = packet[1:-1]
+			if future.command or recipient == -1:
+				self.cache.watch_command(recipient, data, future)
+			else:
+				reply = self.cache.get(recipient, data)
+				if reply is not None:
+					future.sent_at = time.time()
+					future.set_result(reply)
+					return future
+				self.cache.watch_inquiry(recipient, data, future)
 
 		with self.mutex:
+			if self.scheduler:
+				self.scheduler.enqueue(recipient, future)
+			elif self.pipeline and future.command and self._sockets_free(recipient) <= 0:
+				self.deferred.setdefault(recipient, deque()).append(future)
+			else:
+				self._write_pending(recipient, future)
 
-			self._write_packet(packet)
+		if self.scheduler:
+			self.scheduler.pump()
+		return future
 
-			reply = self.recv_packet()
+	def _write_pending(self,recipient,future):
+		# called with the mutex held
+		if self.renumbering is not None and not getattr(future, 'renumber', False):
+			future.sent_at = None
+			self.paused.append((recipient, future))
+			return
+		waiting = self.pending.get(recipient)
+		if waiting is None:
+			waiting = self.pending[recipient] = deque()
+		waiting.append(future)
+		try:
+			self._write_packet(future.packet)
+		except:
+			waiting.remove(future)
+			raise
+		future.sent_at = self.last_write
+		if future.command:
+			self.last_command = self.last_write
 
-		return reply
+	def send_packet(self,recipient,data):
+		"""
+		send a packet and wait for the first reply, see submit_packet.
+		Packets that get no reply are resent as the retry_policy says.
+		Raises ViscaTimeout if nothing arrives after the last attempt.
+		"""
+		return self._wait_reply(recipient, self.submit_packet(recipient,data))
+
+	def template(self,recipient,name):
+		"""the ViscaTemplate for a command of the table in commands"""
+		template = self.templates.get((recipient,name))
+		if template is None:
+			command = commands.BY_NAME[name]
+			template = self.templates[(recipient,name)] = ViscaTemplate(recipient, command.data, command.fields())
+		return template
+
+	def send_template(self,recipient,name,*values):
+		"""like send_packet, for the template of command name filled with values"""
+		template = self.template(recipient, name)
+		future = self._submit(recipient, template.encode(values), template.command)
+		return self._wait_reply(recipient, future)
+
+	def submit(self,recipient,packet,timeout=None,completion_timeout=None):
+		"""
+		send a complete packet, e.g. one encoded by a ViscaTemplate,
+		without waiting. Returns the future for the first reply, see
+		submit_packet. Nothing is resent: the future fails with
+		ViscaTimeout when there was no reply timeout seconds after the
+		packet was written (by default the first timeout of the
+		retry_policy). With completion_timeout the ViscaCommand handle
+		of a command fails the same way when the command has not
+		completed that many seconds after its ACK, and its socket is
+		taken as free again.
+
+		The deadlines are kept by the thread reading the port.
+		"""
+		future = self._submit(recipient, packet, packet[1:2] == '\x01')
+		if not future.done():
+			if timeout is None:
+				timeout = self._packet_timeout(future, 0)
+			self._call_later(timeout, self._reply_deadline, recipient, future, timeout)
+		if completion_timeout is not None:
+			future.add_done_callback(lambda future: self._acked(future, completion_timeout))
+		return future
+
+	def submit_template(self,recipient,name,values=(),timeout=None,completion_timeout=None):
+		"""submit the template of command name filled with values"""
+		return self.submit(recipient, self.template(recipient, name).encode(values), timeout, completion_timeout)
+
+	def _reply_deadline(self,recipient,future,timeout):
+		if future.done():
+			return
+		if future.sent_at is None:
+			# still queued, by the scheduler or for a free socket
+			self._call_later(timeout, self._reply_deadline, recipient, future, timeout)
+			return
+		remaining = future.sent_at + timeout - time.time()
+		if remaining > 0:
+			self._call_later(remaining, self._reply_deadline, recipient, future, timeout)
+			return
+		self._forget_pending(recipient, future)
+		self.counters['timeouts'] += 1
+		self.metrics.timeout(recipient, future.packet)
+		future.set_exception(ViscaTimeout("Timeout waiting for reply"))
+
+	def _acked(self,future,completion_timeout):
+		if future.exception() is None and hasattr(future.result(), 'ack'):
+			self._call_later(completion_timeout, self._completion_deadline, future.result())
+
+	def _completion_deadline(self,handle):
+		if handle.done():
+			return
+		key = (handle.device, handle.socket)
+		with self.mutex:
+			if self.socket_in_use.get(key) is handle:
+				del self.socket_in_use[key]
+		self.counters['timeouts'] += 1
+		self.metrics.timeout(handle.device, handle.packet)
+		handle.set_exception(ViscaTimeout("Timeout waiting for command completion"))
+		self._release_socket(handle.device)
+
+	def _wait_reply(self,recipient,future):
+		attempt = 0
+		timeout = self._packet_timeout(future, attempt)
+		while not future.wait(timeout):
+			if future.sent_at is None:
+				# still queued, by the scheduler or for a free socket
+				continue
+			timeout = future.sent_at + self._packet_timeout(future, attempt) - time.time()
+			if timeout > 0:
+				continue
+			if attempt < self.retry_policy.retries and self._resend(recipient, future):
+				attempt += 1
+				self.counters['retries'] += 1
+				if self.DEBUG: print "debug: no reply from %d, resending (attempt %d)" % (recipient, attempt)
+				timeout = self._packet_timeout(future, attempt)
+				continue
+			self._forget_pending(recipient,future)
+			future.set_exception(ViscaTimeout("Timeout waiting for reply"))
+			print "ERROR: Timeout waiting for reply"
+			self.counters['timeouts'] += 1
+			self.metrics.timeout(recipient, future.packet)
+			self._no_reply(recipient)
+			break
+
+		return future.result()
+
+	def _packet_timeout(self,future,attempt):
+		if future.command:
+			reply_length = 3
+		else:
+			reply_length = ViscaFramer.MAXLEN
+		return self.retry_policy.timeout(getattr(self.transport, 'baudrate', None),
+			len(future.packet), reply_length, attempt)
+
+	def _resend(self,recipient,future):
+		# the future keeps its place in the pending queue, the replies to
+		# the extra sends are dropped once it got its reply
+		with self.mutex:
+			if future not in self.pending.get(recipient, ()):
+				return False
+			self._write_packet(future.packet)
+			future.sent_at = time.time()
+			future.resent = getattr(future, 'resent', 0) + 1
+		self.metrics.retry(recipient, future.packet)
+		return True
+
+	def _duplicate(self,sender,command,length):
+		"""
+		True for a reply to a resent packet whose first reply came in
+		already. It has to arrive in time and be of the same kind (an
+		ACK for a command, a reply of the same length for an inquiry, an
+		error reply (command None) for either).
+		"""
+		expected = self.duplicates.get(sender)
+		if not expected:
+			return False
+		count, deadline, resent_command, resent_length = expected
+		if time.time() > deadline:
+			del self.duplicates[sender]
+			return False
+		if command is not None and (command != resent_command or (not command and length != resent_length)):
+			return False
+		if count > 1:
+			expected[0] -= 1
+		else:
+			del self.duplicates[sender]
+		self.counters['duplicates'] += 1
+		if self.DEBUG: print "debug: dropping the reply of cam %d to a resent packet" % sender
+		return True
+
+	def _no_reply(self,recipient):
+		self.failures[recipient] = self.failures.get(recipient, 0) + 1
+		clear_after = self.retry_policy.clear_after
+		if not clear_after or self.recovering:
+			return
+		if self.devices:
+			addresses = range(1, self.devices + 1)
+		else:
+			# not enumerated, all we know of are the cameras we talked to
+			addresses = [address for address in self.failures if address != -1] or [recipient]
+		for address in addresses:
+			if self.failures.get(address, 0) < clear_after:
+				return
+		self.failures.clear()
+		self.counters['recoveries'] += 1
+		print "visca: no replies from the bus, clearing all interfaces"
+		self.recovering = True
+		try:
+			self.cmd_if_clear_all()
+		except ViscaError as e:
+			print "visca: interface clear failed: %s" % e
+		finally:
+			self.recovering = False
 
 	def send_broadcast(self,data):
 		# shortcut
@@ -373,7 +1297,9 @@ class Visca():
 		first=1
 
 		reply = self.send_broadcast('\x30'+chr(first)) # set address
+		return self._then(reply, lambda reply: self._check_adress_set(reply, first))
 
+	def _check_adress_set(self, reply, first):
 		if not reply:
 			raise ViscaError("No reply from the bus.")
 
@@ -388,80 +1314,396 @@ class Visca():
 
 		if d==0:
 			raise ViscaError("No devices on the bus")
+		self.devices=d
+		return d
 
 
 	def cmd_if_clear_all(self):
 		reply=self.send_broadcast( '\x01\x00\x01') # interface clear all
+		return self._then(reply, self._check_if_clear_all)
+
+	def _check_if_clear_all(self, reply):
 		if not reply:
 			raise ViscaError("No reply to broadcast message")
 		if not reply[1:]=='\x01\x00\x01\xff':
 			raise ViscaError("ERROR clearing all interfaces on the bus!")
 
+		# the command buffers are empty now, nothing will complete
+		with self.mutex:
+			handles = self.socket_in_use.values()
+			self.socket_in_use.clear()
+		for handle in handles:
+			handle.set_exception(ViscaError("Command canceled by interface clear"))
+
 		if self.DEBUG: print "debug: all interfaces clear"
 
 
+	def renumber(self,timeout=10):
+		"""
+		address the cameras, clear their interfaces and identify them by
+		version and camera ID, all in one go. Runs by itself when a
+		camera reports a network change (see renumber_on_change).
+
+		While it runs nothing else is written: requests wait and are sent
+		afterwards, those that were sent but not answered yet are sent
+		again. Commands that were running are canceled by the interface
+		clear and fail with ViscaNetworkChange. Then the cameras are matched with the ones known before,
+		in chain order, and the cache, the requests that waited and the
+		renumber_handlers are told where each camera went.
+
+		returns the mapping {old address: new address, or None for a
+		camera that left the bus}.
+		"""
+		return self._start_renumber().result(timeout)
+
+	def startup(self,topology_file=None,timeout=10):
+		"""
+		get the bus ready. With topology_file the topology saved there
+		by an earlier run is checked with one ID inquiry per camera, all
+		sent at once, and taken over if every camera still answers with
+		its ID within the first timeout of the retry policy (there are no
+		resends). Otherwise, or without a file, the bus is renumbered and
+		the result saved to the file. Later renumberings update it.
+
+		A camera added to the end of the chain since the file was saved
+		is not noticed until it reports a network change.
+
+		returns the number of cameras.
+		"""
+		self.topology_file = topology_file
+		if topology_file and self._check_topology(topology_file):
+			if self.DEBUG: print "debug: topology of %s still valid" % topology_file
+			return self.devices
+		self.renumber(timeout)
+		return self.devices
+
+	def _check_topology(self, filename):
+		try:
+			with open(filename) as f:
+				saved = json.load(f)
+		except (IOError, OSError, ValueError):
+			return False
+		rate = self.baudrate
+		if rate == 'auto':
+			rate = saved.get('baudrate')
+		if saved.get('port') != self._port_name() or saved.get('baudrate') != rate:
+			return False
+		topology = {}
+		for address, camera in saved.get('cameras', {}).items():
+			topology[int(address)] = (camera['version'].decode('hex'), camera['id'].decode('hex'))
+		if not topology or len(topology) != saved.get('devices'):
+			return False
+		if self.baudrate == 'auto':
+			self.baudrate = rate
+		futures = [(address, self.submit_packet(address, '\x09\x04\x22')) for address in sorted(topology)]
+		# one short wait per camera and no resends, a missing camera
+		# should cost less than renumbering does
+		valid = True
+		for address, future in futures:
+			if valid:
+				timeout = self._packet_timeout(future, 0)
+				if future.sent_at is not None:
+					timeout += future.sent_at - time.time()
+				if not future.wait(max(0, timeout)) or future.error is not None or future.value[2:-1] != topology[address][1]:
+					valid = False
+			if not future.done():
+				self._forget_pending(address, future)
+				future.set_exception(ViscaTimeout("Timeout waiting for reply"))
+		if not valid:
+			return False
+		self.devices = len(topology)
+		self.topology = topology
+		return True
+
+	def save_topology(self,filename):
+		"""write port, baud rate and version and ID per address to filename"""
+		cameras = {}
+		for address, (version, id) in self.topology.items():
+			cameras[str(address)] = {
+				'version': (version or '').encode('hex'),
+				'id': (id or '').encode('hex'),
+				}
+		saved = {
+			'port': self._port_name(),
+			'baudrate': self.baudrate,
+			'devices': self.devices,
+			'cameras': cameras,
+			}
+		# replace the file in one step, so a crash never leaves half of it
+		temporary = filename + '.tmp'
+		with open(temporary, 'w') as f:
+			json.dump(saved, f, indent=2, sort_keys=True)
+		os.rename(temporary, filename)
+
+	def _port_name(self):
+		# a transport object has no name to recognize it by
+		if isinstance(self.portname, basestring):
+			return self.portname
+		return None
+
+	def _start_renumber(self):
+		"""start renumbering, returns a future for the mapping"""
+		broadcasts = []
+		with self.mutex:
+			if self.renumbering is not None:
+				# the chain changed again, run once more when done
+				self.renumber_again = True
+				return self.renumbering
+			done = self.renumbering = self._new_future()
+			self.counters['renumbers'] += 1
+			for recipient, waiting in self.pending.items():
+				for future in waiting:
+					if recipient == -1:
+						broadcasts.append(future)
+					else:
+						future.sent_at = None
+						self.paused.append((recipient, future))
+			for recipient, waiting in self.deferred.items():
+				self.paused.extend((recipient, future) for future in waiting)
+			self.pending.clear()
+			self.deferred.clear()
+			# the interface clear is going to cancel them
+			running = self.socket_in_use.values()
+			self.socket_in_use.clear()
+		for future in broadcasts:
+			future.set_exception(ViscaNetworkChange("Network change while waiting for a broadcast"))
+		for handle in running:
+			handle.set_exception(ViscaNetworkChange("Network change, command canceled"))
+		self._renumber_address(0)
+		return done
+
+	def _renumber_send(self, recipient, data, fn):
+		# past the pause, with a timeout of its own
+		future = self._new_future()
+		future.packet = self.make_packet(recipient, data)
+		future.command = False
+		future.sent_at = None
+		future.renumber = True
+		future.add_done_callback(fn)
+		try:
+			self._ensure_open()
+			with self.mutex:
+				self._write_pending(recipient, future)
+		except Exception as e:
+			future.set_exception(e)
+			return
+		self._call_later(self._packet_timeout(future, 0), self._renumber_timeout, recipient, future)
+
+	def _renumber_timeout(self, recipient, future):
+		if future.done():
+			return
+		self._forget_pending(recipient, future)
+		future.set_exception(ViscaTimeout("Timeout waiting for reply"))
+
+	def _call_later(self, delay, fn, *args):
+		"""run fn(*args) in delay seconds, on the thread reading the port"""
+		with self.mutex:
+			self.timer_sequence += 1
+			heapq.heappush(self.timers, (time.time() + delay, self.timer_sequence, fn, args))
+			first = self.timers[0][1] == self.timer_sequence
+		if first and self.timer_added:
+			self.timer_added()
+
+	def next_timer(self):
+		"""when the next timer is due, None if there is none"""
+		with self.mutex:
+			if not self.timers:
+				return None
+			return self.timers[0][0]
+
+	def run_timers(self):
+		"""run the timers that are due"""
+		now = time.time()
+		due = []
+		with self.mutex:
+			while self.timers and self.timers[0][0] <= now:
+				due.append(heapq.heappop(self.timers))
+		for deadline, sequence, fn, args in due:
+			try:
+				fn(*args)
+			except Exception as e:
+				print "visca: timer failed: %s" % e
+
+	def _renumber_address(self, attempt):
+		def _addressed(future):
+			try:
+				self._check_adress_set(future.result(), 1)
+			except Exception as e:
+				self._renumber_retry(attempt, e)
+				return
+			self._renumber_send(-1, '\x01\x00\x01', _cleared)
+		def _cleared(future):
+			try:
+				self._check_if_clear_all(future.result())
+			except Exception as e:
+				self._renumber_retry(attempt, e)
+				return
+			self._renumber_identify()
+		self._renumber_send(-1, '\x30\x01', _addressed)
+
+	def _renumber_retry(self, attempt, error):
+		if attempt + 1 < self.renumber_attempts:
+			if self.DEBUG: print "debug: renumbering failed (%s), pass %d" % (error, attempt + 2)
+			self._renumber_address(attempt + 1)
+		else:
+			self._renumber_failed(error)
+
+	def _renumber_identify(self):
+		# version and camera ID of every camera, all asked at once
+		devices = self.devices
+		replies = {}
+		remaining = [2 * devices]
+		def _reply(address, index):
+			def _store(future):
+				if future.exception() is None and future.result():
+					replies[(address, index)] = future.result()[2:-1]
+				with self.mutex:
+					remaining[0] -= 1
+					last = remaining[0] == 0
+				if last:
+					identities = {}
+					for device in range(1, devices + 1):
+						identities[device] = (replies.get((device, 0)), replies.get((device, 1)))
+					self._renumber_remap(identities)
+			return _store
+		for address in range(1, devices + 1):
+			self._renumber_send(address, '\x09\x00\x02', _reply(address, 0))
+			self._renumber_send(address, '\x09\x04\x22', _reply(address, 1))
+
+	def _match_topology(self, old, new):
+		"""
+		{old address: new address or None}. The chain keeps its order, so
+		the identities are aligned as sequences. Without a previous
+		topology the cameras are assumed to be where they were.
+		"""
+		if not old:
+			return dict((address, address) for address in new)
+		def _key(address, identity):
+			# a camera that did not answer matches nothing
+			if None in identity:
+				return (address,)
+			return identity
+		old_addresses = sorted(old)
+		new_addresses = sorted(new)
+		matcher = difflib.SequenceMatcher(None,
+			[_key(a, old[a]) for a in old_addresses],
+			[_key(a, new[a]) for a in new_addresses], autojunk=False)
+		mapping = dict((address, None) for address in old_addresses)
+		for i, j, n in matcher.get_matching_blocks():
+			for k in range(n):
+				mapping[old_addresses[i + k]] = new_addresses[j + k]
+		return mapping
+
+	def _renumber_remap(self, identities):
+		mapping = self._match_topology(self.topology, identities)
+		self.topology = identities
+		if self.topology_file:
+			try:
+				self.save_topology(self.topology_file)
+			except (IOError, OSError) as e:
+				print "visca: can not save the topology to %s: %s" % (self.topology_file, e)
+		if self.DEBUG: print "debug: renumbered, %d devices, mapping %s" % (self.devices, mapping)
+		if self.cache:
+			self.cache.remap(mapping)
+		with self.mutex:
+			self.socket_completed.clear()
+			paused = list(self.paused)
+			self.paused.clear()
+			gone = []
+			for recipient, future in paused:
+				address = mapping.get(recipient, recipient)
+				if address is None:
+					gone.append(future)
+					continue
+				if address != recipient:
+					future.packet = chr(0x80 | address) + future.packet[1:]
+				self.paused.append((address, future))
+		for future in gone:
+			future.set_exception(ViscaNetworkChange("Camera left the bus"))
+		for fn in list(self.renumber_handlers):
+			try:
+				fn(mapping)
+			except Exception as e:
+				print "visca: renumber handler failed: %s" % e
+		self._renumber_finish(mapping, None)
+
+	def _renumber_failed(self, error):
+		if self.running:
+			print "visca: renumbering the bus failed: %s" % error
+		with self.mutex:
+			paused = [future for recipient, future in self.paused]
+			self.paused.clear()
+		for future in paused:
+			future.set_exception(ViscaNetworkChange("Network change, renumbering failed: %s" % error))
+		self._renumber_finish(None, error)
+
+	def _renumber_finish(self, mapping, error):
+		failed = []
+		with self.mutex:
+			if self.renumber_again:
+				self.renumber_again = False
+				again = True
+			else:
+				again = False
+				done = self.renumbering
+				self.renumbering = None
+				paused = list(self.paused)
+				self.paused.clear()
+				for recipient, future in paused:
+					if self.pipeline and future.command and self._sockets_free(recipient) <= 0:
+						self.deferred.setdefault(recipient, deque()).append(future)
+						continue
+					try:
+						self._write_pending(recipient, future)
+					except Exception as e:
+						failed.append((future, e))
+		if again:
+			self._renumber_address(0)
+			return
+		for future, e in failed:
+			future.set_exception(e)
+		if error is not None:
+			done.set_exception(error)
+		else:
+			done.set_result(mapping)
+
 	def cmd_cam(self,device,subcmd):
 		packet='\x01\x04'+subcmd
 		reply = self.send_packet(device,packet)
-		#FIXME: check returned data here and retransmit?
 
 		return reply
 
 	def cmd_pt(self,device,subcmd):
 		packet='\x01\x06'+subcmd
 		reply = self.send_packet(device,packet)
-		#FIXME: check returned data here and retransmit?
 
 		return reply
 
 	def inq_if(self,device,subcmd):
 		packet='\x09\x00'+subcmd
 		reply = self.send_packet(device,packet)
-		#FIXME: check returned data here and retransmit?
 
 		return reply
 
 	def inq_cam(self,device,subcmd):
 		packet='\x09\x04'+subcmd
 		reply = self.send_packet(device,packet)
-		#FIXME: check returned data here and retransmit?
 
 		return reply
 
 	def inq_pt(self,device,subcmd):
 		packet='\x09\x06'+subcmd
 		reply = self.send_packet(device,packet)
-		#FIXME: check returned data here and retransmit?
 
 		return reply
 
-	# Inquiry commands
-	def inq_cam_power(self, device):
-		reply = self.inq_cam(device, '\x00')
-		return ord(reply[2])
-		
-	def inq_cam_zoom_pos(self, device):
-		reply = self.inq_cam(device, '\x47')
-		return self.v2i(reply[2:-1])
+	def _then(self, reply, fn):
+		"""
+		apply fn to a reply. Subclasses that return futures from
+		send_packet (AsyncVisca) chain fn onto the future instead.
+		"""
+		return fn(reply)
 
-	def inq_cam_version(self, device):
-		reply = self.inq_if(device, '\x02')
-		return reply[2:-1]
-		
-	def inq_cam_id(self, device):
-		reply = self.inq_cam(device, '\x22')
-		return self.v2i(reply[2:-1])
-		
-	def inq_cam_videosystem(self, device):
-		reply = self.inq_pt(device, '\x23')
-		return ord(reply[2])
-		
-	def inq_cam_pan_tilt_pos(self, device):
-		reply = self.inq_pt(device, '\x12')
-		pan = self.v2i_signed(reply[2:6])
-		tilt = self.v2i_signed(reply[6:-1])
-		return pan, tilt
-		
 	def decode_power(self, rv):
 		if rv == 2: return 'on'
 		if rv == 3: return 'off'
@@ -489,308 +1731,27 @@ class Visca():
 
 	def cmd_cam_power(self,device,onoff):
 		if onoff:
-			pwr='\x00\x02'
-		else:
-			pwr='\x00\x03'
-		return self.cmd_cam(device,pwr)
-
-	def cmd_cam_power_on(self,device):
-		return self.cmd_cam_power(device,True)
-
-	def cmd_cam_power_off(self,device):
-		return self.cmd_cam_power(device,False)
-
-
-	def cmd_cam_auto_power_off(self,device,time=0):
-		"""
-		time = minutes without command until standby
-		0: disable
-		0xffff: 65535 minutes
-		"""
-		subcmd='\x40'+self.i2v(time)
-
-		return self.cmd_cam(device,subcmd)
-
-
-	# ZOOM control
-
-	def cmd_cam_zoom_stop(self,device):
-		subcmd="\x07\x00"
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_zoom_tele(self,device):
-		subcmd="\x07\x02"
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_zoom_wide(self,device):
-		subcmd="\x07\x03"
-		return self.cmd_cam(device,subcmd)
-
-
-	def cmd_cam_zoom_tele_speed(self,device,speed):
-		"""
-		zoom in with speed = 0..7
-		"""
-		sbyte=0x20+(speed&0b111)
-		subcmd="\x07"+chr(sbyte)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_zoom_wide_speed(self,device,speed):
-		"""
-		zoom in with speed = 0..7
-		"""
-		sbyte=0x30+(speed&0b111)
-		subcmd="\x07"+chr(sbyte)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_zoom_direct(self,device,zoom):
-		"""
-		zoom to value
-		optical: 0..4000
-		digital: 4000..7000 (1x - 4x)
-		"""
-		subcmd="\x47"+self.i2v(zoom)
-		return self.cmd_cam(device,subcmd)
+			return self.cmd_cam_power_on(device)
+		return self.cmd_cam_power_off(device)
 
 	#Digital Zoom control on/off
 	def cmd_cam_dzoom(self,device,state):
 		if state:
-			subcmd="\x06\x02"
-		else:
-			subcmd="\x06\x03"
-
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_dzoom_on(self,device):
-		return self.cmd_cam_dzoom(device,True)
-
-	def cmd_cam_dzoom_off(self,device):
-		return self.cmd_cam_dzoom(device,False)
-
-
-
-#FIXME: CAM_FOCUS COMMANDS
-#FIXME: CAM_WB
-#FIXME: CAM_?GAIN
-#FIXME: CAM_AE
-#FIXME: CAM_SlowShutter
-#FIXME: CAM_Shutter
-#FIXME: CAM_Iris
-#FIXME: CAM_Gain
-#FIXME: CAM_Bright
-#FIXME: CAM_ExpComp
-#FIXME: CAM_BackLight
-#FIXME: CAM_Aperature
-
-	# 16:9 / Wide format:
-	def cmd_cam_wide(self,device,mode):
-		subcmd="\x60"+chr(mode)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_wide_off(self,device):
-		return self.cmd_cam_wide(device,0x00)
-
-	def cmd_cam_wide_cinema(self,device):
-		return self.cmd_cam_wide(device,0x01)
-
-	def cmd_cam_wide_full(self,device):
-		return self.cmd_cam_wide(device,0x02)
-
-
-	# mirror
-	def cmd_cam_lr_reverse(self,device,mode):
-		subcmd="\x61"+chr(mode)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_lr_reverse_on(self,device):
-		return self.cmd_cam_lr_reverse(device,0x02)
-
-	def cmd_cam_lr_reverse_off(self,device):
-		return self.cmd_cam_lr_reverse(device,0x03)
-
-	# freeze
-	def cmd_cam_freeze(self,device,mode):
-		subcmd="\x62"+chr(mode)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_freeze_on(self,device):
-		return self.cmd_cam_freeze(device,0x02)
-
-	def cmd_cam_freeze_off(self,device):
-		return self.cmd_cam_freeze(device,0x03)
-
-
-
-	# Picture Effects
-	def cmd_cam_picture_effect(self,device,mode):
-		subcmd="\x63"+chr(mode)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_picture_effect_off(self,device):
-		return self.cmd_cam_picture_effect(device,0x00)
-
-	def cmd_cam_picture_effect_pastel(self,device):
-		return self.cmd_cam_picture_effect(device,0x01)
-
-	def cmd_cam_picture_effect_negart(self,device):
-		return self.cmd_cam_picture_effect(device,0x02)
-
-	def cmd_cam_picture_effect_sepa(self,device):
-		return self.cmd_cam_picture_effect(device,0x03)
-
-	def cmd_cam_picture_effect_bw(self,device):
-		return self.cmd_cam_picture_effect(device,0x04)
-
-	def cmd_cam_picture_effect_solarize(self,device):
-		return self.cmd_cam_picture_effect(device,0x05)
-
-	def cmd_cam_picture_effect_mosaic(self,device):
-		return self.cmd_cam_picture_effect(device,0x06)
-
-	def cmd_cam_picture_effect_slim(self,device):
-		return self.cmd_cam_picture_effect(device,0x07)
-
-	def cmd_cam_picture_effect_stretch(self,device):
-		return self.cmd_cam_picture_effect(device,0x08)
-
-
-
-	# Digital Effect
-
-	def cmd_cam_digital_effect(self,device,mode):
-		subcmd="\x64"+chr(mode)
-		return self.cmd_cam(device,subcmd)
-
-	def cmd_cam_digital_effect_off(self,device):
-		return self.cmd_cam_digital_effect(device,0x00)
-
-	def cmd_cam_digital_effect_still(self,device):
-		return self.cmd_cam_digital_effect(device,0x01)
-
-	def cmd_cam_digital_effect_flash(self,device):
-		return self.cmd_cam_digital_effect(device,0x02)
-
-	def cmd_cam_digital_effect_lumi(self,device):
-		return self.cmd_cam_digital_effect(device,0x03)
-
-	def cmd_cam_digital_effect_trail(self,device):
-		return self.cmd_cam_digital_effect(device,0x04)
-
-
-	def cmd_cam_digital_effect_level(self,device,level):
-		subcmd="\x65"+chr( 0b00111111 & level)
-		return self.cmd_cam(device,subcmd)
-
+			return self.cmd_cam_dzoom_on(device)
+		return self.cmd_cam_dzoom_off(device)
 
 	# memory of settings including position
 	def cmd_cam_memory(self,device,func,num):
-		if num>5:
-			num=5
 		if func<0 or func>2:
 			return
-		subcmd="\x3f"+chr(func)+chr( 0b0111 & num)
-		return self.cmd_cam(device,subcmd)
-
+		return (self.cmd_cam_memory_reset,self.cmd_cam_memory_set,self.cmd_cam_memory_recall)[func](device,num)
 
-	#FIXME; Can only be executed when motion has stopped!!!
-	def cmd_cam_memory_reset(self,device,num):
-		return self.cmd_cam_memory(device,0x00,num)
-
-	def cmd_cam_memory_set(self,device,num):
-		return self.cmd_cam_memory(device,0x01,num)
-
-	def cmd_cam_memory_recall(self,device,num):
-		return self.cmd_cam_memory(device,0x02,num)
-
-
-	# Datascreen control
-
-	def cmd_datascreen(self,device,func):
-		subcmd='\x06'+chr(func)
-		return self.cmd_pt(device,subcmd)
-
-	def cmd_datascreen_on(self,device):
-		return self.cmd_datascreen(device,0x02)
-
-	def cmd_datascreen_off(self,device):
-		return self.cmd_datascreen(device,0x03)
-
-	def cmd_datascreen_toggle(self,device):
-		return self.cmd_datascreen(device,0x10)
+	# All other cmd_* and inq_* methods are generated from the table in
+	# commands, see commands.install below.
 
 
 #FIXME: IR_Receive
 #FIXME: IR_Receive_Return
-
-
-	# Pan and Tilt Drive:
-
-	def cmd_ptd(self,device,ps,ts,lr,ud):
-
-		subcmd='\x01'+chr(ps)+chr(ts)+chr(lr)+chr(ud)
-		return self.cmd_pt(device,subcmd)
-
-	def cmd_ptd_up(self,device,ts=0x14):
-		return self.cmd_ptd(device,0,ts,0x03,0x01)
-
-	def cmd_ptd_down(self,device,ts=0x14):
-		return self.cmd_ptd(device,0,ts,0x03,0x02)
-
-	def cmd_ptd_left(self,device,ps=0x18):
-		return self.cmd_ptd(device,ps,0,0x01,0x03)
-
-	def cmd_ptd_right(self,device,ps=0x18):
-		return self.cmd_ptd(device,ps,0,0x02,0x03)
-
-
-	def cmd_ptd_upleft(self,device,ts=0x14,ps=0x18):
-		return self.cmd_ptd(device,ps,ts,0x01,0x01)
-
-	def cmd_ptd_upright(self,device,ts=0x14,ps=0x18):
-		return self.cmd_ptd(device,ps,ts,0x02,0x01)
-
-	def cmd_ptd_downleft(self,device,ts=0x14,ps=0x18):
-		return self.cmd_ptd(device,ps,ts,0x01,0x02)
-
-	def cmd_ptd_downright(self,device,ts=0x14,ps=0x18):
-		return self.cmd_ptd(device,ps,ts,0x02,0x02)
-
-	def cmd_ptd_stop(self,device):
-		return self.cmd_ptd(device,0,0,0x03,0x03)
-
-
-
-	def cmd_ptd_abs(self,device,ts=0x14,ps=0x18,pp=0,tp=0):
-
-		if self.DEBUG: print "DEBUG: ABS POS TO %d/%d" % (pp,tp)
-
-		# pp: range: -1440 - 1440
-		if pp<0:
-			p=(((pp*-1)-1)^0xffff)
-		else:
-			p=pp
-
-		#tp: range -360 - 360
-		if tp<0:
-			t=(((tp*-1)-1)^0xffff)
-		else:
-			t=tp
-
-		subcmd='\x02'+chr(ts)+chr(ps)+self.i2v(p)+self.i2v(t)
-		return self.cmd_pt(device,subcmd)
-
-
-	def cmd_ptd_home(self,device):
-		subcmd='\x04'
-		return self.cmd_pt(device,subcmd)
-
-	def cmd_ptd_reset(self,device):
-		subcmd='\x05'
-		return self.cmd_pt(device,subcmd)
-
-
 #FIXME: Pan-tiltLimitSet
 
-
-
-
+commands.install(Visca)
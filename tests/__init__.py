@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Tests, run with python -m unittest discover"""
+
+import sys
+import unittest
+from StringIO import StringIO
+
+
+class TestCase(unittest.TestCase):
+	"""
+	keeps what the library prints (timeouts, dropped packets) out of the
+	test output, it is in self.output for the test to look at
+	"""
+
+	def run(self,result=None):
+		stdout=sys.stdout
+		sys.stdout=self.output=StringIO()
+		try:
+			return unittest.TestCase.run(self,result)
+		finally:
+			sys.stdout=stdout
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""AsyncVisca on an event loop, against a simulator on a pty"""
+
+import unittest
+
+from pyviscalib.visca import ViscaError, ViscaTimeout
+from pyviscalib.simulator import ViscaSimulator, ViscaPtyServer
+from tests import TestCase
+
+try:
+	from pyviscalib.aiovisca import AsyncVisca, asyncio
+except ImportError:
+	AsyncVisca=None
+
+
+@unittest.skipIf(AsyncVisca is None,'needs asyncio or trollius')
+class AsyncViscaTest(TestCase):
+
+	def setUp(self):
+		self.sim=ViscaSimulator(2,virtual=True)
+		self.server=ViscaPtyServer(self.sim).start()
+		self.loop=asyncio.new_event_loop()
+		self.visca=AsyncVisca(self.server.port,loop=self.loop,baudrate=9600)
+
+	def tearDown(self):
+		self.visca.close()
+		self.server.stop()
+		self.loop.close()
+
+	def run_loop(self,future,timeout=5):
+		return self.loop.run_until_complete(asyncio.wait_for(future,timeout,loop=self.loop))
+
+	def test_inquiry(self):
+		self.assertEqual(self.run_loop(self.visca.inq_cam_id(2)),2)
+
+	def test_command_completes(self):
+		v=self.visca
+		handle=self.run_loop(v.cmd_cam_zoom_direct(1,0x1234))
+		self.run_loop(v.wait_for_cmd_completion(handle))
+		self.assertEqual(self.run_loop(v.inq_cam_zoom_pos(1)),0x1234)
+
+	def test_no_reply_times_out(self):
+		self.sim.unplug()
+		future=self.visca.inq_cam_id(2)
+		self.assertRaises(ViscaTimeout,self.run_loop,future)
+		self.assertFalse(self.visca.pending.get(2))
+
+	def test_end_of_file_fails_what_waits(self):
+		self.sim.unplug()
+		future=self.visca.inq_cam_id(2)
+		self.server.stop()
+		# a fresh one for tearDown to stop
+		self.server=ViscaPtyServer(self.sim)
+		try:
+			self.run_loop(future)
+		except ViscaError as e:
+			self.assertFalse(isinstance(e,ViscaTimeout))
+		else:
+			self.fail('reply without a port')
+		self.assertEqual(self.visca.transport,None)
+		self.assertFalse(self.loop.remove_reader(self.visca.fd))
+
+
+if __name__=='__main__':
+	unittest.main()
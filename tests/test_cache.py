@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaCache on its own and in front of the simulated camera chain"""
+
+import time
+import unittest
+
+from pyviscalib.visca import Visca, ViscaFuture
+from pyviscalib.cache import ViscaCache
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from pyviscalib.trace import SENT
+from tests import TestCase
+
+ZOOM_POS='\x09\x04\x47'
+CAM_ID='\x09\x04\x22'
+
+
+class CacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cache=ViscaCache({ZOOM_POS: 0.05})
+
+	def store(self,camera,inquiry,reply):
+		future=ViscaFuture()
+		self.cache.watch_inquiry(camera,inquiry,future)
+		future.set_result(reply)
+
+	def test_replies_expire(self):
+		self.store(1,ZOOM_POS,'\x90\x50\x01\x02\x03\x04\xff')
+		self.store(1,CAM_ID,'\x90\x50\x00\x00\x00\x01\xff')
+		self.assertEqual(self.cache.get(1,ZOOM_POS),'\x90\x50\x01\x02\x03\x04\xff')
+		time.sleep(0.06)
+		self.assertEqual(self.cache.get(1,ZOOM_POS),None)
+		self.assertEqual(self.cache.get(1,CAM_ID),'\x90\x50\x00\x00\x00\x01\xff')
+		self.assertEqual((self.cache.hits,self.cache.misses),(2,1))
+
+	def test_unknown_inquiries_are_not_cached(self):
+		self.store(1,'\x09\x04\x4b','\x90\x50\x00\x00\x00\x00\xff')
+		self.assertEqual(self.cache.get(1,'\x09\x04\x4b'),None)
+		self.assertEqual(self.cache.entries,{})
+
+	def test_reply_under_way_during_invalidation_is_dropped(self):
+		future=ViscaFuture()
+		self.cache.watch_inquiry(1,ZOOM_POS,future)
+		self.cache.invalidate(1,self.cache.affected('\x01\x04\x47\x01\x02\x03\x04'))
+		future.set_result('\x90\x50\x01\x02\x03\x04\xff')
+		self.assertEqual(self.cache.get(1,ZOOM_POS),None)
+
+	def test_remap(self):
+		self.store(1,CAM_ID,'\x90\x50\x00\x00\x00\x01\xff')
+		self.store(2,CAM_ID,'\x90\x50\x00\x00\x00\x02\xff')
+		self.cache.remap({1: 2, 2: None})
+		self.assertEqual(self.cache.get(2,CAM_ID),'\x90\x50\x00\x00\x00\x01\xff')
+		self.assertEqual(self.cache.get(1,CAM_ID),None)
+
+
+class CachedViscaTest(TestCase):
+
+	def setUp(self):
+		self.cache=ViscaCache()
+		self.visca=Visca(SimTransport(ViscaSimulator(2,virtual=True),timeout=0.1),cache=self.cache)
+
+	def tearDown(self):
+		self.visca.close()
+
+	def sent(self):
+		return len([record for record in self.visca.trace.records() if record[1]==SENT])
+
+	def test_repeated_inquiry_stays_off_the_bus(self):
+		self.assertEqual(self.visca.inq_cam_id(2),2)
+		sent=self.sent()
+		self.assertEqual(self.visca.inq_cam_id(2),2)
+		self.assertEqual(self.sent(),sent)
+		self.assertEqual(self.cache.hits,1)
+
+	def test_command_invalidates(self):
+		v=self.visca
+		self.assertEqual(v.inq_cam_zoom_pos(1),0)
+		v.wait_for_cmd_completion(v.cmd_cam_zoom_direct(1,0x1234),10)
+		self.assertEqual(v.inq_cam_zoom_pos(1),0x1234)
+
+
+if __name__=='__main__':
+	unittest.main()
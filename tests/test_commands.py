@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""The command table: binding arguments, decoding replies"""
+
+import unittest
+
+from pyviscalib import commands
+from pyviscalib.visca import Visca, ViscaError
+
+
+class CommandTest(unittest.TestCase):
+
+	def test_values(self):
+		ptd_abs=commands.BY_NAME['cmd_ptd_abs']
+		self.assertEqual(ptd_abs.values((0x10,),{'tp': 5}),(0x10,0x18,0,5))
+		self.assertEqual(ptd_abs.values({'pp': 7}),(0x14,0x18,7,0))
+		# clamped to the range
+		self.assertEqual(ptd_abs.values((0x30,0)),(0x17,0x01,0,0))
+
+	def test_bad_arguments(self):
+		ptd_abs=commands.BY_NAME['cmd_ptd_abs']
+		self.assertRaises(TypeError,ptd_abs.values,(1,2,3,4,5))
+		self.assertRaises(TypeError,ptd_abs.values,(1,),{'ts': 2})
+		self.assertRaises(TypeError,ptd_abs.values,(),{'speed': 2})
+		self.assertRaises(TypeError,commands.BY_NAME['cmd_cam_zoom_direct'].values,())
+
+	def test_decode(self):
+		self.assertEqual(commands.BY_NAME['inq_cam_pan_tilt_pos'].decode('\x90\x50\x0f\x0f\x0f\x0f\x00\x00\x01\x02\xff'),(-1,0x12))
+		self.assertEqual(commands.BY_NAME['inq_cam_version'].decode('\x90\x50\x00\x01\xff'),'\x00\x01')
+
+	def test_short_reply(self):
+		self.assertRaises(ViscaError,commands.BY_NAME['inq_cam_zoom_pos'].decode,'\x90\x50\x01\xff')
+		self.assertRaises(ViscaError,commands.BY_NAME['inq_cam_power'].decode,'\x90\x50\xff')
+
+	def test_generated_methods(self):
+		method=Visca.cmd_cam_zoom_direct
+		self.assertEqual(method.__name__,'cmd_cam_zoom_direct')
+		self.assertEqual(method.__doc__,commands.BY_NAME['cmd_cam_zoom_direct'].doc)
+		# checked before anything is sent
+		self.assertRaises(TypeError,method,None,1)
+
+	def test_lookup(self):
+		self.assertEqual(commands.lookup('\x01\x04\x07\x00').name,'cmd_cam_zoom_stop')
+		self.assertEqual(commands.lookup('\x01\x04\x07\x23').name,'cmd_cam_zoom_tele_speed')
+		self.assertEqual(commands.lookup('\x01\x7f\x7f'),None)
+
+
+if __name__=='__main__':
+	unittest.main()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaDaemon and ViscaClient against the simulator"""
+
+import os
+import shutil
+import tempfile
+
+from pyviscalib.visca import Visca, ViscaError
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from pyviscalib.daemon import ViscaDaemon, ViscaClient
+from tests import TestCase
+
+
+class DaemonTest(TestCase):
+
+	def setUp(self):
+		self.dir=tempfile.mkdtemp()
+		self.sim=ViscaSimulator(2)
+		self.visca=Visca(SimTransport(self.sim,timeout=0.1))
+		self.daemon=ViscaDaemon(self.visca,os.path.join(self.dir,'visca.sock'))
+		self.daemon.timeout=0.5
+		self.daemon.start()
+		self.client=ViscaClient(self.daemon.path)
+
+	def tearDown(self):
+		self.client.close()
+		self.daemon.stop()
+		self.visca.close()
+		shutil.rmtree(self.dir)
+
+	def test_inquiry(self):
+		self.assertEqual(self.client.request('inq_cam_power',1),2)
+
+	def test_command_is_acked_and_completed(self):
+		id=self.client.send('cmd_cam_power_off',1)
+		self.assertEqual(self.client.receive(),{'id': id,'ack': True})
+		self.assertEqual(self.client.receive(),{'id': id,'completed': True})
+		self.assertEqual(self.client.request('inq_cam_power',1),3)
+
+	def test_same_inquiries_are_merged(self):
+		other=ViscaClient(self.daemon.path)
+		try:
+			ids=[self.client.send('inq_cam_power',1),other.send('inq_cam_power',1)]
+			self.assertEqual(self.client.receive(),{'id': ids[0],'result': 2})
+			self.assertEqual(other.receive(),{'id': ids[1],'result': 2})
+		finally:
+			other.close()
+
+	def test_bad_args(self):
+		with self.assertRaises(ViscaError) as raised:
+			self.client.request('cmd_cam_auto_power_off',1,speed=3)
+		self.assertIn('TypeError',str(raised.exception))
+
+	def test_failed_inquiry_is_not_joined(self):
+		self.visca.close()
+		for _ in range(2):
+			with self.assertRaises(ViscaError) as raised:
+				self.client.request('inq_cam_power',1)
+			self.assertIn('Port is not open',str(raised.exception))
+		self.assertEqual(self.daemon.inquiries,{})
+
+	def test_camera_gone(self):
+		self.sim.unplug()
+		with self.assertRaises(ViscaError) as raised:
+			self.client.request('inq_cam_power',2)
+		self.assertIn('ViscaTimeout',str(raised.exception))
+		self.assertEqual(self.daemon.inquiries,{})
+
+	def test_command_not_completing(self):
+		self.daemon.completion_timeout=0.2
+		id=self.client.send('cmd_ptd_abs',1,ps=1,ts=1,pp=2000,tp=1000)
+		self.assertEqual(self.client.receive(),{'id': id,'ack': True})
+		message=self.client.receive()
+		self.assertEqual(message['id'],id)
+		self.assertEqual(message['type'],'ViscaTimeout')
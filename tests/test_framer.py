@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaFramer, and Visca reading replies in small pieces"""
+
+import unittest
+
+from pyviscalib.visca import Visca, ViscaFramer
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from tests import TestCase
+
+
+class FramerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.framer=ViscaFramer()
+
+	def packets(self):
+		packets=[]
+		while True:
+			packet=self.framer.get()
+			if packet is None:
+				return packets
+			packets.append(packet)
+
+	def test_several_packets_in_one_chunk(self):
+		self.framer.feed('\x90\x41\xff\x90\x51\xff\x90\x50\x02\xff')
+		self.assertEqual(len(self.framer),3)
+		self.assertEqual(self.packets(),['\x90\x41\xff','\x90\x51\xff','\x90\x50\x02\xff'])
+
+	def test_packet_split_over_chunks(self):
+		self.framer.feed('\x90\x50')
+		self.assertEqual(self.packets(),[])
+		self.framer.feed('\x02\xff\x90')
+		self.assertEqual(self.packets(),['\x90\x50\x02\xff'])
+		self.assertEqual(self.framer.buffer,'\x90')
+		self.framer.feed('\x41\xff')
+		self.assertEqual(self.packets(),['\x90\x41\xff'])
+		self.assertEqual(self.framer.buffer,'')
+
+	def test_garbage_without_terminator_is_passed_on(self):
+		self.framer.feed('\x01'*ViscaFramer.MAXLEN)
+		self.assertEqual(self.packets(),['\x01'*ViscaFramer.MAXLEN])
+		self.assertEqual(self.framer.buffer,'')
+
+	def test_reset(self):
+		self.framer.feed('\x90\x41\xff\x90')
+		self.framer.reset()
+		self.assertEqual(self.packets(),[])
+		self.assertEqual(self.framer.buffer,'')
+
+
+class TrickleTransport(SimTransport):
+	"""hands out one byte per read, whatever is waiting"""
+
+	def read(self,size=1):
+		return SimTransport.read(self,1)
+
+
+class TrickleTest(TestCase):
+
+	def setUp(self):
+		self.visca=Visca(TrickleTransport(ViscaSimulator(2,virtual=True),timeout=0.1))
+
+	def tearDown(self):
+		self.visca.close()
+
+	def test_replies_read_a_byte_at_a_time(self):
+		v=self.visca
+		v.wait_for_cmd_completion(v.cmd_cam_zoom_direct(2,0x2345),10)
+		self.assertEqual(v.inq_cam_zoom_pos(2),0x2345)
+		self.assertEqual(v.inq_cam_id(1),1)
+
+
+if __name__=='__main__':
+	unittest.main()
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaMetrics histograms, counters and the Prometheus output"""
+
+import unittest
+
+from pyviscalib.metrics import ViscaMetrics, Histogram
+from pyviscalib.visca import Visca
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from tests import TestCase
+
+
+class HistogramTest(unittest.TestCase):
+
+	def test_buckets(self):
+		histogram=Histogram((0.1,1.0))
+		for value in (0.05,0.1,0.5,3):
+			histogram.observe(value)
+		self.assertEqual(histogram.snapshot()['buckets'],[(0.1,2),(1.0,3),(float('inf'),4)])
+		self.assertEqual(histogram.quantile(0.5),0.1)
+		self.assertEqual(histogram.quantile(1),float('inf'))
+		self.assertEqual(Histogram().quantile(0.5),None)
+
+
+class MetricsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.metrics=ViscaMetrics()
+
+	def commands(self):
+		return [(stats['camera'],stats['opcode'],stats['command']) for stats in self.metrics.snapshot()]
+
+	def test_commands_sharing_an_opcode(self):
+		m=self.metrics
+		m.ack(1,'\x81\x01\x04\x07\x02\xff',0.01)
+		m.ack(1,'\x81\x01\x04\x07\x00\xff',0.01)
+		m.ack(1,'\x81\x01\x04\x07\x23\xff',0.01)
+		m.ack(1,'\x81\x01\x04\x07\x25\xff',0.01)
+		m.retry(1,'\x81\x01\x04\x00\x02\xff')
+		m.timeout(1,'\x81\x01\x04\x00\x03\xff')
+		self.assertEqual(self.commands(),[
+			(1,'010400','cmd_cam_power_off'),
+			(1,'010400','cmd_cam_power_on'),
+			(1,'010407','cmd_cam_zoom_stop'),
+			(1,'010407','cmd_cam_zoom_tele'),
+			(1,'010407','cmd_cam_zoom_tele_speed'),
+			])
+		self.assertEqual(self.metrics.snapshot()[-1]['ack']['count'],2)
+
+	def test_memory(self):
+		for function in range(3):
+			self.metrics.ack(2,'\x82\x01\x04\x3f'+chr(function)+'\x01\xff',0.01)
+		self.assertEqual([name for camera,opcode,name in self.commands()],['cmd_cam_memory_recall','cmd_cam_memory_reset','cmd_cam_memory_set'])
+
+	def test_bus_commands(self):
+		self.metrics.ack(-1,'\x88\x30\x01\xff',0.01)
+		self.metrics.ack(-1,'\x88\x01\x00\x01\xff',0.01)
+		self.metrics.ack(-1,'\x88\x01\x7f\x7f\xff',0.01)
+		self.assertEqual(self.commands(),[(-1,'010001','cmd_if_clear_all'),(-1,'017f7f',''),(-1,'3001','cmd_adress_set')])
+
+	def test_prometheus(self):
+		self.metrics.ack(1,'\x81\x09\x04\x22\xff',0.003)
+		self.metrics.error(1,'\x81\x09\x04\x22\xff',0x02)
+		text=self.metrics.prometheus()
+		labels='camera="1",opcode="090422",command="inq_cam_id"'
+		self.assertTrue('visca_ack_seconds_bucket{%s,le="0.005"} 1' % labels in text)
+		self.assertTrue('visca_ack_seconds_count{%s} 1' % labels in text)
+		self.assertTrue('visca_errors_total{%s,code="0x02"} 1' % labels in text)
+		self.assertTrue('visca_timeouts_total{%s} 0' % labels in text)
+
+
+class ViscaMetricsTest(TestCase):
+
+	def test_visca_measures(self):
+		visca=Visca(SimTransport(ViscaSimulator(1,virtual=True),timeout=0.1))
+		try:
+			visca.wait_for_cmd_completion(visca.cmd_cam_zoom_direct(1,0x1000),10)
+		finally:
+			visca.close()
+		stats=[stats for stats in visca.metrics.snapshot() if stats['command']=='cmd_cam_zoom_direct'][0]
+		self.assertEqual((stats['ack']['count'],stats['completion']['count']),(1,1))
+
+
+if __name__=='__main__':
+	unittest.main()
@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaPoller against the simulated camera chain"""
+
+import time
+import unittest
+
+from pyviscalib.visca import Visca
+from pyviscalib.poller import ViscaPoller, CameraState
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from tests import TestCase
+
+
+class PollerTest(TestCase):
+
+	def setUp(self):
+		self.visca=Visca(SimTransport(ViscaSimulator(2,virtual=True),timeout=0.1))
+		self.poller=ViscaPoller(self.visca,[1,2],rate=50)
+		self.changes=[]
+		self.poller.subscribe(lambda old,new: self.changes.append((old,new)))
+
+	def tearDown(self):
+		self.poller.stop()
+		self.visca.close()
+
+	def test_poll(self):
+		v=self.visca
+		v.wait_for_cmd_completion(v.cmd_ptd_abs(2,pp=100,tp=-20),10)
+		v.wait_for_cmd_completion(v.cmd_cam_zoom_direct(2,0x1000),10)
+		state=self.poller.poll(2)
+		self.assertEqual((state.pan,state.tilt,state.zoom),(100,-20,0x1000))
+		self.assertTrue(self.poller.state(2) is state)
+		self.assertEqual(len(self.changes),1)
+		self.assertEqual(self.changes[0][0].zoom,None)
+		self.poller.poll(2)
+		self.assertEqual(len(self.changes),1)
+
+	def test_background_polling_sees_changes(self):
+		v=self.visca
+		self.poller.start()
+		v.wait_for_cmd_completion(v.cmd_cam_zoom_direct(1,0x2000),10)
+		deadline=time.time()+2
+		while self.poller.state(1).zoom!=0x2000 and time.time()<deadline:
+			time.sleep(0.01)
+		self.assertEqual(self.poller.state(1).zoom,0x2000)
+
+	def test_remap(self):
+		self.poller.poll(1)
+		self.poller.remap({1: 2, 2: None})
+		self.assertEqual(self.poller.devices,[2])
+		self.assertEqual(self.poller.state(2).device,2)
+		self.assertEqual(self.poller.state(2).zoom,0)
+
+	def test_states_are_replaced(self):
+		state=CameraState(1,zoom=5)
+		changed=state.replace(zoom=6)
+		self.assertEqual((state.zoom,changed.zoom,changed.device),(5,6,1))
+		self.assertFalse(state.same(changed))
+
+
+if __name__=='__main__':
+	unittest.main()
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaScheduler queues, against the simulated camera chain"""
+
+import unittest
+
+from pyviscalib.visca import Visca, ViscaTimeout
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from pyviscalib.scheduler import ViscaScheduler
+from pyviscalib.trace import SENT
+from tests import TestCase
+
+ZOOM_STOP='\x01\x04\x07\x00'
+POWER_INQ='\x09\x04\x00'
+
+
+class SchedulerTest(TestCase):
+
+	def setUp(self):
+		self.sim=ViscaSimulator(3,virtual=True)
+		self.visca=Visca(SimTransport(self.sim,timeout=0.1))
+		self.scheduler=ViscaScheduler(self.visca)
+
+	def tearDown(self):
+		self.visca.close()
+
+	def sent(self,since):
+		return [(camera,packet[1:]) for timestamp,direction,camera,packet in self.visca.trace.records(since) if direction==SENT]
+
+	def test_slow_camera_delays_only_itself(self):
+		self.sim.unplug()
+		first=self.visca.submit_packet(3,POWER_INQ)
+		second=self.visca.submit_packet(3,POWER_INQ)
+		self.assertEqual(self.scheduler.queued(3),1)
+		self.assertTrue(self.scheduler.in_flight[3] is first)
+		self.assertTrue(self.visca.submit_packet(2,POWER_INQ).wait(1))
+		self.assertFalse(first.done() or second.done())
+
+	def test_inquiries_before_commands(self):
+		for camera in range(3):
+			self.sim.unplug()
+		since=self.visca.trace.count
+		first=self.visca.submit_packet(1,ZOOM_STOP)
+		self.visca.submit_packet(1,ZOOM_STOP)
+		self.visca.submit_packet(1,POWER_INQ)
+		self.assertEqual(self.scheduler.queued(1),2)
+		first.set_exception(ViscaTimeout('no reply'))
+		self.assertEqual(self.sent(since),[(1,ZOOM_STOP+'\xff'),(1,POWER_INQ+'\xff')])
+
+	def test_cameras_take_turns(self):
+		for camera in range(3):
+			self.sim.unplug()
+		since=self.visca.trace.count
+		futures=[self.visca.submit_packet(camera,POWER_INQ) for camera in (1,1,1,2,2)]
+		self.assertEqual([camera for camera,packet in self.sent(since)],[1,2])
+		futures[0].set_exception(ViscaTimeout('no reply'))
+		futures[3].set_exception(ViscaTimeout('no reply'))
+		futures[1].set_exception(ViscaTimeout('no reply'))
+		self.assertEqual([camera for camera,packet in self.sent(since)],[1,2,1,2,1])
+
+
+if __name__=='__main__':
+	unittest.main()
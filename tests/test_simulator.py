@@ -0,0 +1,483 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Visca against the simulated camera chain"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from pyviscalib.visca import Visca, ViscaFuture, ViscaRetryPolicy, ViscaError, ViscaTimeout, ViscaReplyError, ViscaSyntaxError, ViscaBufferFull, ViscaNotExecutable
+from pyviscalib.simulator import ViscaSimulator, SimTransport, ViscaPtyServer
+from pyviscalib.batch import ViscaBatch, DONE, TIMEOUT
+from pyviscalib.presets import ViscaPresets
+from pyviscalib.motion import ViscaMotion
+from pyviscalib.controller import ViscaController
+from pyviscalib.transport import ViscaIPServer
+from tests import TestCase
+
+
+class SimTestCase(TestCase):
+	"""a Visca talking to a fresh simulator, on virtual time by default"""
+
+	cameras=3
+	virtual=True
+	options={}
+
+	def setUp(self):
+		self.sim=ViscaSimulator(self.cameras,virtual=self.virtual)
+		self.visca=Visca(SimTransport(self.sim,timeout=0.1),**self.options)
+
+	def tearDown(self):
+		self.visca.close()
+
+	def complete(self,*handles):
+		for handle in handles:
+			self.visca.wait_for_cmd_completion(handle,10)
+
+
+class PipelineTest(SimTestCase):
+
+	options={'pipeline':True}
+
+	def test_more_commands_than_sockets(self):
+		v=self.visca
+		handles=[v.cmd_cam_zoom_direct(1,0x1000),v.cmd_ptd_abs(1,pp=100,tp=10),v.cmd_cam_focus_direct(1,0x2000)]
+		self.complete(*handles)
+		self.assertEqual(v.inq_cam_zoom_pos(1),0x1000)
+		self.assertEqual(v.inq_cam_pan_tilt_pos(1),(100,10))
+		self.assertEqual(v.inq_cam_focus_pos(1),0x2000)
+
+	def test_buffer_full_without_pipeline(self):
+		v=self.visca
+		v.pipeline=False
+		v.cmd_cam_zoom_direct(1,0x1000)
+		v.cmd_ptd_abs(1,pp=100,tp=10)
+		self.assertRaises(ViscaBufferFull,v.cmd_cam_focus_direct,1,0x2000)
+
+	def test_cameras_run_in_parallel(self):
+		v=self.visca
+		handles=[v.cmd_ptd_abs(cam,pp=10*cam,tp=-cam) for cam in (1,2,3)]
+		self.complete(*handles)
+		self.assertEqual([v.inq_cam_pan_tilt_pos(cam) for cam in (1,2,3)],[(10,-1),(20,-2),(30,-3)])
+
+
+class SubmitTest(SimTestCase):
+
+	virtual=False
+
+	def test_no_reply(self):
+		v=self.visca
+		self.sim.unplug()
+		time.sleep(0.2)
+		started=time.time()
+		future=v.submit_template(3,'inq_cam_id')
+		self.assertTrue(future.wait(1))
+		self.assertTrue(isinstance(future.exception(),ViscaTimeout))
+		self.assertTrue(time.time()-started<0.5)
+		self.assertFalse(v.pending.get(3))
+		self.assertEqual(v.counters['timeouts'],1)
+
+	def test_reply(self):
+		self.assertEqual(self.visca.submit_template(2,'inq_cam_id').result(1),'\xa0\x50\x00\x00\x00\x02\xff')
+
+	def test_completion_timeout(self):
+		v=self.visca
+		handle=v.submit_template(1,'cmd_ptd_abs',(0x01,0x01,0x800,0),completion_timeout=0.1).result(1)
+		self.assertTrue(handle.wait(1))
+		self.assertTrue(isinstance(handle.exception(),ViscaTimeout))
+		self.assertEqual(v.socket_in_use,{})
+
+
+class ErrorTest(SimTestCase):
+
+	def test_not_executable(self):
+		self.sim.inject_error(1,0x41)
+		self.assertRaises(ViscaNotExecutable,self.visca.cmd_cam_power_on,1)
+
+	def test_syntax_error(self):
+		self.sim.inject_error(2,0x02)
+		try:
+			self.visca.cmd_cam_zoom_tele(2)
+		except ViscaSyntaxError as e:
+			self.assertEqual(e.code,0x02)
+			self.assertTrue(isinstance(e,ViscaReplyError))
+		else:
+			self.fail("no ViscaSyntaxError")
+
+	def test_error_leaves_the_camera_usable(self):
+		self.sim.inject_error(1,0x41)
+		self.assertRaises(ViscaError,self.visca.cmd_cam_zoom_tele,1)
+		self.complete(self.visca.cmd_cam_zoom_direct(1,0x800))
+		self.assertEqual(self.visca.inq_cam_zoom_pos(1),0x800)
+
+
+class RetryTest(SimTestCase):
+
+	options={'retry_policy':ViscaRetryPolicy(turnaround=0.01)}
+
+	def test_inquiry_timeout_is_typed(self):
+		v=self.visca
+		self.assertRaises(ViscaTimeout,v.inq_cam_power,5)
+		self.assertEqual(v.counters['retries'],2)
+		self.assertEqual(v.counters['timeouts'],1)
+
+	def test_camera_answers_after_a_timeout(self):
+		v=self.visca
+		self.assertRaises(ViscaTimeout,v.inq_cam_zoom_pos,6)
+		self.assertEqual(v.inq_cam_zoom_pos(1),0)
+
+	def test_default_policy_gives_up_within_two_seconds(self):
+		policy=ViscaRetryPolicy()
+		total=sum(policy.timeout(9600,16,16,attempt) for attempt in range(policy.retries+1))
+		self.assertTrue(total<2.0,total)
+
+
+class ClearTest(SimTestCase):
+
+	cameras=2
+	virtual=False
+	options={'retry_policy':ViscaRetryPolicy(turnaround=0.02,retries=0,clear_after=3)}
+
+	def test_missing_camera_does_not_clear_the_bus(self):
+		v=self.visca
+		v.renumber()
+		handle=v.cmd_ptd_abs(1,ts=1,ps=1,pp=1400,tp=300)
+		for attempt in range(4):
+			self.assertRaises(ViscaTimeout,v.inq_cam_power,7)
+		self.assertEqual(v.counters['recoveries'],0)
+		self.assertFalse(handle.done())
+
+	def test_silent_bus_is_cleared(self):
+		v=self.visca
+		v.renumber()
+		v.renumber_on_change=False
+		self.sim.unplug()
+		self.sim.unplug()
+		# let the network change the first unplug reports go by
+		time.sleep(0.2)
+		for attempt in range(3):
+			for cam in (1,2):
+				self.assertRaises(ViscaTimeout,v.inq_cam_power,cam)
+		self.assertEqual(v.counters['recoveries'],1)
+
+
+class RenumberTest(SimTestCase):
+
+	def test_unplug_moves_the_cameras_up(self):
+		v=self.visca
+		self.assertEqual(v.renumber(),{1:1,2:2,3:3})
+		renumbered=threading.Event()
+		mappings=[]
+		def _renumbered(mapping):
+			mappings.append(mapping)
+			renumbered.set()
+		v.renumber_handlers.append(_renumbered)
+		self.sim.unplug(0)
+		self.assertTrue(renumbered.wait(5))
+		self.assertEqual(mappings[-1],{1:None,2:1,3:2})
+		self.assertEqual(v.devices,2)
+		self.assertEqual([v.inq_cam_id(cam) for cam in (1,2)],[2,3])
+
+	def test_no_thread_per_packet(self):
+		v=self.visca
+		v.renumber()
+		threads=threading.active_count()
+		v.renumber()
+		self.assertEqual(threading.active_count(),threads)
+
+	def test_plug_adds_a_camera(self):
+		v=self.visca
+		v.renumber()
+		renumbered=threading.Event()
+		v.renumber_handlers.append(lambda mapping: renumbered.set())
+		self.sim.plug()
+		self.assertTrue(renumbered.wait(5))
+		self.assertEqual(v.devices,4)
+
+
+class TopologyTest(SimTestCase):
+
+	virtual=False
+
+	def setUp(self):
+		SimTestCase.setUp(self)
+		self.directory=tempfile.mkdtemp()
+		self.filename=os.path.join(self.directory,'topology.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		SimTestCase.tearDown(self)
+
+	def reopen(self):
+		self.visca.close()
+		self.visca=Visca(SimTransport(self.sim,timeout=0.1),lazy=True)
+
+	def test_saved_topology_is_reused(self):
+		self.assertEqual(self.visca.startup(self.filename),3)
+		self.reopen()
+		self.assertEqual(self.visca.startup(self.filename),3)
+		self.assertEqual(self.visca.counters['renumbers'],0)
+
+	def test_missing_camera_fails_the_check_fast(self):
+		self.visca.startup(self.filename)
+		self.reopen()
+		# gone without a word, as when the chain was changed while we were not running
+		self.sim.cameras.pop()
+		started=time.time()
+		self.assertEqual(self.visca.startup(self.filename),2)
+		self.assertTrue(time.time()-started<1.0,time.time()-started)
+		self.assertEqual(self.visca.counters['renumbers'],1)
+
+
+class BatchTest(SimTestCase):
+
+	options={'pipeline':True}
+
+	def test_scene(self):
+		batch=ViscaBatch(self.visca)
+		for cam in (1,2,3):
+			batch.add(cam,'cmd_ptd_abs',0x14,0x18,-100*cam,20*cam)
+			batch.add(cam,'inq_cam_power')
+		results=batch.run(timeout=10)
+		for cam in (1,2,3):
+			self.assertEqual([result.status for result in results[cam]],[DONE,DONE])
+			self.assertEqual(results[cam][1].value,2)
+			self.assertEqual(self.visca.inq_cam_pan_tilt_pos(cam),(-100*cam,20*cam))
+
+	def test_broadcast(self):
+		results=ViscaBatch(self.visca).add_broadcast('cmd_ptd_home').run(5)
+		self.assertTrue(results[-1][0].ok())
+
+	def test_addresses_are_checked(self):
+		batch=ViscaBatch(self.visca)
+		for address in (0,8,9,-1):
+			self.assertRaises(ViscaError,batch.add,address,'cmd_cam_power_on')
+		self.assertEqual(batch.operations,[])
+
+	def test_defaults_and_clamping(self):
+		batch=ViscaBatch(self.visca)
+		batch.add(1,'cmd_ptd_abs',pp=100)
+		batch.add(2,'cmd_ptd_abs',0x30,0x30,-50,10)
+		batch.add(3,'cmd_ptd_abs')
+		self.assertEqual([values for device,command,values in batch.operations],[(0x14,0x18,100,0),(0x17,0x18,-50,10),(0x14,0x18,0,0)])
+		self.assertRaises(TypeError,batch.add,1,'cmd_cam_zoom_direct')
+		self.assertRaises(TypeError,batch.add_broadcast,'cmd_ptd_home',1)
+		batch.run(10)
+		self.assertEqual([self.visca.inq_cam_pan_tilt_pos(cam) for cam in (1,2,3)],[(100,0),(-50,10),(0,0)])
+
+	def test_camera_gone(self):
+		v=self.visca
+		self.sim.unplug()
+		time.sleep(0.2)
+		results=ViscaBatch(v).add(3,'inq_cam_power').add(2,'inq_cam_power').run(0.3)
+		self.assertEqual((results[2][0].status,results[3][0].status),(DONE,TIMEOUT))
+		deadline=time.time()+1
+		while v.pending.get(3) and time.time()<deadline:
+			time.sleep(0.01)
+		self.assertFalse(v.pending.get(3))
+
+	def test_only_broadcast_commands(self):
+		self.assertRaises(ViscaError,ViscaBatch(self.visca).add_broadcast,'cmd_ptd')
+
+
+class MotionTest(SimTestCase):
+
+	virtual=False
+	options={'pipeline':True}
+
+	def test_dead_camera_holds_up_only_itself(self):
+		v=self.visca
+		v.renumber()
+		v.renumber_on_change=False
+		self.sim.unplug()
+		time.sleep(0.2)
+		motion=ViscaMotion(v).start()
+		try:
+			motion.pan_tilt(3,5,0)
+			started=time.time()
+			motion.pan_tilt(2,5,0)
+			while not self.sim.camera(2).moving(self.sim.time()) and time.time()-started<2:
+				time.sleep(0.001)
+			self.assertTrue(time.time()-started<0.1)
+			self.assertTrue(motion.flush(2))
+			self.assertEqual(motion.timeouts,1+motion.retries)
+		finally:
+			motion.stop()
+
+	def test_failed_command_goes_again(self):
+		self.sim.inject_error(2,0x41)
+		motion=ViscaMotion(self.visca).start()
+		try:
+			motion.zoom(2,3)
+			self.assertTrue(motion.flush(2))
+			self.assertEqual((motion.sent,motion.retried),(2,1))
+			self.assertTrue(self.sim.camera(2).moving(self.sim.time()))
+			self.assertTrue('motion command cmd_cam_zoom_tele_speed for cam 2 failed' in self.output.getvalue())
+		finally:
+			motion.stop()
+
+	def test_newer_input_is_not_overtaken(self):
+		motion=ViscaMotion(self.visca)
+		key=(2,'zoom')
+		motion.busy.add(key)
+		motion.zoom(2,0)
+		failed=ViscaFuture()
+		failed.set_exception(ViscaNotExecutable('Command not executable',0x41,1))
+		motion._replied(key,'cmd_cam_zoom_tele_speed',(2,),failed)
+		self.assertEqual(motion.latest[key],('cmd_cam_zoom_stop',()))
+		self.assertEqual((list(motion.ready),motion.retried),([key],0))
+
+
+class BrokenTransport(SimTransport):
+	"""a port that starts failing every read once broken is set"""
+
+	broken=False
+
+	def read(self,size=1):
+		if self.broken:
+			raise IOError('device reports readiness to read but returned no data')
+		return SimTransport.read(self,size)
+
+
+class ReaderTest(TestCase):
+
+	def setUp(self):
+		self.transport=BrokenTransport(ViscaSimulator(2),timeout=0.1)
+		self.visca=Visca(self.transport)
+
+	def tearDown(self):
+		self.visca.close()
+
+	def test_failing_port_fails_what_waits(self):
+		self.assertEqual(self.visca.inq_cam_id(1),1)
+		self.transport.broken=True
+		future=self.visca.submit_packet(1,'\x09\x04\x22')
+		self.assertTrue(future.wait(2))
+		self.assertRaises(ViscaError,future.result)
+		self.assertFalse(isinstance(future.exception(),ViscaTimeout))
+		self.visca.reader.join(1)
+		self.assertFalse(self.visca.reader.is_alive())
+		self.assertTrue('reader thread stopped' in self.output.getvalue())
+
+	def test_close_is_quiet(self):
+		self.assertEqual(self.visca.inq_cam_id(1),1)
+		self.visca.close()
+		self.assertEqual(self.output.getvalue(),'')
+
+
+class ControllerTest(TestCase):
+
+	def setUp(self):
+		self.sim=ViscaSimulator(3,addressed=False)
+		self.server=ViscaPtyServer(self.sim).start()
+		self.controller=ViscaController().start()
+
+	def tearDown(self):
+		self.controller.close()
+		self.server.stop()
+
+	def test_detect_baudrate(self):
+		visca=self.controller.add_port('studio',self.server.port,baudrate='auto')
+		self.assertTrue(visca.baudrate in Visca.BAUDRATES)
+		self.assertEqual(self.controller.renumber()['studio'],{1:1,2:2,3:3})
+		self.assertEqual(self.controller.camera('studio/3').inq_cam_id(),3)
+
+	def test_readable_without_visca_data(self):
+		# the reply to the sequence number reset on open carries none
+		server=ViscaIPServer().start()
+		try:
+			self.controller.add_port('studio',self.server.port)
+			visca=self.controller.add_port('ip',server.url())
+			time.sleep(0.1)
+			# the loop is not stuck reading the port
+			started=time.time()
+			self.controller.port('studio').renumber()
+			self.assertTrue(time.time()-started<0.5)
+			handle=self.controller.camera('ip/1').cmd_cam_power_on()
+			self.assertEqual(visca.wait_for_cmd_completion(handle,1),'\x90\x51\xff')
+			self.assertEqual(self.controller.faults,{})
+		finally:
+			server.stop()
+
+	def test_end_of_file_is_a_fault(self):
+		listener=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		listener.bind(('127.0.0.1',0))
+		listener.listen(1)
+		try:
+			self.controller.add_port('tcp','tcp://127.0.0.1:%d' % listener.getsockname()[1])
+			peer,_=listener.accept()
+			peer.close()
+			deadline=time.time()+2
+			while 'tcp' not in self.controller.faults and time.time()<deadline:
+				time.sleep(0.01)
+			self.assertEqual(str(self.controller.faults.get('tcp')),'Port closed by the other end')
+		finally:
+			listener.close()
+
+
+class PresetsTest(SimTestCase):
+
+	options={'pipeline':True}
+
+	def setUp(self):
+		SimTestCase.setUp(self)
+		self.directory=tempfile.mkdtemp()
+		self.presets=ViscaPresets(os.path.join(self.directory,'presets.db'),slots=4)
+
+	def tearDown(self):
+		self.presets.close()
+		shutil.rmtree(self.directory)
+		SimTestCase.tearDown(self)
+
+	def test_capture_and_recall(self):
+		v=self.visca
+		self.complete(v.cmd_ptd_abs(1,pp=300,tp=-40),v.cmd_cam_zoom_direct(1,0x1234))
+		captured=self.presets.capture(v,[1,2],'stage')
+		self.assertEqual((captured[1].pan,captured[1].tilt,captured[1].zoom),(300,-40,0x1234))
+		self.complete(v.cmd_ptd_home(1),v.cmd_cam_zoom_direct(1,0))
+		for future in self.presets.recall(v,1,'stage'):
+			self.complete(future.result(5))
+		self.assertEqual(v.inq_cam_pan_tilt_pos(1),(300,-40))
+		self.assertEqual(v.inq_cam_zoom_pos(1),0x1234)
+
+	def test_recall_camera_gone(self):
+		v=self.visca
+		self.presets.save(3,'stage',100,10,0)
+		self.sim.unplug()
+		for future in self.presets.recall(v,3,'stage'):
+			self.assertRaises(ViscaTimeout,future.result,2)
+		self.assertFalse(v.pending.get(3))
+
+	def test_store_grows_and_reopens(self):
+		for number in range(10):
+			self.presets.save(1,'p%d' % number,number,-number,number)
+		self.presets.close()
+		self.presets=ViscaPresets(os.path.join(self.directory,'presets.db'))
+		self.assertEqual(len(self.presets),10)
+		self.assertEqual(self.presets.get(1,'p7').tilt,-7)
+
+
+if __name__=='__main__':
+	unittest.main()
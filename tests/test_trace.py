@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""ViscaTrace ring buffer and capture files"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyviscalib import trace
+from pyviscalib.trace import ViscaTrace, SENT, RECEIVED, read_capture, format_packet
+from pyviscalib.visca import Visca
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from tests import TestCase
+
+
+class TraceTest(TestCase):
+
+	def setUp(self):
+		self.directory=tempfile.mkdtemp()
+		self.filename=os.path.join(self.directory,'capture.vtrace')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_ring_keeps_the_last_packets(self):
+		ring=ViscaTrace(3)
+		for number in range(5):
+			ring.record(SENT,1,'\x81\x01\x04\x07'+chr(number)+'\xff')
+		self.assertEqual(len(ring),3)
+		self.assertEqual([packet[4] for timestamp,direction,camera,packet in ring.records()],['\x02','\x03','\x04'])
+		self.assertEqual(len(ring.records(4)),1)
+
+	def test_long_packets_are_truncated(self):
+		ring=ViscaTrace(2)
+		ring.record(RECEIVED,-1,'\x00'*40)
+		self.assertEqual(ring.records()[0][1:],(RECEIVED,-1,'\x00'*trace.MAXLEN))
+
+	def test_flush_and_read(self):
+		ring=ViscaTrace(4)
+		ring.record(SENT,2,'\x82\x09\x04\x22\xff')
+		ring.record(RECEIVED,2,'\xa0\x50\x00\x00\x00\x02\xff')
+		self.assertEqual(ring.flush(self.filename),2)
+		for number in range(6):
+			ring.record(SENT,1,'\x81\x09\x04\x00\xff')
+		# two of them were overwritten before this flush
+		self.assertEqual(ring.flush(self.filename),4)
+		self.assertEqual(ring.dropped,2)
+		records=list(read_capture(self.filename))
+		self.assertEqual(len(records),6)
+		self.assertEqual(records[1][1:],(RECEIVED,2,'\xa0\x50\x00\x00\x00\x02\xff'))
+
+	def test_not_a_capture(self):
+		with open(self.filename,'wb') as f:
+			f.write('something else')
+		self.assertRaises(ValueError,list,read_capture(self.filename))
+
+	def test_print_capture(self):
+		ring=ViscaTrace()
+		ring.record(SENT,1,'\x81\x01\x04\x07\x00\xff')
+		ring.flush(self.filename)
+		self.assertEqual(trace.main(['trace',self.filename]),0)
+		self.assertTrue('Command....: cmd_cam_zoom_stop' in self.output.getvalue())
+
+	def test_format_packet(self):
+		text=format_packet('\x90\x41\xff','recv')
+		self.assertTrue('packet (recv) [1 => 0]' in text)
+		self.assertTrue('ACK for socket 01' in text)
+
+	def test_visca_records_both_directions(self):
+		visca=Visca(SimTransport(ViscaSimulator(1,virtual=True),timeout=0.1))
+		try:
+			visca.inq_cam_id(1)
+		finally:
+			visca.close()
+		records=visca.trace.records()
+		self.assertEqual([record[1:] for record in records[-2:]],[(SENT,1,'\x81\x09\x04\x22\xff'),(RECEIVED,1,'\x90\x50\x00\x00\x00\x01\xff')])
+
+
+if __name__=='__main__':
+	unittest.main()
@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Trajectory planning, and TrajectoryPlayer against the simulator"""
+
+import time
+import unittest
+
+from pyviscalib.visca import Visca
+from pyviscalib.simulator import ViscaSimulator, SimTransport
+from pyviscalib.trajectory import Trajectory, TrajectoryPlayer, SPEED, WAYPOINTS, linear
+from tests import TestCase
+
+
+class TrajectoryTest(unittest.TestCase):
+
+	def test_first_keyframe_at_zero(self):
+		self.assertRaises(ValueError,Trajectory,[(1,0,0,0)])
+
+	def test_resolve_holds_axes(self):
+		trajectory=Trajectory([(0,None,None,None),(1,100,None,None),(2,None,50,0x1000)])
+		self.assertEqual(trajectory.resolve((10,20,30)),[(0,10,20,30),(1,100,20,30),(2,100,50,0x1000)])
+
+	def test_position(self):
+		trajectory=Trajectory([(0,0,0,0),(2,100,-40,0x2000)],ease=linear)
+		keyframes=trajectory.resolve((0,0,0))
+		self.assertEqual(trajectory.position(keyframes,1),(50,-20,0x1000))
+		self.assertEqual(trajectory.position(keyframes,5),(100,-40,0x2000))
+
+	def test_speed_plan(self):
+		trajectory=Trajectory([(0,0,0,0),(1,200,-60,0x1000)],rate=10)
+		plan=trajectory.plan_speeds((0,0,0))
+		self.assertEqual(len(plan),11)
+		self.assertEqual(plan[-1],(1,0,0,0,(200,-60,0x1000)))
+		for t,pan,tilt,zoom,reached in plan:
+			self.assertTrue(0<=pan<=0x18 and -0x17<=tilt<=0 and 0<=zoom<=8)
+		# the quantized speeds get about there
+		self.assertTrue(abs(plan[-2][4][0]-200)<Trajectory.pan_rate)
+
+	def test_waypoint_plan(self):
+		trajectory=Trajectory([(0,0,0,0),(1,200,-60,0x1000)],rate=4)
+		plan=trajectory.plan_waypoints((0,0,0))
+		self.assertEqual([step[0] for step in plan],[0,0.25,0.5,0.75])
+		self.assertEqual(plan[-1][1:4],(200,-60,0x1000))
+
+
+class PlayerTest(TestCase):
+
+	def setUp(self):
+		self.sim=ViscaSimulator(2)
+		self.visca=Visca(SimTransport(self.sim,timeout=0.1),pipeline=True)
+
+	def tearDown(self):
+		self.visca.close()
+
+	def wait_position(self,device,position,timeout=3):
+		v=self.visca
+		deadline=time.time()+timeout
+		while True:
+			current=v.inq_cam_pan_tilt_pos(device)+(v.inq_cam_zoom_pos(device),)
+			if current==position or time.time()>deadline:
+				return current
+			time.sleep(0.05)
+
+	def play(self,mode):
+		trajectory=Trajectory([(0,None,None,None),(0.5,120,-30,0x800)],rate=10)
+		player=TrajectoryPlayer(self.visca,1,trajectory,mode)
+		player.run()
+		self.assertEqual(self.wait_position(1,(120,-30,0x800)),(120,-30,0x800))
+		return player
+
+	def test_speed(self):
+		self.play(SPEED)
+
+	def test_waypoints(self):
+		self.play(WAYPOINTS)
+
+	def test_camera_gone(self):
+		v=self.visca
+		player=TrajectoryPlayer(v,2,Trajectory([(0,0,0,0),(0.3,50,0,0)]))
+		player.prepare()
+		self.sim.unplug()
+		time.sleep(0.2)
+		player.run()
+		deadline=time.time()+2
+		while v.pending.get(2) and time.time()<deadline:
+			time.sleep(0.05)
+		self.assertFalse(v.pending.get(2))
+		self.assertTrue(v.counters['timeouts']>0)
+
+
+if __name__=='__main__':
+	unittest.main()
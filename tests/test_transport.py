@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    PyVisca - Implementation of the Visca serial protocol in python
+#    Copyright (C) 2013  Florian Streibelt pyvisca@f-streibelt.de
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 2 only.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+"""Transports: VISCA over IP against ViscaIPServer, raw TCP"""
+
+import socket
+import unittest
+
+from pyviscalib.visca import Visca, ViscaSyntaxError
+from pyviscalib.transport import open_transport, TCPTransport, UDPTransport, ViscaIPServer
+from tests import TestCase
+
+
+class UDPTest(TestCase):
+
+	def setUp(self):
+		self.received=[]
+		self.server=ViscaIPServer(self.handler).start()
+		self.visca=Visca(UDPTransport(*self.server.address,timeout=0.1))
+
+	def tearDown(self):
+		self.visca.close()
+		self.server.stop()
+
+	def handler(self,packet):
+		self.received.append(packet)
+		if packet=='\x81\x09\x04\x00\xff':
+			if self.received.count(packet)==1:
+				# lost on the way
+				return []
+			return ['\x90\x50\x02\xff']
+		return self.server.default_handler(packet)
+
+	def test_open_transport(self):
+		transport=open_transport(self.server.url())
+		self.assertTrue(isinstance(transport,UDPTransport))
+		self.assertEqual(transport.address,self.server.address)
+		transport.close()
+
+	def test_command(self):
+		handle=self.visca.cmd_cam_power_on(1)
+		self.assertEqual(self.visca.wait_for_cmd_completion(handle,2),'\x90\x51\xff')
+
+	def test_error_reply(self):
+		self.assertRaises(ViscaSyntaxError,self.visca.inq_cam_zoom_pos,1)
+
+	def test_lost_datagram_is_resent_once(self):
+		self.assertEqual(self.visca.inq_cam_power(1),2)
+		self.assertEqual(self.received.count('\x81\x09\x04\x00\xff'),2)
+		self.assertEqual(self.visca.counters['retries'],1)
+
+
+class TCPTest(TestCase):
+
+	def setUp(self):
+		self.listener=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.listener.bind(('127.0.0.1',0))
+		self.listener.listen(1)
+		self.transport=open_transport('tcp://127.0.0.1:%d' % self.listener.getsockname()[1],timeout=1)
+		self.peer,_=self.listener.accept()
+
+	def tearDown(self):
+		self.transport.close()
+		self.peer.close()
+		self.listener.close()
+
+	def test_open_transport(self):
+		self.assertTrue(isinstance(self.transport,TCPTransport))
+		self.assertRaises(ValueError,open_transport,'tcp://127.0.0.1')
+
+	def test_read_write(self):
+		self.transport.write('\x81\x09\x04\x00\xff')
+		self.assertEqual(self.peer.recv(16),'\x81\x09\x04\x00\xff')
+		self.peer.sendall('\x90\x50\x02\xff')
+		self.assertEqual(self.transport.read(1),'\x90')
+		self.assertEqual(self.transport.inWaiting(),3)
+		self.assertEqual(self.transport.read(3),'\x50\x02\xff')
+
+	def test_read_times_out(self):
+		self.transport.timeout=0.05
+		self.assertEqual(self.transport.read(4),'')
+		self.assertTrue(self.transport.isOpen())
+
+	def test_end_of_file_closes(self):
+		self.peer.close()
+		self.assertEqual(self.transport.read(4),'')
+		self.assertFalse(self.transport.isOpen())
+
+
+if __name__=='__main__':
+	unittest.main()